@@ -8,6 +8,8 @@ import numpy as np
 from typing import Tuple, Optional
 import logging
 
+import indicator_library
+
 logger = logging.getLogger(__name__)
 
 
@@ -55,33 +57,7 @@ def calculate_adx(df: pd.DataFrame, period: int = 14) -> Tuple[pd.Series, pd.Ser
     Returns:
         Tuple (ADX, +DI, -DI)
     """
-    # Calculate True Range
-    high_low = df['High'] - df['Low']
-    high_close = abs(df['High'] - df['Close'].shift())
-    low_close = abs(df['Low'] - df['Close'].shift())
-    
-    tr = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-    atr = tr.rolling(window=period).mean()
-    
-    # Calculate Directional Movement
-    up_move = df['High'] - df['High'].shift()
-    down_move = df['Low'].shift() - df['Low']
-    
-    plus_dm = pd.Series(0, index=df.index)
-    minus_dm = pd.Series(0, index=df.index)
-    
-    plus_dm[(up_move > down_move) & (up_move > 0)] = up_move
-    minus_dm[(down_move > up_move) & (down_move > 0)] = down_move
-    
-    # Calculate Directional Indicators
-    plus_di = 100 * (plus_dm.rolling(window=period).mean() / atr)
-    minus_di = 100 * (minus_dm.rolling(window=period).mean() / atr)
-    
-    # Calculate ADX
-    dx = 100 * abs(plus_di - minus_di) / (plus_di + minus_di)
-    adx = dx.rolling(window=period).mean()
-    
-    return adx, plus_di, minus_di
+    return indicator_library.adx(df['High'], df['Low'], df['Close'], period)
 
 
 def calculate_supertrend(df: pd.DataFrame, period: int = 10, multiplier: float = 3) -> Tuple[pd.Series, pd.Series]:
@@ -104,22 +80,23 @@ def calculate_supertrend(df: pd.DataFrame, period: int = 10, multiplier: float =
     upper_band = hl_avg + (multiplier * atr)
     lower_band = hl_avg - (multiplier * atr)
     
-    # Initialize supertrend
-    supertrend = pd.Series(index=df.index, dtype=float)
-    direction = pd.Series(1, index=df.index)  # 1 = uptrend, -1 = downtrend
+    close = df['Close'].to_numpy(dtype=float)
+    upper = upper_band.to_numpy(dtype=float)
+    lower = lower_band.to_numpy(dtype=float)
     
-    for i in range(period, len(df)):
-        if df['Close'].iloc[i] > upper_band.iloc[i-1]:
-            direction.iloc[i] = 1
-        elif df['Close'].iloc[i] < lower_band.iloc[i-1]:
-            direction.iloc[i] = -1
-        else:
-            direction.iloc[i] = direction.iloc[i-1]
-        
-        if direction.iloc[i] == 1:
-            supertrend.iloc[i] = lower_band.iloc[i]
-        else:
-            supertrend.iloc[i] = upper_band.iloc[i]
+    # Direction changes when close breaks the previous bar's band, otherwise it
+    # carries forward: mark the breakout bars and forward-fill between them.
+    # The first `period` bars keep the initial uptrend (1).
+    prev_upper = np.roll(upper, 1)
+    prev_lower = np.roll(lower, 1)
+    signal = np.where(close > prev_upper, 1.0, np.where(close < prev_lower, -1.0, np.nan))
+    signal[:period] = 1.0
+    direction = pd.Series(signal, index=df.index).ffill().astype('int64')
+    
+    # Supertrend = lower band in uptrend, upper band in downtrend
+    values = np.where(direction.to_numpy() == 1, lower, upper)
+    values[:period] = np.nan
+    supertrend = pd.Series(values, index=df.index, dtype=float)
     
     return supertrend, direction
 
@@ -136,40 +113,48 @@ def calculate_parabolic_sar(df: pd.DataFrame, af_start: float = 0.02, af_max: fl
     Returns:
         Series chứa giá trị SAR
     """
-    sar = pd.Series(index=df.index, dtype=float)
-    trend = pd.Series(1, index=df.index)  # 1 = uptrend, -1 = downtrend
+    # SAR is path-dependent, so walk plain float lists instead of .iloc on every bar
+    high = df['High'].to_numpy(dtype=float).tolist()
+    low = df['Low'].to_numpy(dtype=float).tolist()
+    n = len(high)
+    sar = [np.nan] * n
+    
+    if n == 0:
+        return pd.Series(sar, index=df.index, dtype=float)
+    
+    uptrend = True
     af = af_start
-    ep = df['High'].iloc[0]  # Extreme Point
+    ep = high[0]  # Extreme Point
     
-    sar.iloc[0] = df['Low'].iloc[0]
+    sar[0] = low[0]
     
-    for i in range(1, len(df)):
-        if trend.iloc[i-1] == 1:  # Uptrend
-            sar.iloc[i] = sar.iloc[i-1] + af * (ep - sar.iloc[i-1])
+    for i in range(1, n):
+        if uptrend:
+            value = sar[i-1] + af * (ep - sar[i-1])
             
-            if df['Low'].iloc[i] < sar.iloc[i]:
-                trend.iloc[i] = -1
-                sar.iloc[i] = ep
-                ep = df['Low'].iloc[i]
+            if low[i] < value:
+                uptrend = False
+                value = ep
+                ep = low[i]
                 af = af_start
-            else:
-                trend.iloc[i] = 1
-                if df['High'].iloc[i] > ep:
-                    ep = df['High'].iloc[i]
-                    af = min(af + af_start, af_max)
-        else:  # Downtrend
-            sar.iloc[i] = sar.iloc[i-1] - af * (sar.iloc[i-1] - ep)
+            elif high[i] > ep:
+                ep = high[i]
+                af = min(af + af_start, af_max)
+        else:
+            value = sar[i-1] - af * (sar[i-1] - ep)
             
-            if df['High'].iloc[i] > sar.iloc[i]:
-                trend.iloc[i] = 1
-                sar.iloc[i] = ep
-                ep = df['High'].iloc[i]
+            if high[i] > value:
+                uptrend = True
+                value = ep
+                ep = high[i]
                 af = af_start
-            else:
-                trend.iloc[i] = -1
-                if df['Low'].iloc[i] < ep:
-                    ep = df['Low'].iloc[i]
-                    af = min(af + af_start, af_max)
+            elif low[i] < ep:
+                ep = low[i]
+                af = min(af + af_start, af_max)
+        
+        sar[i] = value
+    
+    sar = pd.Series(sar, index=df.index, dtype=float)
     
     return sar
 
@@ -188,16 +173,7 @@ def calculate_stochastic(df: pd.DataFrame, k_period: int = 14, d_period: int = 3
     Returns:
         Tuple (%K, %D)
     """
-    # Calculate %K
-    low_min = df['Low'].rolling(window=k_period).min()
-    high_max = df['High'].rolling(window=k_period).max()
-    
-    k_percent = 100 * ((df['Close'] - low_min) / (high_max - low_min))
-    
-    # Calculate %D (moving average of %K)
-    d_percent = k_percent.rolling(window=d_period).mean()
-    
-    return k_percent, d_percent
+    return indicator_library.stochastic(df['High'], df['Low'], df['Close'], k_period, d_period)
 
 
 def calculate_williams_r(df: pd.DataFrame, period: int = 14) -> pd.Series:
@@ -325,14 +301,7 @@ def calculate_atr(df: pd.DataFrame, period: int = 14) -> pd.Series:
     Returns:
         Series chứa giá trị ATR
     """
-    high_low = df['High'] - df['Low']
-    high_close = abs(df['High'] - df['Close'].shift())
-    low_close = abs(df['Low'] - df['Close'].shift())
-    
-    tr = pd.concat([high_low, high_close, low_close], axis=1).max(axis=1)
-    atr = tr.rolling(window=period).mean()
-    
-    return atr
+    return indicator_library.atr(df['High'], df['Low'], df['Close'], period)
 
 
 def calculate_keltner_channels(df: pd.DataFrame, ema_period: int = 20, atr_period: int = 10, multiplier: float = 2) -> Tuple[pd.Series, pd.Series, pd.Series]:
@@ -349,7 +318,7 @@ def calculate_keltner_channels(df: pd.DataFrame, ema_period: int = 20, atr_perio
         Tuple (Upper Band, Middle Line, Lower Band)
     """
     # Middle Line (EMA)
-    middle = df['Close'].ewm(span=ema_period, adjust=False).mean()
+    middle = indicator_library.ema(df['Close'], ema_period)
     
     # ATR
     atr = calculate_atr(df, atr_period)
@@ -0,0 +1,93 @@
+"""
+API Concurrency - VNStock Blocking Work Dispatch
+Chạy phần việc blocking của endpoint (vnstock I/O, pandas, SQLite, vẽ chart)
+trên worker thread thay vì trong event loop, mỗi nhóm endpoint có giới hạn số
+request xử lý đồng thời riêng. Một lượt quét thị trường chậm chỉ chiếm slot
+của nhóm "scan", không làm /health hay các request nhẹ phải chờ.
+
+Giới hạn đọc từ bảng settings (api_concurrency_<nhóm>) khi dùng lần đầu.
+"""
+
+import functools
+import threading
+from typing import Any, Callable, Dict
+import logging
+
+import anyio
+import anyio.to_thread
+
+logger = logging.getLogger(__name__)
+
+# Nhóm endpoint -> số request xử lý đồng thời mặc định
+ENDPOINT_CLASSES: Dict[str, int] = {
+    'local': 16,   # Đọc dữ liệu cục bộ (SQLite, cache, job status)
+    'stock': 8,    # Dữ liệu / FA / TA một mã (có thể gọi vnstock)
+    'chart': 2,    # Vẽ biểu đồ (CPU, matplotlib/plotly)
+    'scan': 2,     # Quét nhiều mã (screener, classify, bluechip, backtest)
+}
+
+# Setting (bảng settings) để chỉnh giới hạn, VD: api_concurrency_scan = 4
+SETTING_PREFIX = 'api_concurrency_'
+
+_limiters: Dict[str, anyio.CapacityLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def _configured_limit(endpoint_class: str) -> int:
+    """Giới hạn của nhóm: bảng settings, nếu không có thì mặc định"""
+    default = ENDPOINT_CLASSES[endpoint_class]
+    try:
+        from database import get_db
+        return max(1, int(get_db().get_setting(f"{SETTING_PREFIX}{endpoint_class}", default)))
+    except Exception as e:
+        logger.warning(f"Không đọc được {SETTING_PREFIX}{endpoint_class}, dùng mặc định: {e}")
+        return default
+
+
+def get_limiter(endpoint_class: str) -> anyio.CapacityLimiter:
+    """
+    CapacityLimiter của nhóm endpoint (tạo lần đầu trong event loop)
+
+    Raises:
+        ValueError: Nhóm không tồn tại
+    """
+    if endpoint_class not in ENDPOINT_CLASSES:
+        raise ValueError(f"Nhóm endpoint không hỗ trợ: {endpoint_class}")
+
+    limiter = _limiters.get(endpoint_class)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(endpoint_class)
+            if limiter is None:
+                limiter = anyio.CapacityLimiter(_configured_limit(endpoint_class))
+                _limiters[endpoint_class] = limiter
+                logger.info(f"API concurrency '{endpoint_class}': {limiter.total_tokens}")
+    return limiter
+
+
+async def run_blocking(endpoint_class: str, func: Callable[..., Any], *args, **kwargs) -> Any:
+    """
+    Chạy func(*args, **kwargs) trên worker thread trong giới hạn của nhóm
+
+    Request vượt giới hạn chờ slot (không chiếm event loop).
+
+    Args:
+        endpoint_class: Nhóm endpoint (local, stock, chart, scan)
+        func: Hàm blocking
+    """
+    return await anyio.to_thread.run_sync(functools.partial(func, *args, **kwargs),
+                                          limiter=get_limiter(endpoint_class))
+
+
+def limiter_stats() -> Dict[str, Dict[str, int]]:
+    """Số slot, đang dùng và đang chờ của từng nhóm (gọi trong event loop)"""
+    stats = {}
+    for endpoint_class in ENDPOINT_CLASSES:
+        limiter = get_limiter(endpoint_class)
+        statistics = limiter.statistics()
+        stats[endpoint_class] = {
+            'limit': int(limiter.total_tokens),
+            'in_use': statistics.borrowed_tokens,
+            'waiting': statistics.tasks_waiting
+        }
+    return stats
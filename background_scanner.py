@@ -10,6 +10,10 @@ import time
 from datetime import datetime
 from stock_classifier import StockClassifier
 from database import get_db
+from data_store import get_price_history
+from scan_engine import run_scan
+from streaming_indicators import refresh_market_indicators
+from screener_query import refresh_technical_metrics
 import logging
 
 # Configure logging
@@ -42,24 +46,20 @@ def daily_full_scan():
         # Scan all exchanges
         logger.info("📊 Scanning HOSE and HNX markets...")
         
+        # Upstream calls are metered by rate_limiter - no fixed delay needed
         results = classifier.scan_and_classify_market(
             exchanges=['HOSE', 'HNX'],
             limit=500,  # Scan all stocks
-            delay=10.0,  # Safe delay to avoid rate limits
-            use_cache=False,  # Force fresh scan
-            save_cache=True  # Auto-save to cache
+            use_cache=False  # Force fresh scan (auto-saved to cache)
         )
         
-        # Summary statistics
-        successful = len([r for r in results if not r.get('error')])
-        failed = len([r for r in results if r.get('error')])
+        # Summary statistics (DataFrame only contains classified stocks)
+        total = len(classifier.get_all_stocks(exchanges=['HOSE', 'HNX'])[:500])
+        successful = len(results)
+        failed = total - successful
         
         # Rating distribution
-        ratings = {}
-        for stock in results:
-            if not stock.get('error'):
-                rating = stock.get('overall_rating', {}).get('rating', 'Unknown')
-                ratings[rating] = ratings.get(rating, 0) + 1
+        ratings = results['overall_rating'].value_counts().to_dict() if not results.empty else {}
         
         end_time = datetime.now()
         duration = (end_time - start_time).total_seconds()
@@ -67,7 +67,7 @@ def daily_full_scan():
         logger.info("=" * 80)
         logger.info("✅ Nightly scan complete!")
         logger.info(f"⏱️  Duration: {duration:.1f} seconds ({duration/60:.1f} minutes)")
-        logger.info(f"📈 Total stocks: {len(results)}")
+        logger.info(f"📈 Total stocks: {total}")
         logger.info(f"✅ Successful: {successful}")
         logger.info(f"❌ Failed: {failed}")
         logger.info(f"📊 Rating distribution: {ratings}")
@@ -117,8 +117,6 @@ def incremental_scan():
                 if not result.get('error'):
                     updated += 1
                 
-                time.sleep(8)  # Rate limit safe
-                
             except Exception as e:
                 logger.error(f"Error refreshing {symbol}: {e}")
         
@@ -130,6 +128,76 @@ def incremental_scan():
         return False
 
 
+def end_of_day_indicators():
+    """
+    Cập nhật nến ngày và chỉ báo kỹ thuật cho các mã trong price store
+    Chạy lúc 15:30 sau khi thị trường đóng cửa - mỗi mã chỉ tải phiên mới
+    rồi cập nhật chỉ báo O(1), không tính lại cả năm dữ liệu
+    """
+    logger.info("📈 Starting end-of-day indicator refresh...")
+    
+    try:
+        db = get_db()
+        symbols = db.get_price_history_symbols()
+        
+        if not symbols:
+            logger.info("✅ Price store is empty. Nothing to refresh.")
+            return True
+        
+        # Tải phiên mới nhất (qua rate limiter)
+        outcomes = run_scan(symbols, lambda symbol: get_price_history(symbol, days=5))
+        failed = [o['symbol'] for o in outcomes if o['error']]
+        if failed:
+            logger.warning(f"Could not update bars for {len(failed)} stocks: {', '.join(failed[:10])}")
+        
+        results = refresh_market_indicators(symbols)
+        logger.info(f"✅ Indicators refreshed: {len(results)}/{len(symbols)} stocks")
+        
+        # Chỉ số kỹ thuật mới nhất cho screener query (một lượt panel toàn thị trường)
+        updated = refresh_technical_metrics(symbols)
+        logger.info(f"✅ Screener metrics refreshed: {updated} stocks")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Error during indicator refresh: {e}")
+        return False
+
+
+def compact_history():
+    """
+    Dọn lịch sử phân loại (giữ theo ngày 90 ngày, theo tuần đến 2 năm)
+    Chạy lúc 03:30 sau lượt scan đêm
+    """
+    try:
+        stats = get_db().compact_classification_history()
+        logger.info(f"🗜️ Classification history compacted: {stats}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Error compacting classification history: {e}")
+        return False
+
+
+def retry_rate_limited():
+    """
+    Thử lại các mã bị rate limit trong lần scan trước
+    Chạy mỗi 10 phút, chỉ xử lý các mã đã hết thời gian backoff
+    """
+    try:
+        db = get_db()
+        if not db.get_due_retries(limit=1):
+            return True
+        
+        classifier = StockClassifier()
+        stats = classifier.process_retry_queue(limit=50)
+        logger.info(f"🔁 Retry queue drained: {stats}")
+        return True
+        
+    except Exception as e:
+        logger.error(f"❌ Error draining retry queue: {e}")
+        return False
+
+
 def main():
     """Main scheduler loop"""
     logger.info("🚀 VNStock Background Scanner started")
@@ -144,6 +212,18 @@ def main():
     schedule.every(4).hours.do(incremental_scan)
     logger.info("📅 Scheduled: Incremental scan every 4 hours")
     
+    # End-of-day bars and streaming indicators at 15:30
+    schedule.every().day.at("15:30").do(end_of_day_indicators)
+    logger.info("📅 Scheduled: End-of-day indicator refresh at 15:30")
+    
+    # Classification history retention at 3:30 AM
+    schedule.every().day.at("03:30").do(compact_history)
+    logger.info("📅 Scheduled: Classification history compaction at 03:30 AM")
+    
+    # Retry rate-limited stocks every 10 minutes
+    schedule.every(10).minutes.do(retry_rate_limited)
+    logger.info("📅 Scheduled: Rate-limit retry queue every 10 minutes")
+    
     # Run once at startup (optional - comment out if not needed)
     # logger.info("🔄 Running initial scan...")
     # incremental_scan()
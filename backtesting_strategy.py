@@ -26,13 +26,10 @@ def get_historical_data_for_backtest(symbol: str, period_days: int = 1095) -> pd
         DataFrame với cột OHLCV phù hợp cho backtesting
     """
     try:
-        from vnstock import Vnstock
+        from data_store import get_price_history
         
         logger.info(f"Lấy dữ liệu OHLCV cho backtesting mã {symbol}")
         
-        # Khởi tạo vnstock client
-        stock = Vnstock().stock(symbol=symbol, source='VCI')
-        
         # Tính toán khoảng thời gian
         end_date = datetime.now().strftime("%Y-%m-%d")
         start_date = (datetime.now() - timedelta(days=period_days)).strftime("%Y-%m-%d")
@@ -40,7 +37,7 @@ def get_historical_data_for_backtest(symbol: str, period_days: int = 1095) -> pd
         logger.info(f"Lấy dữ liệu từ {start_date} đến {end_date}")
         
         # Lấy dữ liệu OHLCV
-        df = stock.quote.history(start=start_date, end=end_date)
+        df = get_price_history(symbol, start_date=start_date, end_date=end_date)
         
         if df.empty:
             logger.warning(f"Không có dữ liệu cho mã {symbol}")
@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+"""
+Benchmark Supertrend / Parabolic SAR - VNStock
+So sánh bản tính theo mảng (advanced_indicators) với bản cũ duyệt .iloc
+từng phiên trên dữ liệu giả lập nhiều năm cho nhiều mã.
+
+Usage:
+    python benchmark_indicators.py [SYMBOLS] [YEARS] [LEGACY_SYMBOLS]
+
+Example:
+    python benchmark_indicators.py 300 12 10
+
+Bản cũ rất chậm nên chỉ chạy trên LEGACY_SYMBOLS mã đầu tiên (kiểm tra kết quả
+giống nhau) rồi quy đổi thời gian cho toàn bộ SYMBOLS mã.
+"""
+
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from advanced_indicators import calculate_atr, calculate_parabolic_sar, calculate_supertrend
+
+TRADING_DAYS_PER_YEAR = 250
+
+
+def legacy_supertrend(df: pd.DataFrame, period: int = 10, multiplier: float = 3):
+    """Supertrend bản cũ (duyệt .iloc từng phiên)"""
+    atr = calculate_atr(df, period)
+    hl_avg = (df['High'] + df['Low']) / 2
+    upper_band = hl_avg + (multiplier * atr)
+    lower_band = hl_avg - (multiplier * atr)
+
+    supertrend = pd.Series(index=df.index, dtype=float)
+    direction = pd.Series(1, index=df.index)
+
+    for i in range(period, len(df)):
+        if df['Close'].iloc[i] > upper_band.iloc[i-1]:
+            direction.iloc[i] = 1
+        elif df['Close'].iloc[i] < lower_band.iloc[i-1]:
+            direction.iloc[i] = -1
+        else:
+            direction.iloc[i] = direction.iloc[i-1]
+
+        if direction.iloc[i] == 1:
+            supertrend.iloc[i] = lower_band.iloc[i]
+        else:
+            supertrend.iloc[i] = upper_band.iloc[i]
+
+    return supertrend, direction
+
+
+def legacy_parabolic_sar(df: pd.DataFrame, af_start: float = 0.02, af_max: float = 0.2):
+    """Parabolic SAR bản cũ (duyệt .iloc từng phiên)"""
+    sar = pd.Series(index=df.index, dtype=float)
+    trend = pd.Series(1, index=df.index)
+    af = af_start
+    ep = df['High'].iloc[0]
+
+    sar.iloc[0] = df['Low'].iloc[0]
+
+    for i in range(1, len(df)):
+        if trend.iloc[i-1] == 1:
+            sar.iloc[i] = sar.iloc[i-1] + af * (ep - sar.iloc[i-1])
+
+            if df['Low'].iloc[i] < sar.iloc[i]:
+                trend.iloc[i] = -1
+                sar.iloc[i] = ep
+                ep = df['Low'].iloc[i]
+                af = af_start
+            else:
+                trend.iloc[i] = 1
+                if df['High'].iloc[i] > ep:
+                    ep = df['High'].iloc[i]
+                    af = min(af + af_start, af_max)
+        else:
+            sar.iloc[i] = sar.iloc[i-1] - af * (sar.iloc[i-1] - ep)
+
+            if df['High'].iloc[i] > sar.iloc[i]:
+                trend.iloc[i] = 1
+                sar.iloc[i] = ep
+                ep = df['High'].iloc[i]
+                af = af_start
+            else:
+                trend.iloc[i] = -1
+                if df['Low'].iloc[i] < ep:
+                    ep = df['Low'].iloc[i]
+                    af = min(af + af_start, af_max)
+
+    return sar
+
+
+def make_ohlc(bars: int, seed: int) -> pd.DataFrame:
+    """Tạo dữ liệu OHLC giả lập (random walk, giá nghìn đồng)"""
+    rng = np.random.default_rng(seed)
+    close = 25 * np.exp(np.cumsum(rng.normal(0, 0.02, bars)))
+    spread = close * rng.uniform(0.005, 0.03, bars)
+    dates = pd.bdate_range(end=pd.Timestamp.today().normalize(), periods=bars)
+    return pd.DataFrame({
+        'Open': close + rng.uniform(-0.5, 0.5, bars) * spread,
+        'High': close + spread,
+        'Low': close - spread,
+        'Close': close,
+    }, index=dates)
+
+
+def timed(func, frames):
+    """Chạy func trên từng frame, trả về (kết quả, tổng thời gian)"""
+    started = time.perf_counter()
+    results = [func(df) for df in frames]
+    return results, time.perf_counter() - started
+
+
+def main():
+    symbols = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+    years = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    legacy_symbols = min(symbols, int(sys.argv[3]) if len(sys.argv) > 3 else 10)
+    bars = years * TRADING_DAYS_PER_YEAR
+
+    print(f"\n📊 Benchmark: {symbols} mã × {bars} phiên ({years} năm)")
+    print(f"   Bản cũ chạy trên {legacy_symbols} mã rồi quy đổi\n")
+
+    frames = [make_ohlc(bars, seed) for seed in range(symbols)]
+    legacy_frames = frames[:legacy_symbols]
+
+    cases = [
+        ('Supertrend', calculate_supertrend, legacy_supertrend),
+        ('Parabolic SAR', calculate_parabolic_sar, legacy_parabolic_sar),
+    ]
+
+    print(f"{'Indicator':<16} {'Mới (tổng)':>12} {'Cũ (quy đổi)':>14} {'Nhanh hơn':>10}  Kết quả")
+    print("-" * 70)
+
+    for name, new_func, legacy_func in cases:
+        new_results, new_time = timed(new_func, frames)
+        legacy_results, legacy_time = timed(legacy_func, legacy_frames)
+
+        # Kết quả phải giống bản cũ
+        for new, old in zip(new_results, legacy_results):
+            new_parts = new if isinstance(new, tuple) else (new,)
+            old_parts = old if isinstance(old, tuple) else (old,)
+            for new_part, old_part in zip(new_parts, old_parts):
+                pd.testing.assert_series_equal(new_part, old_part)
+
+        legacy_total = legacy_time / legacy_symbols * symbols
+        print(f"{name:<16} {new_time:>11.2f}s {legacy_total:>13.1f}s {legacy_total / new_time:>9.0f}x  ✅ giống nhau")
+
+    print()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,11 +5,13 @@ Tự động phát hiện và theo dõi cổ phiếu blue-chip Việt Nam
 """
 
 from vnstock import Vnstock
-import pandas as pd
-from datetime import datetime, timedelta
-from typing import List, Dict
+from datetime import datetime
+from typing import Callable, List, Dict, Optional
 import logging
 from database import get_db
+from data_store import get_financial_statement, get_price_history
+from rate_limiter import get_rate_limiter
+from scan_engine import DEFAULT_MAX_WORKERS, run_scan
 
 logger = logging.getLogger(__name__)
 
@@ -46,6 +48,7 @@ class BlueChipDetector:
         try:
             stock = Vnstock()
             # Lấy danh sách HOSE
+            get_rate_limiter().acquire()
             listing = stock.listing.all_symbols()
             hose_stocks = listing[listing['exchange'] == 'HOSE']['ticker'].tolist()
             logger.info(f"Found {len(hose_stocks)} HOSE stocks")
@@ -57,12 +60,8 @@ class BlueChipDetector:
     def calculate_market_cap(self, symbol: str) -> float:
         """Tính vốn hóa thị trường (ước tính)"""
         try:
-            stock = Vnstock().stock(symbol=symbol, source='VCI')
-            
             # Get current price
-            end_date = datetime.now().strftime("%Y-%m-%d")
-            start_date = (datetime.now() - timedelta(days=5)).strftime("%Y-%m-%d")
-            df = stock.quote.history(start=start_date, end=end_date)
+            df = get_price_history(symbol, days=5)
             
             if df.empty:
                 return 0
@@ -70,7 +69,7 @@ class BlueChipDetector:
             current_price = df['close'].iloc[-1] * 1000  # VND
             
             # Get shares outstanding from balance sheet
-            balance_sheet = stock.finance.balance_sheet(period='quarter', lang='en')
+            balance_sheet = get_financial_statement(symbol, 'balance_sheet', period='quarter', lang='en')
             
             if not balance_sheet.empty:
                 # Estimate market cap from equity (rough estimate)
@@ -89,11 +88,7 @@ class BlueChipDetector:
     def calculate_volatility(self, symbol: str, days: int = 365) -> float:
         """Tính độ biến động giá (% change trong khoảng thời gian)"""
         try:
-            stock = Vnstock().stock(symbol=symbol, source='VCI')
-            end_date = datetime.now().strftime("%Y-%m-%d")
-            start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
-            
-            df = stock.quote.history(start=start_date, end=end_date)
+            df = get_price_history(symbol, days=days)
             
             if df.empty or len(df) < 10:
                 return 100  # High volatility if not enough data
@@ -111,11 +106,7 @@ class BlueChipDetector:
     def get_average_volume(self, symbol: str, days: int = 30) -> float:
         """Tính volume trung bình"""
         try:
-            stock = Vnstock().stock(symbol=symbol, source='VCI')
-            end_date = datetime.now().strftime("%Y-%m-%d")
-            start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
-            
-            df = stock.quote.history(start=start_date, end=end_date)
+            df = get_price_history(symbol, days=days)
             
             if df.empty:
                 return 0
@@ -209,13 +200,17 @@ class BlueChipDetector:
                 'error': str(e)
             }
     
-    def scan_bluechips(self, symbols: List[str] = None, min_score: int = 4) -> List[Dict]:
+    def scan_bluechips(self, symbols: List[str] = None, min_score: int = 4,
+                       max_workers: int = DEFAULT_MAX_WORKERS,
+                       progress_callback: Optional[Callable] = None) -> List[Dict]:
         """
         Quét tìm blue-chips từ danh sách
         
         Args:
             symbols: Danh sách mã cần quét (None = VN30)
             min_score: Điểm tối thiểu để được coi là blue-chip (default 4/6)
+            max_workers: Số mã kiểm tra song song
+            progress_callback: Gọi sau mỗi mã hoàn thành: (completed, total, outcome)
         
         Returns:
             List of blue-chip stocks with details
@@ -227,16 +222,22 @@ class BlueChipDetector:
         
         print(f"\n🔍 Scanning {len(symbols)} stocks for blue-chips...\n")
         
-        for i, symbol in enumerate(symbols, 1):
-            print(f"[{i}/{len(symbols)}] Checking {symbol}...", end=' ')
-            
-            result = self.check_bluechip_criteria(symbol)
-            
-            if result['is_bluechip'] and result.get('score', 0) >= min_score:
+        def print_progress(completed: int, total: int, outcome: Dict):
+            result = outcome['result'] or {}
+            status = (f"✅ BLUE-CHIP! (Score: {result['score']}/{result['max_score']})"
+                      if result.get('is_bluechip') and result.get('score', 0) >= min_score
+                      else f"❌ Not qualified (Score: {result.get('score', 0)}/{result.get('max_score', 6)})")
+            print(f"[{completed}/{total}] {outcome['symbol']}: {status}")
+            if progress_callback:
+                progress_callback(completed, total, outcome)
+        
+        outcomes = run_scan(symbols, self.check_bluechip_criteria, max_workers=max_workers,
+                            progress_callback=print_progress)
+        
+        for outcome in outcomes:
+            result = outcome['result']
+            if result and result['is_bluechip'] and result.get('score', 0) >= min_score:
                 bluechips.append(result)
-                print(f"✅ BLUE-CHIP! (Score: {result['score']}/{result['max_score']})")
-            else:
-                print(f"❌ Not qualified (Score: {result.get('score', 0)}/{result.get('max_score', 6)})")
         
         # Sort by score
         bluechips.sort(key=lambda x: x['score'], reverse=True)
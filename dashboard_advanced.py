@@ -9,7 +9,8 @@ from plotly.subplots import make_subplots
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from vnstock import Vnstock
+from data_store import get_price_history
+import indicator_library
 import logging
 import json
 import requests
@@ -69,39 +70,17 @@ st.markdown("""
 
 # ============= Technical Indicators Functions =============
 
-def calculate_ma(df, period):
-    """Tính Moving Average"""
-    return df['close'].rolling(window=period).mean()
-
-def calculate_ema(df, period):
-    """Tính Exponential Moving Average"""
-    return df['close'].ewm(span=period, adjust=False).mean()
-
-def calculate_rsi(df, period=14):
-    """Tính Relative Strength Index"""
-    delta = df['close'].diff()
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    rs = gain / loss
-    rsi = 100 - (100 / (1 + rs))
-    return rsi
-
-def calculate_macd(df, fast=12, slow=26, signal=9):
-    """Tính MACD"""
-    ema_fast = df['close'].ewm(span=fast, adjust=False).mean()
-    ema_slow = df['close'].ewm(span=slow, adjust=False).mean()
-    macd = ema_fast - ema_slow
-    signal_line = macd.ewm(span=signal, adjust=False).mean()
-    histogram = macd - signal_line
-    return macd, signal_line, histogram
-
-def calculate_bollinger_bands(df, period=20, std_dev=2):
-    """Tính Bollinger Bands"""
-    ma = df['close'].rolling(window=period).mean()
-    std = df['close'].rolling(window=period).std()
-    upper_band = ma + (std * std_dev)
-    lower_band = ma - (std * std_dev)
-    return upper_band, ma, lower_band
+def calculate_indicator(df, symbol, name, **params):
+    """
+    Tính chỉ báo qua indicator_library (giá VND như API, cache theo mã + phiên cuối)
+    
+    Args:
+        df: DataFrame từ get_stock_data (cột time, close theo nghìn đồng)
+        symbol: Mã cổ phiếu
+        name: Tên chỉ báo (SMA, EMA, RSI, MACD, BB)
+    """
+    close = (df.set_index('time')['close'] * 1000).rename('Close')
+    return indicator_library.compute(name, close, symbol, **params)
 
 # ============= Data Functions =============
 
@@ -130,13 +109,9 @@ def format_volume(value):
 
 @st.cache_data(ttl=300)
 def get_stock_data(symbol, days=365):
-    """Lấy dữ liệu cổ phiếu từ vnstock (cached 5 phút)"""
+    """Lấy dữ liệu cổ phiếu từ price store cục bộ (cached 5 phút)"""
     try:
-        stock = Vnstock().stock(symbol=symbol.upper(), source='VCI')
-        end_date = datetime.now().strftime("%Y-%m-%d")
-        start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
-        
-        df = stock.quote.history(start=start_date, end=end_date)
+        df = get_price_history(symbol.upper(), days=days)
         
         if df.empty:
             return None
@@ -215,48 +190,48 @@ def plot_advanced_chart(df, symbol, indicators):
     
     # Moving Averages
     if 'MA20' in indicators:
-        ma20 = calculate_ma(df, 20)
+        ma20 = calculate_indicator(df, symbol, 'SMA', period=20)
         fig.add_trace(
-            go.Scatter(x=df['time'], y=ma20 * 1000, name='MA20',
+            go.Scatter(x=df['time'], y=ma20, name='MA20',
                       line=dict(color='blue', width=1)),
             row=1, col=1
         )
     
     if 'MA50' in indicators:
-        ma50 = calculate_ma(df, 50)
+        ma50 = calculate_indicator(df, symbol, 'SMA', period=50)
         fig.add_trace(
-            go.Scatter(x=df['time'], y=ma50 * 1000, name='MA50',
+            go.Scatter(x=df['time'], y=ma50, name='MA50',
                       line=dict(color='orange', width=1)),
             row=1, col=1
         )
     
     if 'MA200' in indicators:
-        ma200 = calculate_ma(df, 200)
+        ma200 = calculate_indicator(df, symbol, 'SMA', period=200)
         fig.add_trace(
-            go.Scatter(x=df['time'], y=ma200 * 1000, name='MA200',
+            go.Scatter(x=df['time'], y=ma200, name='MA200',
                       line=dict(color='red', width=1)),
             row=1, col=1
         )
     
     if 'EMA12' in indicators:
-        ema12 = calculate_ema(df, 12)
+        ema12 = calculate_indicator(df, symbol, 'EMA', period=12)
         fig.add_trace(
-            go.Scatter(x=df['time'], y=ema12 * 1000, name='EMA12',
+            go.Scatter(x=df['time'], y=ema12, name='EMA12',
                       line=dict(color='purple', width=1, dash='dash')),
             row=1, col=1
         )
     
     # Bollinger Bands
     if 'BB' in indicators:
-        upper, middle, lower = calculate_bollinger_bands(df)
+        upper, middle, lower = calculate_indicator(df, symbol, 'BB')
         fig.add_trace(
-            go.Scatter(x=df['time'], y=upper * 1000, name='BB Upper',
+            go.Scatter(x=df['time'], y=upper, name='BB Upper',
                       line=dict(color='gray', width=1, dash='dot'),
                       showlegend=True),
             row=1, col=1
         )
         fig.add_trace(
-            go.Scatter(x=df['time'], y=lower * 1000, name='BB Lower',
+            go.Scatter(x=df['time'], y=lower, name='BB Lower',
                       line=dict(color='gray', width=1, dash='dot'),
                       fill='tonexty', fillcolor='rgba(128,128,128,0.1)',
                       showlegend=True),
@@ -267,7 +242,7 @@ def plot_advanced_chart(df, symbol, indicators):
     
     # RSI
     if 'RSI' in indicators:
-        rsi = calculate_rsi(df)
+        rsi = calculate_indicator(df, symbol, 'RSI')
         fig.add_trace(
             go.Scatter(x=df['time'], y=rsi, name='RSI', line=dict(color='purple', width=2)),
             row=current_row, col=1
@@ -280,7 +255,7 @@ def plot_advanced_chart(df, symbol, indicators):
     
     # MACD
     if 'MACD' in indicators:
-        macd, signal, histogram = calculate_macd(df)
+        macd, signal, histogram = calculate_indicator(df, symbol, 'MACD')
         fig.add_trace(
             go.Scatter(x=df['time'], y=macd, name='MACD', line=dict(color='blue', width=1)),
             row=current_row, col=1
@@ -482,7 +457,7 @@ def main():
                         
                         with col1:
                             if 'RSI' in indicators:
-                                rsi_current = calculate_rsi(df).iloc[-1]
+                                rsi_current = calculate_indicator(df, symbol, 'RSI').iloc[-1]
                                 st.metric("RSI (14)", f"{rsi_current:.2f}")
                                 if rsi_current > 70:
                                     st.warning("⚠️ Overbought")
@@ -491,7 +466,7 @@ def main():
                         
                         with col2:
                             if 'MACD' in indicators:
-                                macd, signal, _ = calculate_macd(df)
+                                macd, signal, _ = calculate_indicator(df, symbol, 'MACD')
                                 macd_current = macd.iloc[-1]
                                 signal_current = signal.iloc[-1]
                                 st.metric("MACD", f"{macd_current:.2f}")
@@ -887,6 +862,35 @@ def main():
             else:
                 st.info("📦 No cache yet. Run first scan!")
         
+        # Query Mode: lọc bằng biểu thức trên chỉ số đã lưu (SQL, mili giây)
+        with st.expander("🔎 Query Mode (biểu thức trên chỉ số đã lưu)", expanded=False):
+            from screener_query import QueryError, run_query
+            
+            query_expr = st.text_input(
+                "Biểu thức",
+                value="PE < 15 AND ROE > 18 AND RSI BETWEEN 30 AND 50",
+                key="metrics_query",
+                help="Trường: price, ma20, ma50, ma200, rsi, macd, atr, adx, pe, roe, eps, npm, de, "
+                     "market_cap, overall_rating, overall_score, exchange... Toán tử: < <= > >= = != "
+                     "BETWEEN, IN, IS NULL, AND/OR/NOT, + - * /"
+            )
+            query_col1, query_col2 = st.columns(2)
+            with query_col1:
+                query_order = st.text_input("Sắp xếp", value="overall_score DESC", key="metrics_order")
+            with query_col2:
+                query_limit = st.number_input("Số mã tối đa", min_value=1, max_value=2000, value=100,
+                                              key="metrics_limit")
+            
+            try:
+                query_started = datetime.now()
+                query_rows = run_query(query_expr, order_by=query_order, limit=int(query_limit))
+                query_ms = (datetime.now() - query_started).total_seconds() * 1000
+                st.caption(f"{len(query_rows)} mã • {query_ms:.0f} ms")
+                if query_rows:
+                    st.dataframe(pd.DataFrame(query_rows).set_index('symbol'), use_container_width=True)
+            except QueryError as e:
+                st.error(f"❌ Biểu thức không hợp lệ: {e}")
+        
         # Mode selection
         st.markdown("### Chọn chế độ Scan")
         mode = st.radio(
@@ -0,0 +1,433 @@
+"""
+Data Store - VNStock Local-first Data Access
+Lưu trữ dữ liệu giá OHLCV cục bộ (SQLite, cùng file vnstock.db) và chỉ tải
+phần dữ liệu mới từ vnstock. Dùng chung cho TA, Classifier, Blue-chip,
+Portfolio và Dashboard.
+
+Báo cáo tài chính được lưu theo (mã, loại báo cáo, kỳ, ngôn ngữ) và chỉ tải
+lại quanh mùa công bố BCTC hoặc khi có kỳ báo cáo mới.
+"""
+
+import pandas as pd
+from datetime import datetime, timedelta
+from io import StringIO
+from typing import Optional, Tuple
+import logging
+import re
+
+from database import get_db
+from rate_limiter import get_rate_limiter
+from single_flight import get_single_flight
+
+logger = logging.getLogger(__name__)
+
+# Cột trả về giống stock.quote.history() của vnstock
+PRICE_COLUMNS = ['time', 'open', 'high', 'low', 'close', 'volume']
+
+# Giờ đóng cửa thị trường (HOSE/HNX) - sau giờ này nến ngày đã chốt
+MARKET_CLOSE_HOUR = 15
+
+# Trong phiên, nến ngày hiện tại được làm mới tối đa mỗi N phút
+INTRADAY_REFRESH_MINUTES = 15
+
+# Sai lệch tối đa (nghìn đồng) giữa giá đóng cửa đã lưu và giá tải lại cùng
+# ngày. Lớn hơn nghĩa là VCI đã điều chỉnh giá lịch sử (chia tách, cổ tức)
+ADJUSTED_PRICE_TOLERANCE = 0.001
+
+# Mùa báo cáo: số ngày sau khi kết thúc kỳ mà doanh nghiệp còn có thể công bố
+# BCTC (BCTC quý hợp nhất: 45 ngày, BCTC năm kiểm toán: 90 ngày)
+STATEMENT_FILING_WINDOW_DAYS = 45
+STATEMENT_ANNUAL_FILING_WINDOW_DAYS = 90
+
+# Trong mùa báo cáo, BCTC chưa có kỳ mới nhất được kiểm tra lại mỗi N giờ
+STATEMENT_SEASON_REFRESH_HOURS = 12
+
+# Ngoài mùa báo cáo, kiểm tra lại mỗi N ngày (công bố trễ / điều chỉnh số liệu)
+STATEMENT_OFFSEASON_REFRESH_DAYS = 7
+
+
+def _fetch_upstream_history(symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """Tải OHLCV từ vnstock (upstream call)"""
+    from vnstock import Vnstock
+
+    logger.info(f"Tải dữ liệu giá {symbol} từ vnstock: {start_date} -> {end_date}")
+    get_rate_limiter().acquire()
+    stock = Vnstock().stock(symbol=symbol, source='VCI')
+    return stock.quote.history(start=start_date, end=end_date)
+
+
+def fetch_upstream_history(symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """
+    Tải OHLCV từ vnstock, gộp các request đồng thời cùng (mã, khoảng ngày)
+    thành một lời gọi upstream
+
+    DataFrame trả về có thể dùng chung giữa các caller - không sửa trực tiếp.
+    """
+    df, _ = get_single_flight().do(('history', symbol.upper(), start_date, end_date),
+                                   lambda: _fetch_upstream_history(symbol, start_date, end_date))
+    return df
+
+
+def _to_bars(df: pd.DataFrame) -> list:
+    """Chuyển DataFrame vnstock sang list bar để lưu DB"""
+    if df is None or df.empty:
+        return []
+
+    dates = pd.to_datetime(df['time']).dt.strftime('%Y-%m-%d')
+    bars = []
+    for date, row in zip(dates, df.itertuples(index=False)):
+        bars.append({
+            'date': date,
+            'open': float(row.open),
+            'high': float(row.high),
+            'low': float(row.low),
+            'close': float(row.close),
+            'volume': float(row.volume)
+        })
+    return bars
+
+
+def _needs_intraday_refresh(coverage: dict, end_date: str) -> bool:
+    """
+    Kiểm tra nến của ngày hôm nay có cần tải lại không
+    (đã tải trong phiên và quá INTRADAY_REFRESH_MINUTES phút)
+    """
+    today = datetime.now().strftime("%Y-%m-%d")
+    if end_date < today or coverage['end_date'] < today:
+        return False
+
+    updated_at = datetime.fromisoformat(coverage['updated_at'])
+    market_close = datetime.now().replace(hour=MARKET_CLOSE_HOUR, minute=0, second=0, microsecond=0)
+
+    if updated_at >= market_close:
+        return False  # Đã tải sau giờ đóng cửa - nến ngày đã chốt
+
+    return datetime.now() - updated_at > timedelta(minutes=INTRADAY_REFRESH_MINUTES)
+
+
+def _is_settled_bar(coverage: dict) -> bool:
+    """
+    Nến tại coverage['end_date'] đã chốt: được tải sau giờ đóng cửa của ngày
+    đó + INTRADAY_REFRESH_MINUTES
+    """
+    updated_at = datetime.fromisoformat(coverage['updated_at'])
+    settled_at = (datetime.fromisoformat(coverage['end_date']).replace(hour=MARKET_CLOSE_HOUR)
+                  + timedelta(minutes=INTRADAY_REFRESH_MINUTES))
+    return updated_at >= settled_at
+
+
+def last_settled_date(symbol: str) -> Optional[str]:
+    """
+    Ngày cuối cùng có nến đã chốt của mã trong price store
+
+    Nến ngày cuối chưa chốt (tải trong phiên) còn thay đổi ở lần tải sau, các
+    nến trước đó đều đã được tải lại sau phiên của chúng.
+
+    Returns:
+        YYYY-MM-DD, None nếu mã chưa có coverage
+    """
+    coverage = get_db().get_price_coverage(symbol)
+    if coverage is None:
+        return None
+    if _is_settled_bar(coverage):
+        return coverage['end_date']
+    return (datetime.fromisoformat(coverage['end_date']) - timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def _is_price_adjusted(db, symbol: str, date: str, bars: list) -> bool:
+    """
+    So sánh giá đóng cửa đã lưu tại date với nến vừa tải lại cùng ngày
+
+    VCI trả giá đã điều chỉnh: sau chia tách / trả cổ tức, toàn bộ giá trước
+    ngày GDKHQ đổi theo, dữ liệu đã lưu không còn khớp.
+    """
+    stored = db.get_price_history(symbol, date, date)
+    fresh = [bar for bar in bars if bar['date'] == date]
+    if not stored or not fresh or stored[0]['close'] is None:
+        return False
+    return abs(fresh[0]['close'] - stored[0]['close']) > ADJUSTED_PRICE_TOLERANCE
+
+
+def get_price_history(symbol: str, days: int = 365, start_date: Optional[str] = None,
+                      end_date: Optional[str] = None) -> pd.DataFrame:
+    """
+    Lấy dữ liệu OHLCV, ưu tiên dữ liệu cục bộ và chỉ tải phần còn thiếu
+
+    Args:
+        symbol: Mã cổ phiếu
+        days: Số ngày lấy dữ liệu (dùng khi không truyền start_date)
+        start_date: Ngày bắt đầu (YYYY-MM-DD)
+        end_date: Ngày kết thúc (YYYY-MM-DD), mặc định hôm nay
+
+    Returns:
+        DataFrame cùng định dạng stock.quote.history():
+        time, open, high, low, close, volume (giá đơn vị nghìn đồng)
+    """
+    symbol = symbol.upper().strip()
+    end = end_date or datetime.now().strftime("%Y-%m-%d")
+    start = start_date or (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+
+    db = get_db()
+    coverage = db.get_price_coverage(symbol)
+
+    # Các khoảng ngày cần tải từ upstream
+    fetch_ranges = []
+    if coverage is None:
+        fetch_ranges.append((start, end))
+        new_start, new_end = start, end
+    else:
+        new_start = min(start, coverage['start_date'])
+        new_end = max(end, coverage['end_date'])
+
+        if start < coverage['start_date']:
+            fetch_ranges.append((start, coverage['start_date']))
+
+        # Tải lại từ ngày cuối đã lưu để cập nhật nến chưa chốt
+        if end > coverage['end_date'] or _needs_intraday_refresh(coverage, end):
+            fetch_ranges.append((coverage['end_date'], end))
+
+    for fetch_start, fetch_end in fetch_ranges:
+        try:
+            bars = _to_bars(fetch_upstream_history(symbol, fetch_start, fetch_end))
+
+            # Nến cuối đã lưu được tải lại - kiểm tra giá lịch sử có bị điều chỉnh không
+            if (coverage is not None and fetch_start == coverage['end_date']
+                    and _is_settled_bar(coverage)
+                    and _is_price_adjusted(db, symbol, fetch_start, bars)):
+                logger.info(f"Giá {symbol} đã được điều chỉnh (chia tách / cổ tức), "
+                            f"tải lại toàn bộ {new_start} -> {new_end}")
+                bars = _to_bars(fetch_upstream_history(symbol, new_start, new_end))
+                db.delete_indicator_states(symbol)  # Trạng thái chỉ báo tính trên giá cũ
+
+            db.save_price_history(symbol, bars)
+        except (Exception, SystemExit) as e:
+            if coverage is None:
+                raise  # Không có dữ liệu cục bộ - để caller xử lý như trước
+            logger.warning(f"Không tải được dữ liệu mới cho {symbol}, dùng dữ liệu cục bộ: {e}")
+            return _load_local(db, symbol, start, end)
+
+    if fetch_ranges:
+        db.update_price_coverage(symbol, new_start, new_end)
+
+    return _load_local(db, symbol, start, end)
+
+
+def _load_local(db, symbol: str, start_date: str, end_date: str) -> pd.DataFrame:
+    """Đọc OHLCV đã lưu thành DataFrame định dạng vnstock"""
+    rows = db.get_price_history(symbol, start_date, end_date)
+
+    if not rows:
+        return pd.DataFrame(columns=PRICE_COLUMNS)
+
+    df = pd.DataFrame(rows).rename(columns={'date': 'time'})
+    df['time'] = pd.to_datetime(df['time'])
+    df['volume'] = df['volume'].fillna(0).astype('int64')
+    return df[PRICE_COLUMNS]
+
+
+def _fetch_upstream_statement(symbol: str, statement_type: str,
+                              period: str = 'quarterly', lang: str = 'vi') -> pd.DataFrame:
+    """
+    Tải báo cáo tài chính từ vnstock (upstream call)
+
+    Args:
+        symbol: Mã cổ phiếu
+        statement_type: income_statement, balance_sheet, cash_flow hoặc ratio
+        period: Kỳ báo cáo (quarterly/year)
+        lang: Ngôn ngữ (vi/en)
+    """
+    from vnstock import Vnstock
+
+    logger.info(f"Tải {statement_type} {symbol} từ vnstock (period={period}, lang={lang})")
+    get_rate_limiter().acquire()
+    stock = Vnstock().stock(symbol=symbol, source='VCI')
+    return getattr(stock.finance, statement_type)(period=period, lang=lang)
+
+
+def _last_closed_period(period: str, now: datetime) -> Tuple[str, datetime]:
+    """
+    Kỳ báo cáo gần nhất đã kết thúc tại thời điểm now
+
+    Returns:
+        (nhãn kỳ - VD: 2025-Q3 hoặc 2025, ngày kết thúc kỳ)
+    """
+    if period in ('year', 'annual', 'yearly'):
+        return f"{now.year - 1}", datetime(now.year - 1, 12, 31)
+
+    quarter = (now.month - 1) // 3
+    if quarter == 0:
+        return f"{now.year - 1}-Q4", datetime(now.year - 1, 12, 31)
+
+    quarter_end = datetime(now.year, quarter * 3 + 1, 1) - timedelta(days=1)
+    return f"{now.year}-Q{quarter}", quarter_end
+
+
+def _latest_statement_period(df: pd.DataFrame) -> Optional[str]:
+    """
+    Xác định kỳ báo cáo mới nhất có trong BCTC (VD: 2025-Q3, hoặc 2025 với BCTC năm)
+
+    Hỗ trợ cột năm/kỳ của VCI (Năm/Kỳ, yearReport/lengthReport), cột period
+    hoặc BCTC dạng ngang (mỗi kỳ một cột).
+    """
+    if df is None or df.empty:
+        return None
+
+    labels = []
+    for year_col, quarter_col in (('yearReport', 'lengthReport'), ('Năm', 'Kỳ'), ('year', 'quarter')):
+        if year_col in df.columns and quarter_col in df.columns:
+            for year, quarter in zip(df[year_col], df[quarter_col]):
+                try:
+                    year, quarter = int(year), int(quarter)
+                except (TypeError, ValueError):
+                    continue
+                labels.append(f"{year}-Q{quarter}" if 1 <= quarter <= 4 else f"{year}")
+            break
+
+    if not labels:
+        pattern = re.compile(r'^\d{4}(-Q[1-4])?$')
+        candidates = df['period'].astype(str) if 'period' in df.columns else df.columns.astype(str)
+        labels = [label for label in candidates if pattern.match(label)]
+
+    return max(labels) if labels else None
+
+
+def _is_statement_fresh(cached: dict, period: str, now: Optional[datetime] = None) -> bool:
+    """
+    Kiểm tra BCTC đã lưu còn dùng được không theo lịch công bố báo cáo
+
+    - Đã có kỳ vừa kết thúc: dùng đến khi kỳ tiếp theo kết thúc
+    - Đang trong mùa báo cáo: kiểm tra lại mỗi STATEMENT_SEASON_REFRESH_HOURS giờ
+    - Ngoài mùa báo cáo: kiểm tra lại mỗi STATEMENT_OFFSEASON_REFRESH_DAYS ngày
+    """
+    now = now or datetime.now()
+    age = now - datetime.fromisoformat(cached['fetched_at'])
+
+    expected_period, period_end = _last_closed_period(period, now)
+    latest_period = cached.get('latest_period')
+    if latest_period and latest_period >= expected_period:
+        return True
+
+    # Kỳ kết thúc 31/12 đi kèm BCTC năm kiểm toán nên hạn công bố dài hơn
+    if period_end.month == 12:
+        filing_window = STATEMENT_ANNUAL_FILING_WINDOW_DAYS
+    else:
+        filing_window = STATEMENT_FILING_WINDOW_DAYS
+
+    if (now - period_end).days <= filing_window:
+        return age < timedelta(hours=STATEMENT_SEASON_REFRESH_HOURS)
+
+    return age < timedelta(days=STATEMENT_OFFSEASON_REFRESH_DAYS)
+
+
+def get_financial_statement(symbol: str, statement_type: str, period: str = 'quarterly',
+                            lang: str = 'vi', force_refresh: bool = False) -> pd.DataFrame:
+    """
+    Lấy báo cáo tài chính, ưu tiên bản đã lưu nếu chưa có kỳ báo cáo mới
+
+    Args:
+        symbol: Mã cổ phiếu
+        statement_type: income_statement, balance_sheet, cash_flow hoặc ratio
+        period: Kỳ báo cáo (quarterly/year)
+        lang: Ngôn ngữ (vi/en)
+        force_refresh: Bỏ qua cache và tải lại từ vnstock
+
+    Returns:
+        DataFrame cùng định dạng stock.finance.<statement_type>()
+    """
+    symbol = symbol.upper().strip()
+    db = get_db()
+    cached = db.get_financial_statement(symbol, statement_type, period, lang)
+
+    if cached and not force_refresh and _is_statement_fresh(cached, period):
+        logger.debug(f"Dùng {statement_type} {symbol} đã lưu (kỳ {cached['latest_period']})")
+        return _load_statement(cached)
+
+    try:
+        # Gộp các request đồng thời cùng báo cáo thành một lời gọi upstream
+        df, _ = get_single_flight().do(
+            ('statement', symbol, statement_type, period, lang),
+            lambda: _fetch_upstream_statement(symbol, statement_type, period=period, lang=lang)
+        )
+    except (Exception, SystemExit) as e:
+        if cached is None:
+            raise  # Không có dữ liệu cục bộ - để caller xử lý như trước
+        logger.warning(f"Không tải được {statement_type} mới cho {symbol}, dùng bản đã lưu: {e}")
+        return _load_statement(cached)
+
+    if df is None or df.empty:
+        return _load_statement(cached) if cached else pd.DataFrame()
+
+    db.save_financial_statement(
+        symbol, statement_type, period, lang,
+        df.to_json(orient='split', date_format='iso', force_ascii=False),
+        _latest_statement_period(df)
+    )
+    return df.copy()  # DataFrame có thể dùng chung với request khác
+
+
+def _load_statement(cached: dict) -> pd.DataFrame:
+    """Đọc BCTC đã lưu thành DataFrame"""
+    return pd.read_json(StringIO(cached['statement_data']), orient='split', convert_dates=False)
+
+
+class SymbolDataBundle:
+    """
+    Dữ liệu của một mã cổ phiếu cho một lượt phân tích
+
+    Mỗi loại dữ liệu (giá, KQKD, CĐKT) chỉ được tải một lần khi cần và dùng
+    chung cho FA, TA, volatility và market cap. Lỗi rate limit (SystemExit)
+    được đẩy lên caller như khi gọi vnstock trực tiếp.
+    """
+
+    def __init__(self, symbol: str, history_days: int = 365):
+        """
+        Args:
+            symbol: Mã cổ phiếu
+            history_days: Số ngày dữ liệu giá cần cho lượt phân tích dài nhất
+        """
+        self.symbol = symbol.upper().strip()
+        self.history_days = history_days
+        self._history = None
+        self._income_statement = None
+        self._balance_sheet = None
+
+    @property
+    def history(self) -> pd.DataFrame:
+        """OHLCV history_days ngày gần nhất (định dạng vnstock)"""
+        if self._history is None:
+            self._history = get_price_history(self.symbol, days=self.history_days)
+        return self._history
+
+    def get_history(self, days: int) -> pd.DataFrame:
+        """Lấy OHLCV N ngày gần nhất từ dữ liệu đã tải (không gọi thêm upstream)"""
+        if days >= self.history_days:
+            return self.history.copy()
+
+        df = self.history
+        if df.empty:
+            return df.copy()
+
+        cutoff = pd.Timestamp(datetime.now() - timedelta(days=days)).normalize()
+        return df[df['time'] >= cutoff].reset_index(drop=True)
+
+    @property
+    def current_price(self) -> Optional[float]:
+        """Giá đóng cửa gần nhất (nghìn đồng)"""
+        df = self.history
+        if df.empty:
+            return None
+        return float(df['close'].iloc[-1])
+
+    @property
+    def income_statement(self) -> pd.DataFrame:
+        """Báo cáo KQKD theo quý (tiếng Việt, quý gần nhất ở đầu)"""
+        if self._income_statement is None:
+            self._income_statement = get_financial_statement(self.symbol, 'income_statement')
+        return self._income_statement
+
+    @property
+    def balance_sheet(self) -> pd.DataFrame:
+        """Bảng CĐKT theo quý (tiếng Việt, quý gần nhất ở đầu)"""
+        if self._balance_sheet is None:
+            self._balance_sheet = get_financial_statement(self.symbol, 'balance_sheet')
+        return self._balance_sheet
@@ -1,28 +1,150 @@
 """
 Database Module - VNStock Persistent Storage
 SQLite database cho Watchlist, Alerts, Chart Layouts, Portfolio
+
+Mỗi thread (worker FastAPI, alert monitor, Streamlit rerun, scan worker) dùng
+connection riêng trên cùng file, ở chế độ WAL: đọc không bị chặn bởi ghi và
+các ghi đồng thời chờ nhau theo busy_timeout thay vì báo "database is locked".
 """
 
+import atexit
+import re
 import sqlite3
-from datetime import datetime
-from typing import List, Dict, Any, Optional
+import threading
+import time
+import types
+from datetime import datetime, timedelta
+from typing import Callable, List, Dict, Any, Optional, Tuple
 import json
 import logging
 
 logger = logging.getLogger(__name__)
 
+# Cột chỉ số của bảng symbol_metrics (ngoài symbol và các cột thời gian)
+SYMBOL_METRIC_COLUMNS = [
+    # Giá & kỹ thuật (VND) - từ price store
+    'price', 'volume', 'volume_ma', 'ma20', 'ma50', 'ma200', 'rsi',
+    'macd', 'macd_signal', 'macd_hist', 'bb_upper', 'bb_lower', 'atr', 'adx', 'stoch_k', 'ta_date',
+    # Cơ bản - từ calculate_fa_ratios
+    'pe', 'roe', 'eps', 'npm', 'de',
+    # Phân loại - từ StockClassifier
+    'exchange', 'market_cap', 'growth_category', 'risk_category', 'market_cap_category',
+    'momentum_category', 'overall_rating', 'overall_score',
+]
+
+# Cột có thể chọn khi đọc cache phân loại không decode JSON
+# (tên -> biểu thức SQL trên bảng stock_classification_cache)
+CLASSIFICATION_CACHE_COLUMNS = {
+    'symbol': 'symbol',
+    'exchange': 'exchange',
+    'growth_category': 'growth_category',
+    'growth_score': 'growth_score',
+    'risk_category': 'risk_category',
+    'risk_score': 'risk_score',
+    'market_cap_category': 'market_cap_category',
+    'momentum_category': 'momentum_category',
+    'overall_rating': 'overall_rating',
+    'overall_score': 'overall_score',
+    'scan_timestamp': 'scan_timestamp',
+    'recommendation': 'recommendation',
+    'age_hours': "(CAST(strftime('%s', 'now') AS INTEGER) - scan_epoch) / 3600.0",
+}
+
+# Thứ tự rating (thấp -> cao); classification_history lưu rating dưới dạng
+# chỉ số trong list này
+RATING_RANKS = ['F', 'D', 'C', 'B', 'A', 'A+']
+
+# Lịch sử phân loại: giữ bản ghi theo ngày trong N ngày, cũ hơn chỉ giữ bản
+# cuối tuần của mỗi mã, quá HISTORY_MAX_DAYS thì xóa
+HISTORY_DAILY_DAYS = 90
+HISTORY_MAX_DAYS = 730
+
+# Pragma áp dụng cho mỗi connection (ghi đè qua tham số pragmas của VNStockDB)
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'WAL',           # Đọc song song với ghi
+    'synchronous': 'NORMAL',         # An toàn với WAL, commit không fsync mỗi lần
+    'busy_timeout': 5000,            # ms chờ khi thread khác đang ghi
+    'cache_size': -16000,            # Page cache mỗi connection (số âm = KB)
+    'mmap_size': 128 * 1024 * 1024,  # Đọc qua memory-map (byte)
+    'temp_store': 'MEMORY',
+}
+
+_PRAGMA_VALUE = re.compile(r'^(-?\d+|[A-Za-z_]+)$')
+
+
+# Ngưỡng ghi lô mặc định của BatchWriter
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_BATCH_MAX_DELAY_SECONDS = 5.0
+
+
+def _rating_rank_sql(column: str) -> str:
+    """Biểu thức SQL đổi rating (A+, A, ...) thành chỉ số trong RATING_RANKS"""
+    cases = ' '.join(f"WHEN '{rating}' THEN {rank}" for rank, rating in enumerate(RATING_RANKS))
+    return f"CASE {column} {cases} END"
+
+
+def _rating_rank(rating: Optional[str]) -> Optional[int]:
+    """Chỉ số của rating trong RATING_RANKS (None nếu không có)"""
+    return RATING_RANKS.index(rating) if rating in RATING_RANKS else None
+
+
+def _age_cutoff(max_age_hours: float) -> int:
+    """scan_epoch nhỏ nhất còn trong max_age_hours giờ gần đây"""
+    return int(time.time() - max_age_hours * 3600)
+
 
 class VNStockDB:
     """Database manager cho VNStock application"""
     
-    def __init__(self, db_path: str = 'vnstock.db'):
-        """Initialize database connection"""
+    def __init__(self, db_path: str = 'vnstock.db', pragmas: Optional[Dict[str, Any]] = None):
+        """
+        Initialize database
+
+        Args:
+            db_path: File SQLite
+            pragmas: Ghi đè DEFAULT_PRAGMAS (VD: {'synchronous': 'FULL'})
+        """
         self.db_path = db_path
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
+        for name, value in self.pragmas.items():
+            if not name.isidentifier() or not _PRAGMA_VALUE.match(str(value)):
+                raise ValueError(f"Pragma không hợp lệ: {name} = {value}")
+
+        # :memory: là DB riêng của từng connection nên mọi thread dùng chung một connection
+        self._local = types.SimpleNamespace() if db_path == ':memory:' else threading.local()
+        self._connections: Dict[int, Tuple[threading.Thread, sqlite3.Connection]] = {}
+        self._connections_lock = threading.Lock()
+
         self.create_tables()
+        atexit.register(self.close)  # Checkpoint WAL khi thoát
         logger.info(f"Database initialized: {db_path}")
     
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """Connection của thread hiện tại (mở khi thread dùng DB lần đầu)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+    
+    def _connect(self) -> sqlite3.Connection:
+        """Mở connection mới với pragma đã cấu hình, đóng connection của thread đã kết thúc"""
+        conn = sqlite3.connect(self.db_path, timeout=self.pragmas['busy_timeout'] / 1000,
+                               check_same_thread=False)
+        conn.row_factory = sqlite3.Row  # Return rows as dictionaries
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+
+        current = threading.current_thread()
+        with self._connections_lock:
+            for key, (thread, old_conn) in list(self._connections.items()):
+                if not thread.is_alive():
+                    old_conn.close()
+                    del self._connections[key]
+            self._connections[id(conn)] = (current, conn)
+        return conn
+    
     def create_tables(self):
         """Create all required tables"""
         cursor = self.conn.cursor()
@@ -131,7 +253,198 @@ class VNStockDB:
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_overall_rating ON stock_classification_cache(overall_rating)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_scan_timestamp ON stock_classification_cache(scan_timestamp)')
         cursor.execute('CREATE INDEX IF NOT EXISTS idx_exchange ON stock_classification_cache(exchange)')
-        
+
+        # scan_epoch (Unix giây) để lọc theo tuổi cache bằng so sánh trực tiếp trên index,
+        # thay vì datetime(scan_timestamp) phải parse từng dòng. Migration cho DB cũ.
+        columns = [row[1] for row in cursor.execute('PRAGMA table_info(stock_classification_cache)')]
+        if 'scan_epoch' not in columns:
+            cursor.execute('ALTER TABLE stock_classification_cache ADD COLUMN scan_epoch INTEGER')
+            # scan_timestamp là giờ địa phương (datetime.now().isoformat())
+            cursor.execute('''
+                UPDATE stock_classification_cache
+                SET scan_epoch = COALESCE(CAST(strftime('%s', scan_timestamp, 'utc') AS INTEGER), 0)
+            ''')
+            logger.info("Migrated stock_classification_cache: added scan_epoch")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_scan_epoch ON stock_classification_cache(scan_epoch)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_exchange_scan_epoch ON stock_classification_cache(exchange, scan_epoch)')
+
+        # recommendation tách khỏi classification_data để bản tóm tắt không phải parse JSON
+        if 'recommendation' not in columns:
+            cursor.execute('ALTER TABLE stock_classification_cache ADD COLUMN recommendation TEXT')
+            cursor.execute('''
+                UPDATE stock_classification_cache
+                SET recommendation = json_extract(classification_data, '$.overall_rating.recommendation')
+            ''')
+            logger.info("Migrated stock_classification_cache: added recommendation")
+
+        # Classification History table (append-only, một dòng / mã / ngày scan).
+        # Khóa chính bắt đầu bằng scan_date để truy vấn và dọn dẹp theo khoảng ngày.
+        history_exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'classification_history'"
+        ).fetchone()
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS classification_history (
+                scan_date TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                scan_epoch INTEGER NOT NULL,
+                exchange TEXT,
+                rating_rank INTEGER,
+                overall_score REAL,
+                growth_score REAL,
+                risk_score REAL,
+                PRIMARY KEY (scan_date, symbol)
+            ) WITHOUT ROWID
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_history_symbol_date ON classification_history(symbol, scan_date)')
+        if not history_exists:
+            # Khởi tạo lịch sử từ kết quả đang có trong cache
+            cursor.execute(f'''
+                INSERT OR IGNORE INTO classification_history
+                (scan_date, symbol, scan_epoch, exchange, rating_rank, overall_score, growth_score, risk_score)
+                SELECT date(scan_epoch, 'unixepoch', 'localtime'), symbol, scan_epoch, exchange,
+                       {_rating_rank_sql('overall_rating')}, overall_score, growth_score, risk_score
+                FROM stock_classification_cache
+            ''')
+
+        # Price History table (OHLCV daily bars, đơn vị nghìn đồng như vnstock)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_history (
+                symbol TEXT NOT NULL,
+                date TEXT NOT NULL,
+                open REAL,
+                high REAL,
+                low REAL,
+                close REAL,
+                volume REAL,
+                PRIMARY KEY (symbol, date)
+            )
+        ''')
+
+        # Price History Coverage table (khoảng ngày đã tải cho mỗi mã)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS price_history_coverage (
+                symbol TEXT PRIMARY KEY,
+                start_date TEXT NOT NULL,
+                end_date TEXT NOT NULL,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+
+        # Financial Statement Cache table (BCTC dạng JSON, làm mới theo mùa báo cáo)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS financial_statement_cache (
+                symbol TEXT NOT NULL,
+                statement_type TEXT NOT NULL,
+                period TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                statement_data TEXT NOT NULL,
+                latest_period TEXT,
+                fetched_at TEXT NOT NULL,
+                PRIMARY KEY (symbol, statement_type, period, lang)
+            )
+        ''')
+
+        # Retry Queue table (mã bị rate limit, thử lại với backoff)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS retry_queue (
+                task TEXT NOT NULL,
+                symbol TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at TEXT NOT NULL,
+                last_error TEXT,
+                created_at TEXT NOT NULL,
+                PRIMARY KEY (task, symbol)
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_retry_next_attempt ON retry_queue(task, next_attempt_at)')
+
+        # Indicator State table (trạng thái chỉ báo streaming theo mã)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS indicator_state (
+                symbol TEXT NOT NULL,
+                indicator TEXT NOT NULL,
+                params TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                state TEXT NOT NULL,
+                last_bar TEXT NOT NULL,
+                updated_at TEXT NOT NULL,
+                PRIMARY KEY (symbol, indicator, params)
+            )
+        ''')
+
+        # Symbol Metrics table (chỉ số mới nhất mỗi mã cho screener query)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS symbol_metrics (
+                symbol TEXT PRIMARY KEY,
+                price REAL,
+                volume REAL,
+                volume_ma REAL,
+                ma20 REAL,
+                ma50 REAL,
+                ma200 REAL,
+                rsi REAL,
+                macd REAL,
+                macd_signal REAL,
+                macd_hist REAL,
+                bb_upper REAL,
+                bb_lower REAL,
+                atr REAL,
+                adx REAL,
+                stoch_k REAL,
+                ta_date TEXT,
+                pe REAL,
+                roe REAL,
+                eps REAL,
+                npm REAL,
+                de REAL,
+                exchange TEXT,
+                market_cap REAL,
+                growth_category TEXT,
+                risk_category TEXT,
+                market_cap_category TEXT,
+                momentum_category TEXT,
+                overall_rating TEXT,
+                overall_score REAL,
+                ta_updated_at TEXT,
+                fa_updated_at TEXT,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        for column in ['pe', 'roe', 'rsi', 'market_cap', 'overall_score', 'exchange']:
+            cursor.execute(f'CREATE INDEX IF NOT EXISTS idx_metrics_{column} ON symbol_metrics({column})')
+
+        # Scan Jobs table (quét thị trường chạy nền, theo dõi qua /jobs)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_jobs (
+                job_id TEXT PRIMARY KEY,
+                job_type TEXT NOT NULL,
+                params TEXT NOT NULL,
+                params_key TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'queued',
+                completed INTEGER DEFAULT 0,
+                total INTEGER DEFAULT 0,
+                result TEXT,
+                error TEXT,
+                created_at TEXT NOT NULL,
+                started_at TEXT,
+                finished_at TEXT,
+                updated_at TEXT NOT NULL
+            )
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_scan_jobs_key ON scan_jobs(params_key, status)')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_scan_jobs_created ON scan_jobs(created_at)')
+
+        # Kết quả từng mã của scan job (xem dần khi job đang chạy)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS scan_job_results (
+                job_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                symbol TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (job_id, seq)
+            )
+        ''')
+
         self.conn.commit()
         logger.info("All tables created successfully")
     
@@ -498,8 +811,19 @@ class VNStockDB:
     # ========== UTILITY FUNCTIONS ==========
     
     def close(self):
-        """Close database connection"""
-        self.conn.close()
+        """Close database connections (của mọi thread)"""
+        with self._connections_lock:
+            connections = [conn for _, conn in self._connections.values()]
+            self._connections.clear()
+            # Thread nào dùng tiếp sẽ mở connection mới
+            self._local = types.SimpleNamespace() if self.db_path == ':memory:' else threading.local()
+        if not connections:
+            return
+        for conn in connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.warning(f"Không đóng được connection: {e}")
         logger.info("Database connection closed")
     
     def get_stats(self) -> Dict:
@@ -513,10 +837,579 @@ class VNStockDB:
             'open_positions_count': cursor.execute('SELECT COUNT(*) FROM portfolio WHERE status = "open"').fetchone()[0],
             'total_transactions': cursor.execute('SELECT COUNT(*) FROM transactions').fetchone()[0],
             'cached_stocks_count': cursor.execute('SELECT COUNT(*) FROM stock_classification_cache').fetchone()[0],
+            'price_history_symbols': cursor.execute('SELECT COUNT(*) FROM price_history_coverage').fetchone()[0],
+            'cached_statements_count': cursor.execute('SELECT COUNT(*) FROM financial_statement_cache').fetchone()[0],
+            'retry_queue_count': cursor.execute('SELECT COUNT(*) FROM retry_queue').fetchone()[0],
+            'symbol_metrics_count': cursor.execute('SELECT COUNT(*) FROM symbol_metrics').fetchone()[0],
+            'scan_jobs_count': cursor.execute('SELECT COUNT(*) FROM scan_jobs').fetchone()[0],
+            'classification_history_count': cursor.execute('SELECT COUNT(*) FROM classification_history').fetchone()[0],
+            'journal_mode': cursor.execute('PRAGMA journal_mode').fetchone()[0],
+            'open_connections': len(self._connections),
         }
-        
+
         return stats
+
+    # ========== PRICE HISTORY OPERATIONS ==========
+
+    def save_price_history(self, symbol: str, bars: List[Dict]) -> int:
+        """
+        Lưu (upsert) các phiên giao dịch OHLCV vào price_history
+
+        Args:
+            symbol: Mã cổ phiếu
+            bars: List dict có keys date (YYYY-MM-DD), open, high, low, close, volume
+
+        Returns:
+            int: Số phiên đã lưu
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.executemany('''
+                INSERT OR REPLACE INTO price_history
+                (symbol, date, open, high, low, close, volume)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (symbol.upper(), bar['date'], bar.get('open'), bar.get('high'),
+                 bar.get('low'), bar.get('close'), bar.get('volume'))
+                for bar in bars
+            ])
+            self.conn.commit()
+            logger.debug(f"Saved {len(bars)} price bars for {symbol}")
+            return len(bars)
+        except Exception as e:
+            logger.error(f"Error saving price history for {symbol}: {e}")
+            return 0
+
+    def get_price_history(self, symbol: str, start_date: str = None,
+                          end_date: str = None) -> List[Dict]:
+        """
+        Lấy dữ liệu OHLCV đã lưu, sắp xếp theo ngày tăng dần
+
+        Args:
+            symbol: Mã cổ phiếu
+            start_date: Ngày bắt đầu (YYYY-MM-DD), None = không giới hạn
+            end_date: Ngày kết thúc (YYYY-MM-DD), None = không giới hạn
+
+        Returns:
+            List[Dict]: Các phiên giao dịch
+        """
+        cursor = self.conn.cursor()
+        query = '''
+            SELECT date, open, high, low, close, volume
+            FROM price_history
+            WHERE symbol = ?
+        '''
+        params = [symbol.upper()]
+
+        if start_date:
+            query += ' AND date >= ?'
+            params.append(start_date)
+
+        if end_date:
+            query += ' AND date <= ?'
+            params.append(end_date)
+
+        query += ' ORDER BY date ASC'
+
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def get_price_coverage(self, symbol: str) -> Optional[Dict]:
+        """Lấy khoảng ngày đã tải dữ liệu giá cho một mã"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT symbol, start_date, end_date, updated_at
+            FROM price_history_coverage
+            WHERE symbol = ?
+        ''', (symbol.upper(),))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def update_price_coverage(self, symbol: str, start_date: str, end_date: str) -> bool:
+        """Cập nhật khoảng ngày đã tải dữ liệu giá cho một mã"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO price_history_coverage
+                (symbol, start_date, end_date, updated_at)
+                VALUES (?, ?, ?, ?)
+            ''', (symbol.upper(), start_date, end_date, datetime.now().isoformat()))
+            self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error updating price coverage for {symbol}: {e}")
+            return False
+
+    def get_price_history_symbols(self) -> List[str]:
+        """Lấy danh sách mã đã có dữ liệu giá cục bộ"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT symbol FROM price_history_coverage ORDER BY symbol')
+        return [row['symbol'] for row in cursor.fetchall()]
+
+    def delete_price_history(self, symbol: str) -> bool:
+        """Xóa toàn bộ dữ liệu giá đã lưu của một mã"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM price_history WHERE symbol = ?', (symbol.upper(),))
+            cursor.execute('DELETE FROM price_history_coverage WHERE symbol = ?', (symbol.upper(),))
+            self.conn.commit()
+            logger.info(f"Deleted price history for {symbol}")
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting price history for {symbol}: {e}")
+            return False
+
+    # ========== FINANCIAL STATEMENT CACHE OPERATIONS ==========
+
+    def save_financial_statement(self, symbol: str, statement_type: str, period: str,
+                                 lang: str, statement_data: str,
+                                 latest_period: Optional[str] = None) -> bool:
+        """
+        Lưu (upsert) một báo cáo tài chính đã tải
+
+        Args:
+            symbol: Mã cổ phiếu
+            statement_type: income_statement, balance_sheet, cash_flow, ratio
+            period: Kỳ báo cáo (quarterly/year)
+            lang: Ngôn ngữ (vi/en)
+            statement_data: DataFrame đã serialize (JSON orient='split')
+            latest_period: Kỳ báo cáo mới nhất trong dữ liệu (VD: 2025-Q3)
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO financial_statement_cache
+                (symbol, statement_type, period, lang, statement_data, latest_period, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', (symbol.upper(), statement_type, period, lang, statement_data,
+                  latest_period, datetime.now().isoformat()))
+            self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error saving {statement_type} for {symbol}: {e}")
+            return False
+
+    def get_financial_statement(self, symbol: str, statement_type: str, period: str,
+                                lang: str) -> Optional[Dict]:
+        """Lấy báo cáo tài chính đã lưu (statement_data, latest_period, fetched_at)"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT symbol, statement_type, period, lang, statement_data, latest_period, fetched_at
+            FROM financial_statement_cache
+            WHERE symbol = ? AND statement_type = ? AND period = ? AND lang = ?
+        ''', (symbol.upper(), statement_type, period, lang))
+        row = cursor.fetchone()
+        return dict(row) if row else None
+
+    def delete_financial_statements(self, symbol: str = None) -> int:
+        """Xóa BCTC đã lưu của một mã (None = xóa tất cả)"""
+        try:
+            cursor = self.conn.cursor()
+            if symbol:
+                cursor.execute('DELETE FROM financial_statement_cache WHERE symbol = ?', (symbol.upper(),))
+            else:
+                cursor.execute('DELETE FROM financial_statement_cache')
+            deleted = cursor.rowcount
+            self.conn.commit()
+            logger.info(f"Deleted {deleted} cached financial statements")
+            return deleted
+        except Exception as e:
+            logger.error(f"Error deleting cached financial statements: {e}")
+            return 0
     
+    # ========== INDICATOR STATE OPERATIONS ==========
+
+    def save_indicator_states(self, symbol: str, states: List[Dict]) -> bool:
+        """
+        Lưu toàn bộ trạng thái chỉ báo của một mã (thay thế bản cũ)
+
+        Args:
+            symbol: Mã cổ phiếu
+            states: List dict có keys indicator, kind, params (JSON), state (JSON), last_bar
+        """
+        try:
+            cursor = self.conn.cursor()
+            now = datetime.now().isoformat()
+            cursor.execute('DELETE FROM indicator_state WHERE symbol = ?', (symbol.upper(),))
+            cursor.executemany('''
+                INSERT INTO indicator_state
+                (symbol, indicator, params, kind, state, last_bar, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', [
+                (symbol.upper(), s['indicator'], s['params'], s['kind'], s['state'], s['last_bar'], now)
+                for s in states
+            ])
+            self.conn.commit()
+            return True
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Error saving indicator state for {symbol}: {e}")
+            return False
+
+    def get_indicator_states(self, symbol: str) -> List[Dict]:
+        """Lấy trạng thái chỉ báo đã lưu của một mã"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT symbol, indicator, params, kind, state, last_bar, updated_at
+            FROM indicator_state
+            WHERE symbol = ?
+        ''', (symbol.upper(),))
+        return [dict(row) for row in cursor.fetchall()]
+
+    def delete_indicator_states(self, symbol: str) -> bool:
+        """Xóa trạng thái chỉ báo của một mã (lần sau sẽ khởi tạo lại)"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM indicator_state WHERE symbol = ?', (symbol.upper(),))
+            self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting indicator state for {symbol}: {e}")
+            return False
+
+    # ========== RETRY QUEUE OPERATIONS ==========
+
+    def enqueue_retry(self, symbol: str, task: str = 'classify', error: str = None,
+                      base_delay_seconds: int = 60, max_delay_seconds: int = 3600) -> int:
+        """
+        Đưa mã vào hàng đợi thử lại với exponential backoff
+
+        Lần thứ n được hẹn sau min(base_delay * 2^(n-1), max_delay) giây.
+
+        Args:
+            symbol: Mã cổ phiếu
+            task: Loại tác vụ cần chạy lại (VD: classify)
+            error: Lỗi gần nhất
+            base_delay_seconds: Thời gian chờ cho lần thử đầu
+            max_delay_seconds: Thời gian chờ tối đa
+
+        Returns:
+            int: Số lần đã thất bại (attempts), 0 nếu lỗi
+        """
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                SELECT attempts, created_at FROM retry_queue
+                WHERE task = ? AND symbol = ?
+            ''', (task, symbol.upper()))
+            row = cursor.fetchone()
+
+            now = datetime.now()
+            attempts = (row['attempts'] if row else 0) + 1
+            delay = min(max_delay_seconds, base_delay_seconds * 2 ** (attempts - 1))
+            next_attempt_at = now + timedelta(seconds=delay)
+
+            cursor.execute('''
+                INSERT OR REPLACE INTO retry_queue
+                (task, symbol, attempts, next_attempt_at, last_error, created_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (task, symbol.upper(), attempts, next_attempt_at.isoformat(), error,
+                  row['created_at'] if row else now.isoformat()))
+            self.conn.commit()
+            logger.info(f"Queued {symbol} for {task} retry #{attempts} at {next_attempt_at:%H:%M:%S}")
+            return attempts
+        except Exception as e:
+            logger.error(f"Error queueing retry for {symbol}: {e}")
+            return 0
+
+    def get_due_retries(self, task: str = 'classify', limit: int = None) -> List[Dict]:
+        """Lấy các mã đã đến hạn thử lại (sớm nhất trước)"""
+        cursor = self.conn.cursor()
+        query = '''
+            SELECT task, symbol, attempts, next_attempt_at, last_error, created_at
+            FROM retry_queue
+            WHERE task = ? AND next_attempt_at <= ?
+            ORDER BY next_attempt_at ASC
+        '''
+        params = [task, datetime.now().isoformat()]
+
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def remove_retry(self, symbol: str, task: str = 'classify') -> bool:
+        """Xóa mã khỏi hàng đợi thử lại"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM retry_queue WHERE task = ? AND symbol = ?',
+                           (task, symbol.upper()))
+            self.conn.commit()
+            return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error removing retry for {symbol}: {e}")
+            return False
+
+    def remove_retries(self, symbols: List[str], task: str = 'classify') -> int:
+        """Xóa nhiều mã khỏi hàng đợi thử lại (một transaction)"""
+        if not symbols:
+            return 0
+        try:
+            cursor = self.conn.cursor()
+            cursor.executemany('DELETE FROM retry_queue WHERE task = ? AND symbol = ?',
+                               [(task, symbol.upper()) for symbol in symbols])
+            self.conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Error removing retries: {e}")
+            return 0
+
+    def get_retry_queue(self, task: str = 'classify') -> List[Dict]:
+        """Lấy toàn bộ hàng đợi thử lại"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT task, symbol, attempts, next_attempt_at, last_error, created_at
+            FROM retry_queue
+            WHERE task = ?
+            ORDER BY next_attempt_at ASC
+        ''', (task,))
+        return [dict(row) for row in cursor.fetchall()]
+
+    # ========== SYMBOL METRICS OPERATIONS ==========
+
+    def upsert_symbol_metrics(self, rows: List[Dict], source: str = None) -> int:
+        """
+        Cập nhật chỉ số của nhiều mã (chỉ ghi đè các cột có trong từng dict)
+
+        Args:
+            rows: List dict có key symbol và các cột trong SYMBOL_METRIC_COLUMNS
+            source: 'ta' hoặc 'fa' để cập nhật ta_updated_at / fa_updated_at
+
+        Returns:
+            int: Số mã đã cập nhật
+        """
+        if not rows:
+            return 0
+
+        try:
+            cursor = self.conn.cursor()
+            now = datetime.now().isoformat()
+            time_columns = ['updated_at'] + ([f'{source}_updated_at'] if source in ('ta', 'fa') else [])
+
+            # Gom theo bộ cột để executemany một câu lệnh cho mỗi nhóm
+            groups: Dict[tuple, List[tuple]] = {}
+            for row in rows:
+                columns = tuple(c for c in SYMBOL_METRIC_COLUMNS if c in row)
+                values = tuple(row[c] for c in columns) + (now,) * len(time_columns)
+                groups.setdefault(columns, []).append((row['symbol'].upper(),) + values)
+
+            for columns, values in groups.items():
+                all_columns = list(columns) + time_columns
+                cursor.executemany(f'''
+                    INSERT INTO symbol_metrics (symbol, {', '.join(all_columns)})
+                    VALUES ({', '.join('?' * (len(all_columns) + 1))})
+                    ON CONFLICT(symbol) DO UPDATE SET
+                    {', '.join(f'{c} = excluded.{c}' for c in all_columns)}
+                ''', values)
+
+            self.conn.commit()
+            return len(rows)
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Error saving symbol metrics: {e}")
+            return 0
+
+    def query_symbol_metrics(self, where: str = None, params: List = None,
+                             order_by: str = None, limit: int = None) -> List[Dict]:
+        """
+        Truy vấn bảng symbol_metrics
+
+        where / order_by phải do screener_query biên dịch (chỉ gồm tên cột hợp lệ
+        và placeholder ?), giá trị truyền qua params.
+
+        Returns:
+            List[Dict]: Các mã thỏa điều kiện
+        """
+        query = 'SELECT * FROM symbol_metrics'
+        params = list(params or [])
+        if where:
+            query += f' WHERE {where}'
+        if order_by:
+            query += f' ORDER BY {order_by}'
+        if limit:
+            query += ' LIMIT ?'
+            params.append(limit)
+
+        cursor = self.conn.cursor()
+        cursor.execute(query, params)
+        return [dict(row) for row in cursor.fetchall()]
+
+    def delete_symbol_metrics(self, symbol: str) -> bool:
+        """Xóa chỉ số của một mã"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM symbol_metrics WHERE symbol = ?', (symbol.upper(),))
+            self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting symbol metrics for {symbol}: {e}")
+            return False
+
+    # ========== SCAN JOB OPERATIONS ==========
+
+    def create_scan_job(self, job_id: str, job_type: str, params: Dict, params_key: str) -> bool:
+        """Tạo scan job mới (trạng thái queued)"""
+        try:
+            now = datetime.now().isoformat()
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                INSERT INTO scan_jobs (job_id, job_type, params, params_key, status, created_at, updated_at)
+                VALUES (?, ?, ?, ?, 'queued', ?, ?)
+            ''', (job_id, job_type, json.dumps(params), params_key, now, now))
+            self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error creating scan job {job_id}: {e}")
+            return False
+
+    def update_scan_job(self, job_id: str, **kwargs) -> bool:
+        """
+        Cập nhật scan job
+
+        Args:
+            job_id: ID job
+            **kwargs: status, completed, total, result (dict), error,
+                      started_at, finished_at
+        """
+        allowed_fields = ['status', 'completed', 'total', 'result', 'error', 'started_at', 'finished_at']
+        updates = {k: v for k, v in kwargs.items() if k in allowed_fields}
+        if not updates:
+            return False
+
+        if 'result' in updates and updates['result'] is not None:
+            updates['result'] = json.dumps(updates['result'], default=str)
+        updates['updated_at'] = datetime.now().isoformat()
+
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute(
+                f"UPDATE scan_jobs SET {', '.join(f'{k} = ?' for k in updates)} WHERE job_id = ?",
+                list(updates.values()) + [job_id]
+            )
+            self.conn.commit()
+            return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error updating scan job {job_id}: {e}")
+            return False
+
+    def _scan_job_from_row(self, row) -> Dict:
+        job = dict(row)
+        job['params'] = json.loads(job['params']) if job['params'] else {}
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        return job
+
+    def get_scan_job(self, job_id: str) -> Optional[Dict]:
+        """Lấy scan job theo ID"""
+        cursor = self.conn.cursor()
+        cursor.execute('SELECT * FROM scan_jobs WHERE job_id = ?', (job_id,))
+        row = cursor.fetchone()
+        return self._scan_job_from_row(row) if row else None
+
+    def find_active_scan_job(self, params_key: str) -> Optional[Dict]:
+        """Tìm job đang chờ / đang chạy với cùng loại và tham số"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT * FROM scan_jobs
+            WHERE params_key = ? AND status IN ('queued', 'running')
+            ORDER BY created_at DESC LIMIT 1
+        ''', (params_key,))
+        row = cursor.fetchone()
+        return self._scan_job_from_row(row) if row else None
+
+    def get_scan_jobs(self, status: str = None, limit: int = 50) -> List[Dict]:
+        """Danh sách scan job (mới nhất trước, không kèm result)"""
+        query = '''
+            SELECT job_id, job_type, params, status, completed, total, error,
+                   created_at, started_at, finished_at, updated_at
+            FROM scan_jobs
+        '''
+        params: List = []
+        if status:
+            query += ' WHERE status = ?'
+            params.append(status)
+        query += ' ORDER BY created_at DESC LIMIT ?'
+        params.append(limit)
+
+        cursor = self.conn.cursor()
+        cursor.execute(query, params)
+        jobs = []
+        for row in cursor.fetchall():
+            job = dict(row)
+            job['params'] = json.loads(job['params']) if job['params'] else {}
+            jobs.append(job)
+        return jobs
+
+    def add_scan_job_result(self, job_id: str, seq: int, symbol: str, data: Dict) -> bool:
+        """Lưu kết quả một mã của scan job"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO scan_job_results (job_id, seq, symbol, data)
+                VALUES (?, ?, ?, ?)
+            ''', (job_id, seq, symbol, json.dumps(data, default=str)))
+            self.conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Error saving result {seq} of scan job {job_id}: {e}")
+            return False
+
+    def get_scan_job_results(self, job_id: str, offset: int = 0, limit: int = 100) -> List[Dict]:
+        """Kết quả từng mã của scan job theo thứ tự hoàn thành"""
+        cursor = self.conn.cursor()
+        cursor.execute('''
+            SELECT seq, symbol, data FROM scan_job_results
+            WHERE job_id = ? AND seq > ?
+            ORDER BY seq ASC LIMIT ?
+        ''', (job_id, offset, limit))
+        return [{'seq': row['seq'], 'symbol': row['symbol'], 'data': json.loads(row['data'])}
+                for row in cursor.fetchall()]
+
+    def clear_scan_job_results(self, job_id: str) -> int:
+        """Xóa kết quả từng mã của scan job (khi chạy lại)"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM scan_job_results WHERE job_id = ?', (job_id,))
+            self.conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Error clearing results of scan job {job_id}: {e}")
+            return 0
+
+    def delete_scan_job(self, job_id: str) -> bool:
+        """Xóa scan job và kết quả của nó"""
+        try:
+            cursor = self.conn.cursor()
+            cursor.execute('DELETE FROM scan_job_results WHERE job_id = ?', (job_id,))
+            cursor.execute('DELETE FROM scan_jobs WHERE job_id = ?', (job_id,))
+            self.conn.commit()
+            return cursor.rowcount > 0
+        except Exception as e:
+            logger.error(f"Error deleting scan job {job_id}: {e}")
+            return False
+
+    def delete_old_scan_jobs(self, days: int = 7) -> int:
+        """Xóa các job đã kết thúc quá số ngày chỉ định (kèm kết quả)"""
+        try:
+            cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+            cursor = self.conn.cursor()
+            cursor.execute('''
+                DELETE FROM scan_job_results WHERE job_id IN (
+                    SELECT job_id FROM scan_jobs
+                    WHERE status NOT IN ('queued', 'running') AND created_at < ?
+                )
+            ''', (cutoff,))
+            cursor.execute('''
+                DELETE FROM scan_jobs
+                WHERE status NOT IN ('queued', 'running') AND created_at < ?
+            ''', (cutoff,))
+            self.conn.commit()
+            return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Error deleting old scan jobs: {e}")
+            return 0
+
     # ========== STOCK CLASSIFICATION CACHE OPERATIONS ==========
     
     def save_classification_result(self, symbol: str, data: Dict, exchange: str = 'HOSE') -> bool:
@@ -531,39 +1424,80 @@ class VNStockDB:
         Returns:
             bool: True nếu lưu thành công
         """
+        return self.save_classification_results([(symbol, data, exchange)]) == 1
+    
+    def save_classification_results(self, items: List[Tuple[str, Dict, str]]) -> int:
+        """
+        Lưu nhiều kết quả classification trong một transaction
+        
+        Args:
+            items: List (symbol, data, exchange)
+        
+        Returns:
+            int: Số kết quả đã lưu (bỏ qua kết quả không serialize được;
+                 0 nếu lỗi ghi - không lưu kết quả nào)
+        """
+        if not items:
+            return 0
+        
+        now = datetime.now()
+        rows = []
         try:
-            cursor = self.conn.cursor()
+            for symbol, data, exchange in items:
+                # Bản ghi lỗi (VD: không serialize được) chỉ bỏ qua bản ghi đó
+                try:
+                    classifications = data.get('classifications', {})
+                    overall = data.get('overall_rating', {})
+                    rows.append((
+                        symbol.upper(),
+                        json.dumps(data),
+                        now.isoformat(),
+                        int(now.timestamp()),
+                        (exchange or 'HOSE').upper(),
+                        classifications.get('growth', {}).get('category'),
+                        classifications.get('growth', {}).get('score'),
+                        classifications.get('risk', {}).get('category'),
+                        classifications.get('risk', {}).get('risk_score'),
+                        classifications.get('market_cap', {}).get('category'),
+                        classifications.get('momentum', {}).get('category'),
+                        overall.get('rating'),
+                        overall.get('score'),
+                        overall.get('recommendation')
+                    ))
+                except Exception as e:
+                    logger.error(f"Skipping classification for {symbol}: {e}")
             
-            classifications = data.get('classifications', {})
-            overall = data.get('overall_rating', {})
+            if not rows:
+                return 0
             
-            cursor.execute('''
+            cursor = self.conn.cursor()
+            cursor.executemany('''
                 INSERT OR REPLACE INTO stock_classification_cache 
-                (symbol, classification_data, scan_timestamp, exchange,
+                (symbol, classification_data, scan_timestamp, scan_epoch, exchange,
                  growth_category, growth_score, risk_category, risk_score,
-                 market_cap_category, momentum_category, overall_rating, overall_score)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                symbol.upper(),
-                json.dumps(data),
-                datetime.now().isoformat(),
-                exchange.upper(),
-                classifications.get('growth', {}).get('category'),
-                classifications.get('growth', {}).get('score'),
-                classifications.get('risk', {}).get('category'),
-                classifications.get('risk', {}).get('risk_score'),
-                classifications.get('market_cap', {}).get('category'),
-                classifications.get('momentum', {}).get('category'),
-                overall.get('rating'),
-                overall.get('score')
-            ))
+                 market_cap_category, momentum_category, overall_rating, overall_score,
+                 recommendation)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ''', rows)
+            
+            # Lịch sử: kết quả mới nhất trong ngày thay bản trước đó cùng ngày
+            cursor.executemany('''
+                INSERT OR REPLACE INTO classification_history
+                (scan_date, symbol, scan_epoch, exchange, rating_rank, overall_score, growth_score, risk_score)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ''', [(now.strftime('%Y-%m-%d'), row[0], row[3], row[4], _rating_rank(row[11]),
+                   row[12], row[6], row[8]) for row in rows])
             
             self.conn.commit()
-            logger.info(f"Saved classification for {symbol} to cache")
-            return True
+            if len(rows) == 1:
+                logger.info(f"Saved classification for {rows[0][0]} to cache")
+            else:
+                logger.info(f"Saved {len(rows)} classifications to cache")
+            return len(rows)
         except Exception as e:
+            self.conn.rollback()
             logger.error(f"Error saving classification: {e}")
-            return False
+            return 0
     
     def get_cached_classification(self, symbol: str, max_age_hours: int = 24) -> Optional[Dict]:
         """
@@ -583,8 +1517,8 @@ class VNStockDB:
                 SELECT classification_data, scan_timestamp
                 FROM stock_classification_cache
                 WHERE symbol = ?
-                AND datetime(scan_timestamp) > datetime('now', '-' || ? || ' hours')
-            ''', (symbol.upper(), max_age_hours))
+                AND scan_epoch > ?
+            ''', (symbol.upper(), _age_cutoff(max_age_hours)))
             
             row = cursor.fetchone()
             if row:
@@ -600,7 +1534,10 @@ class VNStockDB:
             return None
     
     def get_all_cached_classifications(self, exchange: str = None, max_age_hours: int = 24, 
-                                      min_rating: str = None, limit: int = None) -> List[Dict]:
+                                      min_rating: str = None, limit: int = None,
+                                      growth: str = None, risk: str = None, rating: str = None,
+                                      min_score: float = None, columns: List[str] = None,
+                                      as_dataframe: bool = False):
         """
         Lấy tất cả kết quả classification từ cache
         
@@ -609,29 +1546,54 @@ class VNStockDB:
             max_age_hours: Tuổi tối đa của cache (giờ)
             min_rating: Rating tối thiểu (A+, A, B, C, D, F)
             limit: Giới hạn số lượng kết quả
+            growth, risk, rating: Lọc đúng growth_category / risk_category / overall_rating
+            min_score: overall_score tối thiểu
+            columns: Chỉ lấy các cột này (tên trong CLASSIFICATION_CACHE_COLUMNS),
+                     đọc thẳng từ cột của bảng, không decode classification_data.
+                     None = kết quả đầy đủ (decode JSON từng dòng)
+            as_dataframe: Trả về DataFrame (chỉ dùng với columns)
         
         Returns:
-            List[Dict]: Danh sách kết quả
+            List[Dict] (hoặc DataFrame nếu as_dataframe): Danh sách kết quả
+        
+        Raises:
+            ValueError: Cột không hỗ trợ
         """
+        if columns is not None:
+            unknown = [c for c in columns if c not in CLASSIFICATION_CACHE_COLUMNS]
+            if unknown:
+                raise ValueError(f"Cột không hỗ trợ: {', '.join(unknown)}")
+            select = ', '.join(f'{CLASSIFICATION_CACHE_COLUMNS[c]} AS {c}' for c in columns)
+        else:
+            select = 'symbol, classification_data, scan_timestamp'
+        
         try:
             cursor = self.conn.cursor()
             
             # Build query
-            query = '''
-                SELECT symbol, classification_data, scan_timestamp
+            query = f'''
+                SELECT {select}
                 FROM stock_classification_cache
-                WHERE datetime(scan_timestamp) > datetime('now', '-' || ? || ' hours')
+                WHERE scan_epoch > ?
             '''
-            params = [max_age_hours]
+            params = [_age_cutoff(max_age_hours)]
             
             if exchange:
                 query += ' AND exchange = ?'
                 params.append(exchange.upper())
             
+            for column, value in (('growth_category', growth), ('risk_category', risk),
+                                  ('overall_rating', rating)):
+                if value:
+                    query += f' AND {column} = ?'
+                    params.append(value)
+            
             if min_rating:
                 # Convert rating to score for comparison
                 rating_scores = {'A+': 8, 'A': 7, 'B': 6, 'C': 5, 'D': 4, 'F': 0}
-                min_score = rating_scores.get(min_rating, 0)
+                min_score = max(min_score or 0, rating_scores.get(min_rating, 0))
+            
+            if min_score:
                 query += ' AND overall_score >= ?'
                 params.append(min_score)
             
@@ -641,6 +1603,14 @@ class VNStockDB:
                 query += ' LIMIT ?'
                 params.append(limit)
             
+            if columns is not None:
+                if as_dataframe:
+                    import pandas as pd
+                    cursor.row_factory = None  # Tuple - tạo DataFrame một lần
+                    return pd.DataFrame.from_records(cursor.execute(query, params).fetchall(),
+                                                     columns=columns)
+                return [dict(row) for row in cursor.execute(query, params).fetchall()]
+            
             cursor.execute(query, params)
             
             results = []
@@ -658,6 +1628,9 @@ class VNStockDB:
             return results
         except Exception as e:
             logger.error(f"Error getting all cached classifications: {e}")
+            if as_dataframe and columns is not None:
+                import pandas as pd
+                return pd.DataFrame(columns=columns)
             return []
     
     def get_outdated_classifications(self, max_age_hours: int = 24, limit: int = None) -> List[Dict]:
@@ -677,10 +1650,10 @@ class VNStockDB:
             query = '''
                 SELECT symbol, scan_timestamp
                 FROM stock_classification_cache
-                WHERE datetime(scan_timestamp) <= datetime('now', '-' || ? || ' hours')
-                ORDER BY scan_timestamp ASC
+                WHERE scan_epoch <= ?
+                ORDER BY scan_epoch ASC
             '''
-            params = [max_age_hours]
+            params = [_age_cutoff(max_age_hours)]
             
             if limit:
                 query += ' LIMIT ?'
@@ -722,8 +1695,8 @@ class VNStockDB:
             
             fresh_24h = cursor.execute('''
                 SELECT COUNT(*) FROM stock_classification_cache
-                WHERE datetime(scan_timestamp) > datetime('now', '-24 hours')
-            ''').fetchone()[0]
+                WHERE scan_epoch > ?
+            ''', (_age_cutoff(24),)).fetchone()[0]
             
             outdated = total - fresh_24h
             
@@ -740,6 +1713,167 @@ class VNStockDB:
             logger.error(f"Error getting cache stats: {e}")
             return {}
     
+    # ========== CLASSIFICATION HISTORY OPERATIONS ==========
+
+    def get_classification_history(self, symbol: str, days: int = 90) -> List[Dict]:
+        """
+        Chuỗi kết quả phân loại theo ngày của một mã
+
+        Args:
+            symbol: Mã cổ phiếu
+            days: Số ngày gần nhất
+
+        Returns:
+            List[Dict]: scan_date, overall_rating, overall_score, growth_score,
+            risk_score (cũ -> mới)
+        """
+        try:
+            cursor = self.conn.cursor()
+            start = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+            cursor.execute('''
+                SELECT scan_date, exchange, rating_rank, overall_score, growth_score, risk_score
+                FROM classification_history
+                WHERE symbol = ? AND scan_date >= ?
+                ORDER BY scan_date ASC
+            ''', (symbol.upper(), start))
+
+            history = []
+            for row in cursor.fetchall():
+                item = dict(row)
+                rank = item.pop('rating_rank')
+                item['overall_rating'] = RATING_RANKS[rank] if rank is not None else None
+                history.append(item)
+            return history
+        except Exception as e:
+            logger.error(f"Error getting classification history for {symbol}: {e}")
+            return []
+
+    def get_rating_changes(self, days: int = 7, direction: str = None,
+                           exchange: str = None, limit: int = None) -> List[Dict]:
+        """
+        Các mã đổi rating trong N ngày gần nhất
+
+        So sánh kết quả mới nhất trong khoảng với kết quả cuối cùng trước
+        khoảng (nếu chưa có thì kết quả đầu tiên trong khoảng).
+
+        Args:
+            days: Số ngày gần nhất
+            direction: 'upgrade', 'downgrade' hoặc None (cả hai)
+            exchange: Lọc theo sàn
+            limit: Giới hạn số lượng
+
+        Returns:
+            List[Dict]: symbol, exchange, from_rating, to_rating, from_score,
+            to_score, from_date, to_date, rank_change (mức thay đổi lớn trước)
+        """
+        comparisons = {'upgrade': '>', 'downgrade': '<', None: '!='}
+        if direction not in comparisons:
+            raise ValueError(f"direction không hỗ trợ: {direction}")
+
+        try:
+            cursor = self.conn.cursor()
+            start = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d')
+
+            # cur: dòng mới nhất của mỗi mã trong khoảng (SQLite lấy các cột
+            # bare của dòng có MAX(scan_date))
+            query = f'''
+                WITH cur AS (
+                    SELECT symbol, exchange, rating_rank, overall_score, MAX(scan_date) AS scan_date
+                    FROM classification_history
+                    WHERE scan_date >= ?
+                    GROUP BY symbol
+                ),
+                base AS (
+                    SELECT cur.*, COALESCE(
+                        (SELECT b.scan_date FROM classification_history b
+                         WHERE b.symbol = cur.symbol AND b.scan_date < ?
+                         ORDER BY b.scan_date DESC LIMIT 1),
+                        (SELECT MIN(b.scan_date) FROM classification_history b
+                         WHERE b.symbol = cur.symbol AND b.scan_date >= ?)
+                    ) AS from_date
+                    FROM cur
+                )
+                SELECT base.symbol, base.exchange,
+                       prev.rating_rank AS from_rank, base.rating_rank AS to_rank,
+                       prev.overall_score AS from_score, base.overall_score AS to_score,
+                       base.from_date, base.scan_date AS to_date
+                FROM base
+                JOIN classification_history prev
+                  ON prev.symbol = base.symbol AND prev.scan_date = base.from_date
+                WHERE base.rating_rank {comparisons[direction]} prev.rating_rank
+            '''
+            params = [start, start, start]
+
+            if exchange:
+                query += ' AND base.exchange = ?'
+                params.append(exchange.upper())
+
+            query += ' ORDER BY ABS(base.rating_rank - prev.rating_rank) DESC, base.overall_score DESC'
+
+            if limit:
+                query += ' LIMIT ?'
+                params.append(limit)
+
+            changes = []
+            for row in cursor.execute(query, params).fetchall():
+                changes.append({
+                    'symbol': row['symbol'],
+                    'exchange': row['exchange'],
+                    'from_rating': RATING_RANKS[row['from_rank']],
+                    'to_rating': RATING_RANKS[row['to_rank']],
+                    'rank_change': row['to_rank'] - row['from_rank'],
+                    'from_score': row['from_score'],
+                    'to_score': row['to_score'],
+                    'from_date': row['from_date'],
+                    'to_date': row['to_date']
+                })
+            return changes
+        except Exception as e:
+            logger.error(f"Error getting rating changes: {e}")
+            return []
+
+    def compact_classification_history(self, daily_days: int = HISTORY_DAILY_DAYS,
+                                       max_days: int = HISTORY_MAX_DAYS) -> Dict[str, int]:
+        """
+        Dọn lịch sử phân loại theo chính sách lưu trữ
+
+        - Trong daily_days ngày gần nhất: giữ mọi bản ghi theo ngày
+        - Cũ hơn: mỗi mã chỉ giữ bản ghi cuối cùng của mỗi tuần
+        - Cũ hơn max_days ngày: xóa
+
+        Returns:
+            Dict: downsampled (số dòng gộp theo tuần), deleted (số dòng quá hạn)
+        """
+        try:
+            cursor = self.conn.cursor()
+            now = datetime.now()
+            daily_cutoff = (now - timedelta(days=daily_days)).strftime('%Y-%m-%d')
+            max_cutoff = (now - timedelta(days=max_days)).strftime('%Y-%m-%d')
+
+            cursor.execute('DELETE FROM classification_history WHERE scan_date < ?', (max_cutoff,))
+            deleted = cursor.rowcount
+
+            cursor.execute('''
+                DELETE FROM classification_history
+                WHERE scan_date < ?
+                AND EXISTS (
+                    SELECT 1 FROM classification_history later
+                    WHERE later.symbol = classification_history.symbol
+                    AND later.scan_date > classification_history.scan_date
+                    AND later.scan_date < ?
+                    AND date(later.scan_date, 'weekday 0') = date(classification_history.scan_date, 'weekday 0')
+                )
+            ''', (daily_cutoff, daily_cutoff))
+            downsampled = cursor.rowcount
+
+            self.conn.commit()
+            logger.info(f"Compacted classification history: {downsampled} downsampled, {deleted} deleted")
+            return {'downsampled': downsampled, 'deleted': deleted}
+        except Exception as e:
+            self.conn.rollback()
+            logger.error(f"Error compacting classification history: {e}")
+            return {'downsampled': 0, 'deleted': 0}
+
     def clear_all_data(self, confirm: bool = False):
         """Clear all data (USE WITH CAUTION!)"""
         if not confirm:
@@ -762,6 +1896,83 @@ class VNStockDB:
             return False
 
 
+class BatchWriter:
+    """
+    Gom các bản ghi và ghi theo lô (thread-safe)
+
+    flush_func nhận list bản ghi và ghi trong một transaction (VD:
+    VNStockDB.save_classification_results). Lô được ghi khi đủ max_size bản
+    ghi, khi bản ghi cũ nhất đã chờ quá max_delay giây (kiểm tra lúc add), hoặc
+    khi flush() / close(). Sau close(), bản ghi đến muộn (VD: worker quá timeout
+    vẫn chạy xong) được ghi ngay. Dùng được như context manager.
+    """
+
+    def __init__(self, flush_func: Callable[[List[Any]], int],
+                 max_size: int = DEFAULT_BATCH_SIZE,
+                 max_delay: float = DEFAULT_BATCH_MAX_DELAY_SECONDS):
+        self.flush_func = flush_func
+        self.max_size = max(1, max_size)
+        self.max_delay = max_delay
+        self._buffer: List[Any] = []
+        self._first_added: Optional[float] = None
+        self._lock = threading.Lock()
+        self._closed = False
+        self.written = 0
+        self.batches = 0
+
+    def add(self, item: Any):
+        """Thêm bản ghi, ghi lô nếu đạt ngưỡng số lượng hoặc thời gian"""
+        with self._lock:
+            if not self._buffer:
+                self._first_added = time.monotonic()
+            self._buffer.append(item)
+            if (self._closed or len(self._buffer) >= self.max_size
+                    or time.monotonic() - self._first_added >= self.max_delay):
+                self._flush_locked()
+
+    def flush(self) -> int:
+        """Ghi các bản ghi đang chờ, trả về số bản ghi đã ghi"""
+        with self._lock:
+            return self._flush_locked()
+
+    def _flush_locked(self) -> int:
+        """Ghi lô hiện tại (gọi khi đang giữ lock)"""
+        if not self._buffer:
+            return 0
+        items, self._buffer = self._buffer, []
+        try:
+            written = self.flush_func(items)
+        except Exception as e:
+            logger.error(f"Error writing batch of {len(items)} records: {e}")
+            written = 0
+        if not written and len(items) > 1:
+            # Lô lỗi: ghi lại từng bản ghi để một bản ghi hỏng không làm mất cả lô
+            written = sum(self._write_one(item) for item in items)
+        self.written += written
+        self.batches += 1
+        return written
+
+    def _write_one(self, item: Any) -> int:
+        """Ghi riêng một bản ghi (khi ghi cả lô lỗi)"""
+        try:
+            return self.flush_func([item])
+        except Exception as e:
+            logger.error(f"Error writing record, dropped: {e}")
+            return 0
+
+    def close(self) -> int:
+        """Ghi nốt các bản ghi còn lại"""
+        with self._lock:
+            self._closed = True
+            return self._flush_locked()
+
+    def __enter__(self) -> 'BatchWriter':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
 # Singleton instance
 _db_instance = None
 
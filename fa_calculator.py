@@ -8,17 +8,22 @@ from datetime import datetime
 from typing import Dict, Any, Optional
 import logging
 
+from data_store import SymbolDataBundle
+from screener_query import record_fundamentals
+
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def calculate_fa_ratios(symbol: str) -> Dict[str, Any]:
+def calculate_fa_ratios(symbol: str, bundle: Optional[SymbolDataBundle] = None) -> Dict[str, Any]:
     """
     Tính toán các chỉ số phân tích cơ bản (FA) cho một mã cổ phiếu
     
     Args:
         symbol: Mã cổ phiếu (VD: VIC, VCB, FPT)
+        bundle: Dữ liệu đã tải sẵn của mã (dùng chung với TA/Classifier).
+                None = tự tải (giá 7 ngày + KQKD + CĐKT)
     
     Returns:
         Dictionary chứa các chỉ số FA:
@@ -27,32 +32,28 @@ def calculate_fa_ratios(symbol: str) -> Dict[str, Any]:
         - Biên lợi nhuận ròng (Net Profit Margin): Lợi nhuận ròng / Doanh thu
         - D/E (Debt to Equity): Nợ phải trả / Vốn chủ sở hữu
         - EPS (Earnings Per Share): Thu nhập mỗi cổ phiếu
+        Khi bị vnstock rate limit: {"error": ..., "symbol": ..., "rate_limited": True}
     """
     try:
-        from vnstock import Vnstock
-        
         logger.info(f"Bắt đầu tính toán FA ratios cho mã {symbol}")
         
-        # Khởi tạo vnstock client
-        stock = Vnstock().stock(symbol=symbol, source='VCI')
+        if bundle is None:
+            bundle = SymbolDataBundle(symbol, history_days=7)
         
         # 1. Lấy giá thị trường hiện tại
         logger.info("Lấy giá thị trường...")
         current_price = None
         try:
-            end_date = datetime.now().strftime("%Y-%m-%d")
-            start_date = (datetime.now() - pd.Timedelta(days=7)).strftime("%Y-%m-%d")
-            price_data = stock.quote.history(start=start_date, end=end_date)
-            
-            if not price_data.empty:
-                # Giá đóng cửa gần nhất (đã ở đơn vị nghìn đồng)
-                current_price = float(price_data.iloc[-1]['close'])
+            # Giá đóng cửa gần nhất (đã ở đơn vị nghìn đồng)
+            current_price = bundle.current_price
+            if current_price is not None:
                 logger.info(f"Giá hiện tại: {current_price} nghìn đồng")
         except SystemExit as e:
             logger.error(f"Rate limit hit for {symbol} when getting price: {str(e)}")
             return {
                 "error": f"Rate limit exceeded for {symbol}. Please wait and try again.",
-                "symbol": symbol
+                "symbol": symbol,
+                "rate_limited": True
             }
         except Exception as e:
             logger.warning(f"Không lấy được giá thị trường: {str(e)}")
@@ -61,7 +62,7 @@ def calculate_fa_ratios(symbol: str) -> Dict[str, Any]:
         logger.info("Lấy Báo cáo KQKD (4 quý gần nhất)...")
         income_statement = pd.DataFrame()
         try:
-            income_statement = stock.finance.income_statement(period='quarterly', lang='vi')
+            income_statement = bundle.income_statement
             if not income_statement.empty:
                 # Lấy 4 quý gần nhất
                 income_statement = income_statement.head(4)
@@ -70,7 +71,8 @@ def calculate_fa_ratios(symbol: str) -> Dict[str, Any]:
             logger.error(f"Rate limit hit for {symbol} when getting income statement: {str(e)}")
             return {
                 "error": f"Rate limit exceeded for {symbol}. Please wait and try again.",
-                "symbol": symbol
+                "symbol": symbol,
+                "rate_limited": True
             }
         except Exception as e:
             logger.warning(f"Không lấy được KQKD: {str(e)}")
@@ -79,7 +81,7 @@ def calculate_fa_ratios(symbol: str) -> Dict[str, Any]:
         logger.info("Lấy Bảng CĐKT (quý gần nhất)...")
         balance_sheet = pd.DataFrame()
         try:
-            balance_sheet = stock.finance.balance_sheet(period='quarterly', lang='vi')
+            balance_sheet = bundle.balance_sheet
             if not balance_sheet.empty:
                 # Lấy quý gần nhất
                 balance_sheet = balance_sheet.head(1)
@@ -89,7 +91,8 @@ def calculate_fa_ratios(symbol: str) -> Dict[str, Any]:
             logger.error(f"Rate limit hit for {symbol}: {str(e)}")
             return {
                 "error": f"Rate limit exceeded for {symbol}. Please wait and try again.",
-                "symbol": symbol
+                "symbol": symbol,
+                "rate_limited": True
             }
         except Exception as e:
             logger.warning(f"Không lấy được CĐKT: {str(e)}")
@@ -284,6 +287,13 @@ def calculate_fa_ratios(symbol: str) -> Dict[str, Any]:
         }
         
         logger.info(f"Hoàn thành tính toán FA ratios cho {symbol}: {complete_ratios}/{total_ratios} chỉ số")
+        
+        # Lưu tỷ số mới nhất cho screener query
+        try:
+            record_fundamentals(symbol, fa_ratios["ratios"])
+        except Exception as e:
+            logger.warning(f"Không lưu được metrics FA cho {symbol}: {e}")
+        
         return fa_ratios
         
     except Exception as e:
@@ -0,0 +1,289 @@
+"""
+Indicator Library - VNStock Shared Technical Indicators
+Một bản công thức duy nhất cho MA, EMA, RSI, MACD, Bollinger Bands, ATR, ADX,
+Stochastic dùng chung cho API (ta_analyzer), Dashboard, Classifier,
+advanced_indicators và panel_indicators.
+
+Các hàm nhận Series (một mã) hoặc DataFrame dạng rộng (nhiều mã). compute()
+thêm lớp memoization LRU theo (mã, phiên cuối, chỉ báo, tham số) để các lần
+gọi lặp lại trên cùng dữ liệu không phải tính lại.
+"""
+
+import inspect
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+import logging
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+Frame = Union[pd.Series, pd.DataFrame]
+
+# Số kết quả tối đa giữ trong cache (mỗi kết quả ~ vài KB cho 1 năm dữ liệu)
+DEFAULT_CACHE_SIZE = 2048
+
+# Setting (bảng settings) để chỉnh kích thước cache
+SETTING_CACHE_SIZE = 'indicator_cache_size'
+
+
+# ============= INDICATORS =============
+
+def sma(prices: Frame, period: int) -> Frame:
+    """Simple Moving Average"""
+    return prices.rolling(window=period).mean()
+
+
+def ema(prices: Frame, period: int) -> Frame:
+    """Exponential Moving Average"""
+    return prices.ewm(span=period, adjust=False).mean()
+
+
+def rsi(prices: Frame, period: int = 14) -> Frame:
+    """
+    RSI (Relative Strength Index), gain/loss trung bình trượt đơn giản
+
+    Args:
+        prices: Giá đóng cửa
+        period: Chu kỳ (mặc định 14)
+    """
+    delta = prices.diff()
+    gain = delta.where(delta > 0, 0).rolling(window=period).mean()
+    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
+    rs = gain / loss
+    return 100 - (100 / (1 + rs))
+
+
+def macd(prices: Frame, fast: int = 12, slow: int = 26, signal: int = 9) -> Tuple[Frame, Frame, Frame]:
+    """
+    MACD (Moving Average Convergence Divergence)
+
+    Returns:
+        Tuple (MACD line, Signal line, Histogram)
+    """
+    macd_line = ema(prices, fast) - ema(prices, slow)
+    signal_line = ema(macd_line, signal)
+    return macd_line, signal_line, macd_line - signal_line
+
+
+def bollinger_bands(prices: Frame, period: int = 20, std_dev: float = 2) -> Tuple[Frame, Frame, Frame]:
+    """
+    Bollinger Bands
+
+    Returns:
+        Tuple (Upper band, Middle band, Lower band)
+    """
+    middle = sma(prices, period)
+    std = prices.rolling(window=period).std()
+    return middle + std * std_dev, middle, middle - std * std_dev
+
+
+def true_range(high: Frame, low: Frame, close: Frame) -> Frame:
+    """True Range (bỏ qua NaN như concat(...).max(axis=1))"""
+    prev_close = close.shift()
+    return np.fmax(high - low, np.fmax((high - prev_close).abs(), (low - prev_close).abs()))
+
+
+def atr(high: Frame, low: Frame, close: Frame, period: int = 14) -> Frame:
+    """ATR (Average True Range)"""
+    return true_range(high, low, close).rolling(window=period).mean()
+
+
+def adx(high: Frame, low: Frame, close: Frame, period: int = 14) -> Tuple[Frame, Frame, Frame]:
+    """
+    ADX (Average Directional Index)
+
+    Returns:
+        Tuple (ADX, +DI, -DI)
+    """
+    average_range = atr(high, low, close, period)
+
+    up_move = high - high.shift()
+    down_move = low.shift() - low
+    plus_dm = up_move.where((up_move > down_move) & (up_move > 0), 0)
+    minus_dm = down_move.where((down_move > up_move) & (down_move > 0), 0)
+
+    plus_di = 100 * (plus_dm.rolling(window=period).mean() / average_range)
+    minus_di = 100 * (minus_dm.rolling(window=period).mean() / average_range)
+
+    dx = 100 * (plus_di - minus_di).abs() / (plus_di + minus_di)
+    return dx.rolling(window=period).mean(), plus_di, minus_di
+
+
+def stochastic(high: Frame, low: Frame, close: Frame,
+               k_period: int = 14, d_period: int = 3) -> Tuple[Frame, Frame]:
+    """
+    Stochastic Oscillator
+
+    Returns:
+        Tuple (%K, %D)
+    """
+    low_min = low.rolling(window=k_period).min()
+    high_max = high.rolling(window=k_period).max()
+    k_percent = 100 * ((close - low_min) / (high_max - low_min))
+    return k_percent, k_percent.rolling(window=d_period).mean()
+
+
+# Registry: tên -> (hàm, cột đầu vào khi truyền DataFrame OHLCV,
+# số phiên cuối cần để tính đúng giá trị mới nhất; None = cần toàn bộ chuỗi
+# vì EMA phụ thuộc vào mọi phiên trước đó)
+INDICATORS: Dict[str, Tuple[Callable, Tuple[str, ...], Callable[[Dict], Optional[int]]]] = {
+    'SMA': (sma, ('Close',), lambda p: p['period']),
+    'EMA': (ema, ('Close',), lambda p: None),
+    'RSI': (rsi, ('Close',), lambda p: p['period'] + 1),
+    'MACD': (macd, ('Close',), lambda p: None),
+    'BB': (bollinger_bands, ('Close',), lambda p: p['period']),
+    'ATR': (atr, ('High', 'Low', 'Close'), lambda p: p['period'] + 1),
+    'ADX': (adx, ('High', 'Low', 'Close'), lambda p: 2 * p['period']),
+    'STOCH': (stochastic, ('High', 'Low', 'Close'), lambda p: p['k_period'] + p['d_period'] - 1),
+}
+
+
+def _resolve_params(func: Callable, params: Dict) -> Dict:
+    """Tham số đầy đủ (kể cả giá trị mặc định), bỏ các tham số dữ liệu đầu vào"""
+    resolved = {}
+    for name, parameter in inspect.signature(func).parameters.items():
+        if name in params:
+            resolved[name] = params[name]
+        elif parameter.default is not inspect.Parameter.empty:
+            resolved[name] = parameter.default
+    return resolved
+
+
+def lookback(name: str, **params) -> Optional[int]:
+    """
+    Số phiên cuối cần để tính giá trị mới nhất của chỉ báo
+
+    Returns:
+        Số phiên, hoặc None nếu cần toàn bộ chuỗi (EMA, MACD)
+    """
+    if name not in INDICATORS:
+        raise ValueError(f"Chỉ báo không hỗ trợ: {name}")
+    func, _, bars = INDICATORS[name]
+    return bars(_resolve_params(func, params))
+
+
+# ============= MEMOIZATION =============
+
+class IndicatorCache:
+    """
+    Cache LRU có giới hạn cho kết quả chỉ báo (thread-safe)
+
+    Kết quả trả về được dùng chung giữa các lần gọi, caller không được sửa
+    trực tiếp (gán vào cột DataFrame khác thì không sao vì pandas copy).
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_CACHE_SIZE):
+        self.max_entries = max(1, max_entries)
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, key: Tuple, func: Callable[[], Any]) -> Any:
+        """Lấy kết quả theo key, tính bằng func() nếu chưa có"""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        # Tính ngoài lock để các mã khác không phải chờ
+        value = func()
+
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return value
+
+    def clear(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0
+            }
+
+
+# Singleton instance
+_indicator_cache = None
+_indicator_cache_lock = threading.Lock()
+
+
+def get_indicator_cache() -> IndicatorCache:
+    """Get indicator cache instance (singleton, kích thước đọc từ bảng settings)"""
+    global _indicator_cache
+    if _indicator_cache is None:
+        with _indicator_cache_lock:
+            if _indicator_cache is None:
+                size = DEFAULT_CACHE_SIZE
+                try:
+                    from database import get_db
+                    size = int(get_db().get_setting(SETTING_CACHE_SIZE, DEFAULT_CACHE_SIZE))
+                except Exception as e:
+                    logger.warning(f"Không đọc được {SETTING_CACHE_SIZE}, dùng mặc định: {e}")
+                _indicator_cache = IndicatorCache(size)
+    return _indicator_cache
+
+
+def _data_key(data: Frame) -> Tuple:
+    """
+    Nhận diện cửa sổ dữ liệu: cột, phiên đầu, phiên cuối, số phiên và giá trị
+    phiên cuối (phiên hôm nay còn thay đổi trong giờ giao dịch)
+    """
+    if len(data) == 0:
+        return (None,)
+    if isinstance(data, pd.DataFrame):
+        columns = tuple(data.columns)
+        last_values = tuple(data.iloc[-1].tolist())
+    else:
+        columns = data.name
+        last_values = data.iloc[-1]
+    return (columns, data.index[0], data.index[-1], len(data), last_values)
+
+
+def compute(name: str, data: Frame, symbol: Optional[str] = None, **params) -> Any:
+    """
+    Tính chỉ báo theo tên trong registry, có memoization khi biết mã
+
+    Args:
+        name: Tên chỉ báo (SMA, EMA, RSI, MACD, BB, ATR)
+        data: Series giá (hoặc volume), hoặc DataFrame có các cột đầu vào
+              của chỉ báo (VD: High, Low, Close cho ATR)
+        symbol: Mã cổ phiếu; None = tính trực tiếp, không cache
+        **params: Tham số của chỉ báo (VD: period=14)
+
+    Returns:
+        Kết quả của hàm chỉ báo (Series hoặc tuple Series)
+    """
+    if name not in INDICATORS:
+        raise ValueError(f"Chỉ báo không hỗ trợ: {name}")
+
+    func, inputs, _ = INDICATORS[name]
+    args = [data[column] for column in inputs] if isinstance(data, pd.DataFrame) else [data]
+
+    if symbol is None:
+        return func(*args, **params)
+
+    # Chuẩn hóa tham số (kể cả giá trị mặc định) để rsi() và rsi(period=14) cùng key
+    param_key = tuple(sorted(_resolve_params(func, params).items()))
+
+    key = (symbol.upper(), _data_key(data), name, param_key)
+    return get_indicator_cache().get_or_compute(key, lambda: func(*args, **params))
@@ -5,8 +5,10 @@ FastAPI Server cho VNStock Data Collector
 
 from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Iterator, List
+import json
 import uvicorn
 from datetime import datetime
 import logging
@@ -17,7 +19,14 @@ from ta_analyzer import calculate_ta_indicators, plot_technical_chart, get_ta_an
 from stock_screener import get_stock_list, screen_stock, run_screener
 from backtesting_strategy import run_ma_crossover_backtest
 from bluechip_detector import BlueChipDetector
-from stock_classifier import StockClassifier
+from stock_classifier import StockClassifier, SUMMARY_COLUMNS
+from database import get_db
+from indicator_library import get_indicator_cache
+from screener_query import QueryError, run_query
+from scan_jobs import get_job_manager, screener_records, classify_market_records
+from api_concurrency import run_blocking, limiter_stats
+from response_cache import get_response_cache, response_cache_middleware
+from single_flight import get_single_flight
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
@@ -32,6 +41,10 @@ app = FastAPI(
     redoc_url="/redoc"
 )
 
+# Cache response cho các endpoint đọc (FA, TA, phân loại một mã).
+# Đăng ký trước CORS để response lấy từ cache vẫn đi qua CORSMiddleware.
+app.middleware("http")(response_cache_middleware)
+
 # Cấu hình CORS cho n8n
 app.add_middleware(
     CORSMiddleware,
@@ -56,6 +69,91 @@ class StockResponse(BaseModel):
     error: Optional[str] = None
     timestamp: str
 
+class BatchStockRequest(BaseModel):
+    symbols: Optional[List[str]] = None
+    symbol: Optional[str] = None  # Request cũ (một mã)
+    sections: Optional[List[str]] = None
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+
+class JobRequest(BaseModel):
+    job_type: str
+    params: Dict[str, Any] = {}
+
+# Streaming (NDJSON / Server-Sent Events) cho các endpoint quét nhiều mã
+STREAM_MEDIA_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'sse': 'text/event-stream'
+}
+
+
+def _json_default(obj):
+    """Chuyển kiểu numpy / datetime sang kiểu JSON"""
+    if hasattr(obj, 'item'):
+        return obj.item()
+    if hasattr(obj, 'isoformat'):
+        return obj.isoformat()
+    return str(obj)
+
+
+def _stream_response(records: Iterator[Dict[str, Any]], stream: str,
+                     endpoint_class: str = 'scan') -> StreamingResponse:
+    """
+    Trả từng record ngay khi có (mỗi dòng một JSON, hoặc một event SSE)
+
+    Record có key "type" (result / summary / error). Lỗi giữa chừng được gửi
+    thành record error thay vì cắt ngang kết nối. Mỗi lần lấy record chạy trên
+    worker thread trong giới hạn của endpoint_class.
+    """
+    def encode(record: Dict[str, Any]) -> str:
+        payload = json.dumps(record, ensure_ascii=False, default=_json_default)
+        if stream == 'sse':
+            return f"event: {record['type']}\ndata: {payload}\n\n"
+        return payload + "\n"
+
+    async def body():
+        try:
+            while True:
+                record = await run_blocking(endpoint_class, next, records, None)
+                if record is None:
+                    break
+                yield encode(record)
+        except Exception as e:
+            logger.error(f"Lỗi khi stream kết quả: {str(e)}")
+            yield encode({"type": "error", "error": str(e), "timestamp": datetime.now().isoformat()})
+        finally:
+            # Client ngắt kết nối: hủy các mã chưa chạy
+            records.close()
+
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return StreamingResponse(body(), media_type=STREAM_MEDIA_TYPES[stream], headers=headers)
+
+
+def _check_stream(stream: Optional[str]) -> Optional[str]:
+    """Kiểm tra tham số stream (None = trả JSON một lần như cũ)"""
+    if stream is None:
+        return None
+    stream = stream.lower()
+    if stream not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400,
+                            detail=f"stream phải là một trong: {', '.join(STREAM_MEDIA_TYPES)}")
+    return stream
+
+
+async def _submit_job(job_type: str, params: Dict[str, Any]) -> StockResponse:
+    """Tạo scan job chạy nền (hoặc dùng chung job đang chạy cùng tham số)"""
+    try:
+        job = await run_blocking('local', lambda: get_job_manager().submit(job_type, params))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return StockResponse(
+        success=True,
+        data=job,
+        timestamp=datetime.now().isoformat()
+    )
+
+
 @app.get("/")
 async def root():
     """Endpoint gốc - thông tin API"""
@@ -76,8 +174,10 @@ async def root():
             "/stock/{symbol}/ta/chart": "Vẽ biểu đồ kỹ thuật (candlestick + indicators)",
             "/screener/list": "Lấy danh sách cổ phiếu theo sàn",
             "/screener/screen": "Sàng lọc cổ phiếu theo tiêu chí FA + TA",
+            "/screener/query": "Sàng lọc toàn thị trường bằng biểu thức trên chỉ số đã lưu",
             "/screener/{symbol}": "Kiểm tra một mã cổ phiếu với tiêu chí",
             "/backtest/{symbol}": "Backtest chiến lược MA Crossover",
+            "/jobs": "Quét thị trường chạy nền (screener, classify_market, bluechip)",
             "/health": "Kiểm tra trạng thái API"
         }
     }
@@ -88,14 +188,19 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now().isoformat(),
-        "service": "VNStock Data Collector"
+        "service": "VNStock Data Collector",
+        "indicator_cache": get_indicator_cache().stats(),
+        "response_cache": get_response_cache().stats(),
+        "single_flight": get_single_flight().stats(),
+        "concurrency": limiter_stats()
     }
 
 @app.get("/stock/{symbol}", response_model=StockResponse)
 async def get_complete_stock_data(
     symbol: str,
     start_date: Optional[str] = Query(None, description="Ngày bắt đầu (YYYY-MM-DD)"),
-    end_date: Optional[str] = Query(None, description="Ngày kết thúc (YYYY-MM-DD)")
+    end_date: Optional[str] = Query(None, description="Ngày kết thúc (YYYY-MM-DD)"),
+    sections: Optional[str] = Query(None, description="Các phần cần lấy, phân cách bởi dấu phẩy (overview,historical,financial,market). Mặc định: tất cả")
 ):
     """
     Lấy toàn bộ dữ liệu của một mã cổ phiếu
@@ -103,6 +208,7 @@ async def get_complete_stock_data(
     - **symbol**: Mã cổ phiếu (VD: VIC, VCB, FPT)
     - **start_date**: Ngày bắt đầu (tùy chọn, mặc định từ 2010-01-01)
     - **end_date**: Ngày kết thúc (tùy chọn, mặc định đến hiện tại)
+    - **sections**: Chỉ lấy một số phần (VD: `overview,financial`); các phần được lấy song song
     """
     try:
         logger.info(f"Nhận yêu cầu lấy dữ liệu cho mã: {symbol}")
@@ -124,8 +230,11 @@ async def get_complete_stock_data(
             except ValueError:
                 raise HTTPException(status_code=400, detail="Định dạng end_date không hợp lệ. Sử dụng YYYY-MM-DD")
         
+        section_list = [s.strip() for s in sections.split(',') if s.strip()] if sections else None
+        
         # Thu thập dữ liệu
-        data = collector.get_complete_stock_data(symbol, start_date, end_date)
+        data = await run_blocking('stock', collector.get_complete_stock_data, symbol, start_date, end_date,
+                                  sections=section_list)
         
         return StockResponse(
             success=True,
@@ -135,6 +244,8 @@ async def get_complete_stock_data(
         
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Lỗi khi xử lý yêu cầu cho {symbol}: {str(e)}")
         return StockResponse(
@@ -150,7 +261,7 @@ async def get_stock_overview(symbol: str):
         if not symbol or len(symbol.strip()) == 0:
             raise HTTPException(status_code=400, detail="Mã cổ phiếu không được để trống")
         
-        data = collector.get_stock_overview(symbol)
+        data = await run_blocking('stock', collector.get_stock_overview, symbol)
         
         return StockResponse(
             success=True,
@@ -179,7 +290,7 @@ async def get_historical_data(
         if not symbol or len(symbol.strip()) == 0:
             raise HTTPException(status_code=400, detail="Mã cổ phiếu không được để trống")
         
-        data = collector.get_historical_data(symbol, start_date, end_date)
+        data = await run_blocking('stock', collector.get_historical_data, symbol, start_date, end_date)
         
         return StockResponse(
             success=True,
@@ -204,7 +315,7 @@ async def get_financial_data(symbol: str):
         if not symbol or len(symbol.strip()) == 0:
             raise HTTPException(status_code=400, detail="Mã cổ phiếu không được để trống")
         
-        data = collector.get_financial_data(symbol)
+        data = await run_blocking('stock', collector.get_financial_data, symbol)
         
         return StockResponse(
             success=True,
@@ -229,7 +340,7 @@ async def get_market_data(symbol: str):
         if not symbol or len(symbol.strip()) == 0:
             raise HTTPException(status_code=400, detail="Mã cổ phiếu không được để trống")
         
-        data = collector.get_market_data(symbol)
+        data = await run_blocking('stock', collector.get_market_data, symbol)
         
         return StockResponse(
             success=True,
@@ -248,16 +359,43 @@ async def get_market_data(symbol: str):
         )
 
 @app.post("/stock/batch", response_model=StockResponse)
-async def get_batch_stock_data(request: StockRequest):
+async def get_batch_stock_data(request: BatchStockRequest):
     """
-    Lấy dữ liệu cổ phiếu qua POST request (phù hợp cho n8n)
+    Lấy dữ liệu nhiều mã cổ phiếu qua POST request (phù hợp cho n8n)
+    
+    - **symbols**: Danh sách mã, VD: `["ACB", "VCB", "FPT"]` (tối đa 100, mã trùng chỉ lấy một lần)
+    - **sections**: Phần dữ liệu cần lấy: overview, historical, financial, market (mặc định: tất cả)
+    - **start_date** / **end_date**: Khoảng ngày của historical (YYYY-MM-DD)
+    
+    Các mã được lấy song song; kết quả theo từng mã trong `results`, lỗi
+    theo mã và phần trong `errors`. Request cũ chỉ có `symbol` vẫn trả về
+    toàn bộ dữ liệu một mã như trước.
     """
+    for value, name in [(request.start_date, 'start_date'), (request.end_date, 'end_date')]:
+        if value:
+            try:
+                datetime.strptime(value, "%Y-%m-%d")
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Định dạng {name} không hợp lệ. Sử dụng YYYY-MM-DD")
+    
     try:
-        data = collector.get_complete_stock_data(
-            request.symbol, 
-            request.start_date, 
-            request.end_date
-        )
+        if request.symbols is None and request.symbol:
+            data = await run_blocking(
+                'stock',
+                collector.get_complete_stock_data,
+                request.symbol, 
+                request.start_date, 
+                request.end_date
+            )
+        else:
+            data = await run_blocking(
+                'scan',
+                collector.get_batch_stock_data,
+                request.symbols or [],
+                sections=request.sections,
+                start_date=request.start_date,
+                end_date=request.end_date
+            )
         
         return StockResponse(
             success=True,
@@ -265,6 +403,8 @@ async def get_batch_stock_data(request: StockRequest):
             timestamp=datetime.now().isoformat()
         )
         
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Lỗi khi xử lý batch request: {str(e)}")
         return StockResponse(
@@ -292,7 +432,7 @@ async def get_fa_ratios(symbol: str):
             raise HTTPException(status_code=400, detail="Mã cổ phiếu không được để trống")
         
         logger.info(f"Tính toán FA ratios cho mã: {symbol}")
-        data = calculate_fa_ratios(symbol)
+        data = await run_blocking('stock', calculate_fa_ratios, symbol)
         
         return StockResponse(
             success=True,
@@ -330,7 +470,7 @@ async def get_fa_interpretation_endpoint(symbol: str):
         logger.info(f"Phân tích FA đầy đủ cho mã: {symbol}")
         
         # Tính toán FA ratios
-        fa_ratios = calculate_fa_ratios(symbol)
+        fa_ratios = await run_blocking('stock', calculate_fa_ratios, symbol)
         
         # Diễn giải
         interpretation = get_fa_interpretation(fa_ratios)
@@ -360,13 +500,15 @@ async def get_fa_interpretation_endpoint(symbol: str):
 @app.get("/stock/{symbol}/ta", response_model=StockResponse)
 async def get_ta_indicators(
     symbol: str,
-    period_days: Optional[int] = Query(365, description="Số ngày lấy dữ liệu (mặc định 365)")
+    period_days: Optional[int] = Query(365, description="Số ngày lấy dữ liệu (mặc định 365)"),
+    indicators: Optional[str] = Query(None, description="Các chỉ báo cần tính, phân cách bởi dấu phẩy (VD: MA50,RSI). Mặc định: tất cả")
 ):
     """
     Phân tích kỹ thuật (TA) - Tính toán các chỉ báo
     
     - **symbol**: Mã cổ phiếu (VD: FPT, VIC, VCB)
     - **period_days**: Số ngày lấy dữ liệu (mặc định 365 ngày)
+    - **indicators**: MA50, MA200, RSI, MACD, BB, Volume_MA (mặc định: tất cả)
     
     Trả về các chỉ báo:
     - MA(50), MA(200): Moving Averages
@@ -379,7 +521,11 @@ async def get_ta_indicators(
             raise HTTPException(status_code=400, detail="Mã cổ phiếu không được để trống")
         
         logger.info(f"Tính toán TA indicators cho mã: {symbol}")
-        ta_result = calculate_ta_indicators(symbol, period_days)
+        indicator_list = [i.strip() for i in indicators.split(',') if i.strip()] if indicators else None
+        
+        # Response không gồm DataFrame nên chỉ cần giá trị mới nhất
+        ta_result = await run_blocking('stock', calculate_ta_indicators, symbol, period_days,
+                                       indicators=indicator_list, latest_only=True)
         
         if ta_result.get("error"):
             return StockResponse(
@@ -436,7 +582,7 @@ async def get_ta_analysis_endpoint(
             raise HTTPException(status_code=400, detail="Mã cổ phiếu không được để trống")
         
         logger.info(f"Phân tích TA đầy đủ cho mã: {symbol}")
-        analysis = get_ta_analysis(symbol, period_days)
+        analysis = await run_blocking('stock', get_ta_analysis, symbol, period_days)
         
         if analysis.get("error"):
             return StockResponse(
@@ -482,7 +628,7 @@ async def generate_ta_chart(
             raise HTTPException(status_code=400, detail="Mã cổ phiếu không được để trống")
         
         logger.info(f"Vẽ biểu đồ TA cho mã: {symbol}")
-        chart_result = plot_technical_chart(symbol, period_days)
+        chart_result = await run_blocking('chart', plot_technical_chart, symbol, period_days)
         
         if not chart_result.get("success"):
             return StockResponse(
@@ -522,7 +668,7 @@ async def get_stock_list_endpoint(
     """
     try:
         logger.info(f"Lấy danh sách cổ phiếu sàn {exchange}")
-        stock_list = get_stock_list(exchange)
+        stock_list = await run_blocking('stock', get_stock_list, exchange)
         
         return StockResponse(
             success=True,
@@ -542,43 +688,35 @@ async def get_stock_list_endpoint(
             timestamp=datetime.now().isoformat()
         )
 
-@app.get("/screener/{symbol}")
-async def screen_single_stock(
-    symbol: str,
-    pe_max: Optional[float] = Query(15, description="P/E tối đa"),
-    roe_min: Optional[float] = Query(18, description="ROE tối thiểu %"),
-    price_vs_ma50: Optional[str] = Query("above", description="Giá so với MA50 (above/below)")
+@app.get("/screener/query")
+async def query_screener(
+    q: Optional[str] = Query(None, description="Biểu thức tiêu chí, VD: PE < 15 AND ROE > 18 AND RSI BETWEEN 30 AND 50"),
+    order_by: Optional[str] = Query(None, description="Sắp xếp, VD: overall_score DESC, pe"),
+    limit: Optional[int] = Query(100, description="Số mã tối đa (<= 2000)")
 ):
     """
-    Kiểm tra một mã cổ phiếu với các tiêu chí sàng lọc
+    Sàng lọc toàn thị trường trên chỉ số đã lưu (không quét lại vnstock)
     
-    - **symbol**: Mã cổ phiếu
-    - **pe_max**: P/E tối đa (mặc định 15)
-    - **roe_min**: ROE tối thiểu % (mặc định 18)
-    - **price_vs_ma50**: Giá so với MA50 (above/below)
+    - **q**: Biểu thức gồm so sánh (<, <=, >, >=, =, !=), BETWEEN, IN, IS [NOT] NULL,
+      AND / OR / NOT, ngoặc và phép tính (+ - * /) trên các trường: price, ma20, ma50,
+      ma200, rsi, macd, atr, adx, volume, pe, roe, eps, npm, de, market_cap,
+      overall_rating, overall_score, exchange, ...
+    - **order_by**: Trường sắp xếp kèm ASC/DESC (mặc định overall_score DESC)
+    - **limit**: Số mã tối đa
     
-    Trả về:
-    - Thông tin FA, TA
-    - Kết quả kiểm tra từng tiêu chí
-    - Kết quả tổng thể (passed/failed)
+    Ví dụ: `price > ma50 AND rsi < 40 AND rating IN ('A+', 'A')`
     """
     try:
-        if not symbol or len(symbol.strip()) == 0:
-            raise HTTPException(status_code=400, detail="Mã cổ phiếu không được để trống")
-        
-        logger.info(f"Sàng lọc mã {symbol}")
-        result = screen_stock(symbol, pe_max, roe_min, price_vs_ma50)
-        
+        rows = await run_blocking('local', run_query, q, order_by=order_by, limit=limit)
         return StockResponse(
             success=True,
-            data=result,
+            data={"query": q, "count": len(rows), "stocks": rows},
             timestamp=datetime.now().isoformat()
         )
-        
-    except HTTPException:
-        raise
+    except QueryError as e:
+        raise HTTPException(status_code=400, detail=f"Biểu thức không hợp lệ: {e}")
     except Exception as e:
-        logger.error(f"Lỗi khi sàng lọc {symbol}: {str(e)}")
+        logger.error(f"Lỗi khi truy vấn screener: {str(e)}")
         return StockResponse(
             success=False,
             error=str(e),
@@ -592,7 +730,10 @@ async def run_stock_screener(
     pe_max: Optional[float] = Query(15, description="P/E tối đa"),
     roe_min: Optional[float] = Query(18, description="ROE tối thiểu %"),
     price_vs_ma50: Optional[str] = Query("above", description="Giá so với MA50"),
-    delay: Optional[float] = Query(1.0, description="Delay giữa các request (giây)")
+    delay: Optional[float] = Query(0.0, description="Nghỉ thêm giữa các mã (giây), rate limit do server điều phối"),
+    prefilter: Optional[bool] = Query(True, description="Chỉ lấy FA cho các mã đạt tiêu chí giá vs MA50"),
+    stream: Optional[str] = Query(None, description="Trả kết quả từng mã ngay khi có: ndjson hoặc sse"),
+    background: bool = Query(False, description="Chạy nền, trả về job_id (xem /jobs)")
 ):
     """
     Sàng lọc nhiều cổ phiếu theo tiêu chí FA + TA
@@ -602,7 +743,11 @@ async def run_stock_screener(
     - **pe_max**: P/E tối đa (mặc định 15)
     - **roe_min**: ROE tối thiểu % (mặc định 18)
     - **price_vs_ma50**: Giá so với MA50 (above/below)
-    - **delay**: Delay giữa các request (giây)
+    - **delay**: Nghỉ thêm giữa các mã (giây, mặc định 0 - request lên vnstock đã được rate limiter điều phối)
+    - **prefilter**: Lọc giá vs MA50 từ dữ liệu cục bộ trước, chỉ lấy FA cho mã còn lại (mặc định true)
+    - **stream**: `ndjson` / `sse` - gửi record `result` cho từng mã ngay khi xong
+      (thứ tự hoàn thành), cuối cùng là record `summary`
+    - **background**: Tạo job `screener` chạy nền thay vì quét trong request
     
     Trả về:
     - Tổng số mã đã sàng lọc
@@ -610,16 +755,33 @@ async def run_stock_screener(
     - Danh sách mã đạt tiêu chí
     - Chi tiết từng mã
     """
+    stream = _check_stream(stream)
+    
     try:
         logger.info(f"Chạy stock screener cho sàn {exchange}")
         
-        results = run_screener(
+        if background:
+            return await _submit_job('screener', {
+                'exchange': exchange, 'limit': limit, 'pe_max': pe_max, 'roe_min': roe_min,
+                'price_vs_ma50': price_vs_ma50, 'delay': delay, 'prefilter': prefilter
+            })
+        
+        if stream:
+            return _stream_response(
+                screener_records(exchange, limit, pe_max, roe_min, price_vs_ma50, delay, prefilter),
+                stream
+            )
+        
+        results = await run_blocking(
+            'scan',
+            run_screener,
             exchange=exchange,
             limit=limit,
             pe_max=pe_max,
             roe_min=roe_min,
             price_vs_ma50=price_vs_ma50,
-            delay=delay
+            delay=delay,
+            prefilter=prefilter
         )
         
         if not results.get("success"):
@@ -643,6 +805,49 @@ async def run_stock_screener(
             timestamp=datetime.now().isoformat()
         )
 
+@app.get("/screener/{symbol}")
+async def screen_single_stock(
+    symbol: str,
+    pe_max: Optional[float] = Query(15, description="P/E tối đa"),
+    roe_min: Optional[float] = Query(18, description="ROE tối thiểu %"),
+    price_vs_ma50: Optional[str] = Query("above", description="Giá so với MA50 (above/below)")
+):
+    """
+    Kiểm tra một mã cổ phiếu với các tiêu chí sàng lọc
+    
+    - **symbol**: Mã cổ phiếu
+    - **pe_max**: P/E tối đa (mặc định 15)
+    - **roe_min**: ROE tối thiểu % (mặc định 18)
+    - **price_vs_ma50**: Giá so với MA50 (above/below)
+    
+    Trả về:
+    - Thông tin FA, TA
+    - Kết quả kiểm tra từng tiêu chí
+    - Kết quả tổng thể (passed/failed)
+    """
+    try:
+        if not symbol or len(symbol.strip()) == 0:
+            raise HTTPException(status_code=400, detail="Mã cổ phiếu không được để trống")
+        
+        logger.info(f"Sàng lọc mã {symbol}")
+        result = await run_blocking('stock', screen_stock, symbol, pe_max, roe_min, price_vs_ma50)
+        
+        return StockResponse(
+            success=True,
+            data=result,
+            timestamp=datetime.now().isoformat()
+        )
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Lỗi khi sàng lọc {symbol}: {str(e)}")
+        return StockResponse(
+            success=False,
+            error=str(e),
+            timestamp=datetime.now().isoformat()
+        )
+
 @app.get("/backtest/{symbol}")
 async def backtest_ma_crossover(
     symbol: str,
@@ -677,7 +882,9 @@ async def backtest_ma_crossover(
         
         logger.info(f"Chạy backtest cho mã {symbol}")
         
-        result = run_ma_crossover_backtest(
+        result = await run_blocking(
+            'scan',
+            run_ma_crossover_backtest,
             symbol=symbol,
             initial_cash=initial_cash,
             ma_fast=ma_fast,
@@ -715,7 +922,8 @@ async def backtest_ma_crossover(
 @app.get("/bluechip/scan")
 async def scan_bluechips(
     symbols: Optional[str] = Query(None, description="Comma-separated list of symbols (default: VN30)"),
-    min_score: int = Query(4, description="Minimum score to be considered blue-chip (1-6)")
+    min_score: int = Query(4, description="Minimum score to be considered blue-chip (1-6)"),
+    background: bool = Query(False, description="Run as a background job and return its job id (see /jobs)")
 ):
     """
     Scan for blue-chip stocks
@@ -723,6 +931,7 @@ async def scan_bluechips(
     Args:
         symbols: Comma-separated symbols (e.g. "ACB,VCB,TCB") or None for VN30
         min_score: Minimum score (1-6) to qualify as blue-chip
+        background: Submit a `bluechip` job instead of scanning in the request
     
     Returns:
         List of blue-chip stocks with detailed analysis
@@ -735,8 +944,11 @@ async def scan_bluechips(
         if symbols:
             symbol_list = [s.strip().upper() for s in symbols.split(',')]
         
+        if background:
+            return await _submit_job('bluechip', {'symbols': symbol_list, 'min_score': min_score})
+        
         # Scan
-        bluechips = detector.scan_bluechips(symbols=symbol_list, min_score=min_score)
+        bluechips = await run_blocking('scan', detector.scan_bluechips, symbols=symbol_list, min_score=min_score)
         
         return {
             "success": True,
@@ -778,8 +990,8 @@ async def add_bluechips_to_watchlist(
             symbol_list = [s.strip().upper() for s in symbols.split(',')]
         
         # Scan and add
-        bluechips = detector.scan_bluechips(symbols=symbol_list, min_score=min_score)
-        added = detector.auto_add_to_watchlist(bluechips)
+        bluechips = await run_blocking('scan', detector.scan_bluechips, symbols=symbol_list, min_score=min_score)
+        added = await run_blocking('local', detector.auto_add_to_watchlist, bluechips)
         
         return {
             "success": True,
@@ -817,7 +1029,7 @@ async def get_bluechip_report(
             symbol_list = [s.strip().upper() for s in symbols.split(',')]
         
         # Scan
-        bluechips = detector.scan_bluechips(symbols=symbol_list, min_score=min_score)
+        bluechips = await run_blocking('scan', detector.scan_bluechips, symbols=symbol_list, min_score=min_score)
         report = detector.get_bluechip_report(bluechips)
         
         return {
@@ -846,8 +1058,8 @@ async def classify_single_stock(symbol: str):
         Complete classification including growth, risk, market cap, momentum
     """
     try:
-        classifier = StockClassifier()
-        result = classifier.classify_stock(symbol.upper())
+        classifier = await run_blocking('stock', StockClassifier)
+        result = await run_blocking('stock', classifier.classify_stock, symbol.upper())
         
         return {
             "success": True,
@@ -867,25 +1079,42 @@ async def classify_single_stock(symbol: str):
 async def classify_market_scan(
     exchanges: str = Query('HOSE', description="Comma-separated exchanges (HOSE, HNX)"),
     limit: int = Query(50, description="Số lượng mã quét"),
-    delay: float = Query(3.0, description="Delay between requests (seconds)")
+    delay: float = Query(0.0, description="Extra pause between symbols (seconds); upstream calls are rate limited server-side"),
+    stream: Optional[str] = Query(None, description="Emit each classification as soon as it is ready: ndjson or sse"),
+    background: bool = Query(False, description="Run as a background job and return its job id (see /jobs)")
 ):
     """
     Quét và phân loại thị trường
     
+    - **stream**: `ndjson` / `sse` - one `result` record per symbol in completion
+      order, then a `summary` record with the same statistics as the JSON response
+    - **background**: submit a `classify_market` job instead of scanning in the request
+    
     Returns:
         DataFrame of classified stocks with summary statistics
     """
+    stream = _check_stream(stream)
+    
     try:
         logger.info(f"Starting market scan: exchanges={exchanges}, limit={limit}, delay={delay}")
-        classifier = StockClassifier()
         
         # Parse exchanges
         exchange_list = [e.strip().upper() for e in exchanges.split(',')]
         logger.info(f"Parsed exchanges: {exchange_list}")
         
+        if background:
+            return await _submit_job('classify_market', {'exchanges': exchange_list, 'limit': limit, 'delay': delay})
+        
+        if stream:
+            return _stream_response(classify_market_records(exchange_list, limit, delay), stream)
+        
+        classifier = await run_blocking('scan', StockClassifier)
+        
         # Scan
         logger.info(f"Starting scan_and_classify_market...")
-        df = classifier.scan_and_classify_market(
+        df = await run_blocking(
+            'scan',
+            classifier.scan_and_classify_market,
             exchanges=exchange_list,
             limit=limit,
             delay=delay
@@ -934,46 +1163,77 @@ async def filter_by_classification(
     risk: Optional[str] = Query(None, description="Risk category (low_risk, medium_risk, high_risk)"),
     rating: Optional[str] = Query(None, description="Rating (A+, A, B, C, D, F)"),
     min_score: Optional[float] = Query(None, description="Minimum overall score"),
-    limit: int = Query(100, description="Max stocks to scan")
+    limit: int = Query(100, description="Max stocks to return (also max HOSE stocks to scan when cache is empty)"),
+    max_age_hours: int = Query(24, description="Tuổi tối đa của kết quả trong cache (giờ)")
 ):
     """
     Lọc cổ phiếu theo classification criteria
     
+    Lọc trực tiếp trên cache phân loại (chỉ đọc các cột tóm tắt). Chỉ quét
+    thị trường khi cache chưa có kết quả nào còn hạn: khi đó quét `limit` mã
+    đầu tiên của HOSE rồi lọc, nên số mã trả về có thể ít hơn `limit`.
+    
+    Mỗi phần tử của "stocks" là một dòng phẳng gồm đúng các cột SUMMARY_COLUMNS
+    (symbol, exchange, overall_rating, overall_score, growth_category,
+    risk_category, market_cap_category, momentum_category, recommendation,
+    age_hours) dù "source" là "cache" hay "scan". Các trường chi tiết
+    (growth_score, risk_desc, ...) không còn trả về - dùng /classify/stock/{symbol}.
+    
     Returns:
-        Filtered list of stocks matching criteria
+        Filtered list of stocks matching criteria, sorted by overall_score
     """
+    filters = {
+        "growth": growth,
+        "risk": risk,
+        "rating": rating,
+        "min_score": min_score
+    }
+    
     try:
-        classifier = StockClassifier()
-        
-        # Scan market first
-        df = classifier.scan_and_classify_market(exchanges=['HOSE'], limit=limit, delay=3.0)
-        
-        if df.empty:
-            return {
-                "success": False,
-                "error": "No stocks to filter",
-                "timestamp": datetime.now().isoformat()
-            }
-        
-        # Apply filters
-        df_filtered = classifier.get_stocks_by_filter(
-            df,
-            growth=growth,
-            risk=risk,
-            rating=rating,
-            min_score=min_score
-        )
+        db = get_db()
+        stocks = await run_blocking('local', db.get_all_cached_classifications,
+                                    max_age_hours=max_age_hours, limit=limit,
+                                    columns=SUMMARY_COLUMNS, **filters)
+        source = "cache"
+        
+        if not stocks:
+            has_cache = await run_blocking('local', db.get_all_cached_classifications,
+                                           max_age_hours=max_age_hours, limit=1, columns=['symbol'])
+            if not has_cache:
+                classifier = await run_blocking('scan', StockClassifier)
+                exchange = 'HOSE'
+                
+                # Cache trống - quét thị trường trước
+                df = await run_blocking('scan', classifier.scan_and_classify_market, exchanges=[exchange], limit=limit)
+                
+                if df.empty:
+                    return {
+                        "success": False,
+                        "error": "No stocks to filter",
+                        "timestamp": datetime.now().isoformat()
+                    }
+                
+                # Apply filters
+                df_filtered = classifier.get_stocks_by_filter(df, **filters)
+                
+                # Cùng dạng dòng với nhánh cache
+                now = datetime.now()
+                stocks = [
+                    {
+                        **{column: row.get(column) for column in SUMMARY_COLUMNS},
+                        'exchange': exchange,
+                        'age_hours': (now - datetime.fromisoformat(row['timestamp'])).total_seconds() / 3600
+                    }
+                    for row in df_filtered.to_dict('records')
+                ]
+                source = "scan"
         
         return {
             "success": True,
-            "filters": {
-                "growth": growth,
-                "risk": risk,
-                "rating": rating,
-                "min_score": min_score
-            },
-            "total_found": len(df_filtered),
-            "stocks": df_filtered.to_dict('records'),
+            "filters": filters,
+            "source": source,
+            "total_found": len(stocks),
+            "stocks": stocks,
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -998,10 +1258,10 @@ async def get_top_picks(
         Top rated stocks with detailed analysis
     """
     try:
-        classifier = StockClassifier()
+        classifier = await run_blocking('scan', StockClassifier)
         
         # Scan HOSE (top 100)
-        df = classifier.scan_and_classify_market(exchanges=['HOSE'], limit=100, delay=3.0)
+        df = await run_blocking('scan', classifier.scan_and_classify_market, exchanges=['HOSE'], limit=100)
         
         if df.empty:
             return {
@@ -1046,6 +1306,147 @@ async def get_top_picks(
         }
 
 
+@app.get("/classify/changes")
+async def get_rating_changes(
+    days: int = Query(7, ge=1, le=365, description="Số ngày gần nhất"),
+    direction: Optional[str] = Query(None, description="upgrade, downgrade hoặc bỏ trống (cả hai)"),
+    exchange: Optional[str] = Query(None, description="Lọc theo sàn (HOSE, HNX)"),
+    limit: Optional[int] = Query(None, ge=1, description="Số mã tối đa")
+):
+    """
+    Các mã được nâng / hạ rating trong N ngày gần nhất (từ lịch sử phân loại)
+    
+    Returns:
+        Danh sách thay đổi: from_rating -> to_rating, điểm và ngày scan
+    """
+    if direction not in (None, 'upgrade', 'downgrade'):
+        raise HTTPException(status_code=400, detail="direction phải là upgrade hoặc downgrade")
+    
+    changes = await run_blocking('local', get_db().get_rating_changes,
+                                 days=days, direction=direction, exchange=exchange, limit=limit)
+    return {
+        "success": True,
+        "days": days,
+        "direction": direction or "all",
+        "upgrades": sum(1 for c in changes if c['rank_change'] > 0),
+        "downgrades": sum(1 for c in changes if c['rank_change'] < 0),
+        "changes": changes,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+@app.get("/classify/history/{symbol}")
+async def get_classification_history(
+    symbol: str,
+    days: int = Query(90, ge=1, description="Số ngày gần nhất")
+):
+    """
+    Lịch sử rating / điểm theo ngày của một mã
+    """
+    history = await run_blocking('local', get_db().get_classification_history, symbol, days=days)
+    return {
+        "success": True,
+        "symbol": symbol.upper(),
+        "days": days,
+        "history": history,
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+# ========== SCAN JOBS ==========
+
+@app.post("/jobs", response_model=StockResponse)
+async def submit_scan_job(request: JobRequest):
+    """
+    Gửi lượt quét thị trường chạy nền
+    
+    - **job_type**: `screener`, `classify_market` hoặc `bluechip`
+    - **params**: Tham số như endpoint tương ứng (VD: `{"exchange": "HOSE", "limit": 50}`)
+    
+    Job trùng loại và tham số với một job đang chạy sẽ dùng chung job đó
+    (`shared: true`). Theo dõi bằng GET /jobs/{job_id}.
+    """
+    return await _submit_job(request.job_type, request.params)
+
+
+@app.get("/jobs", response_model=StockResponse)
+async def list_scan_jobs(
+    status: Optional[str] = Query(None, description="queued, running, completed, failed, cancelled"),
+    limit: int = Query(50, description="Số job tối đa")
+):
+    """Danh sách scan job gần nhất"""
+    jobs = await run_blocking('local', lambda: get_job_manager().list(status=status, limit=limit))
+    return StockResponse(
+        success=True,
+        data={"total": len(jobs), "jobs": jobs},
+        timestamp=datetime.now().isoformat()
+    )
+
+
+@app.get("/jobs/{job_id}", response_model=StockResponse)
+async def get_scan_job(job_id: str):
+    """
+    Trạng thái và tiến độ của scan job
+    
+    Khi job hoàn thành, `result` chứa kết quả tổng hợp (như record summary của
+    chế độ stream); chi tiết từng mã lấy qua /jobs/{job_id}/results.
+    """
+    job = await run_blocking('local', lambda: get_job_manager().get(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy job {job_id}")
+    
+    return StockResponse(
+        success=True,
+        data=job,
+        timestamp=datetime.now().isoformat()
+    )
+
+
+@app.get("/jobs/{job_id}/results", response_model=StockResponse)
+async def get_scan_job_results(
+    job_id: str,
+    after: int = Query(0, description="Chỉ lấy kết quả có seq lớn hơn giá trị này"),
+    limit: int = Query(100, description="Số kết quả tối đa")
+):
+    """
+    Kết quả từng mã của scan job theo thứ tự hoàn thành (có cả khi job đang chạy)
+    
+    Poll tiếp bằng `after` = seq cuối cùng đã nhận.
+    """
+    manager = await run_blocking('local', get_job_manager)
+    job = await run_blocking('local', manager.get, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy job {job_id}")
+    
+    results = await run_blocking('local', manager.results, job_id, after=after, limit=limit)
+    return StockResponse(
+        success=True,
+        data={
+            "job_id": job_id,
+            "status": job['status'],
+            "completed": job['completed'],
+            "total": job['total'],
+            "results": results,
+            "next_after": results[-1]['seq'] if results else after
+        },
+        timestamp=datetime.now().isoformat()
+    )
+
+
+@app.delete("/jobs/{job_id}", response_model=StockResponse)
+async def cancel_scan_job(job_id: str):
+    """Hủy scan job (có hiệu lực sau mã đang xử lý, các mã chưa chạy bị bỏ)"""
+    job = await run_blocking('local', lambda: get_job_manager().cancel(job_id))
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Không tìm thấy job {job_id}")
+    
+    return StockResponse(
+        success=True,
+        data=job,
+        timestamp=datetime.now().isoformat()
+    )
+
+
 if __name__ == "__main__":
     # Chạy server
     uvicorn.run(
@@ -423,6 +423,7 @@ def start_alert_monitor(check_interval: int = 60):
     import threading
     import time
     from database import get_db
+    from data_store import get_price_history
     
     def monitor_alerts():
         """Monitor function running in background"""
@@ -436,13 +437,8 @@ def start_alert_monitor(check_interval: int = 60):
                 alerts = db.get_active_alerts()
                 
                 for alert in alerts:
-                    # Get current price
-                    from vnstock import Vnstock
-                    stock = Vnstock().stock(symbol=alert['symbol'], source='VCI')
-                    end_date = datetime.now().strftime("%Y-%m-%d")
-                    start_date = (datetime.now() - timedelta(days=1)).strftime("%Y-%m-%d")
-                    
-                    df = stock.quote.history(start=start_date, end=end_date)
+                    # Get current price (price store, upstream qua rate limiter)
+                    df = get_price_history(alert['symbol'], days=5)
                     
                     if not df.empty:
                         current_price = df['close'].iloc[-1] * 1000  # Convert to VND
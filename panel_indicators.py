@@ -0,0 +1,223 @@
+"""
+Panel Indicators - VNStock Market-wide TA
+Tính chỉ báo kỹ thuật cho toàn thị trường trong một lượt vector hóa trên
+panel dạng rộng (index = ngày, columns = mã), thay vì lặp từng mã qua
+calculate_ta_indicators.
+
+Công thức lấy từ indicator_library (dùng chung với ta_analyzer /
+advanced_indicators); giá tính theo VND (nghìn đồng * 1000) như
+calculate_ta_indicators.
+"""
+
+import numpy as np
+import pandas as pd
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import logging
+
+from database import get_db
+import indicator_library
+
+logger = logging.getLogger(__name__)
+
+PANEL_FIELDS = ['open', 'high', 'low', 'close', 'volume']
+
+
+def load_price_panel(symbols: Optional[List[str]] = None, days: int = 365) -> Dict[str, pd.DataFrame]:
+    """
+    Đọc dữ liệu giá cục bộ thành panel dạng rộng
+
+    Args:
+        symbols: Danh sách mã (None = mọi mã trong price store)
+        days: Số ngày dữ liệu
+
+    Returns:
+        Dict field -> DataFrame (index = ngày, columns = mã) cho
+        open, high, low, close (VND) và volume
+    """
+    start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    query = 'SELECT symbol, date, open, high, low, close, volume FROM price_history WHERE date >= ?'
+    params: List = [start_date]
+
+    if symbols:
+        symbols = [s.upper() for s in symbols]
+        query += f" AND symbol IN ({','.join('?' * len(symbols))})"
+        params.extend(symbols)
+
+    rows = pd.read_sql_query(query, get_db().conn, params=params)
+    if rows.empty:
+        return {field: pd.DataFrame() for field in PANEL_FIELDS}
+
+    rows['date'] = pd.to_datetime(rows['date'])
+    wide = rows.pivot(index='date', columns='symbol').sort_index()
+
+    panel = {field: wide[field] for field in PANEL_FIELDS}
+    for field in ['open', 'high', 'low', 'close']:
+        panel[field] = panel[field] * 1000
+
+    logger.info(f"Loaded price panel: {wide.shape[0]} days x {panel['close'].shape[1]} symbols")
+    return panel
+
+
+# ============= INDICATORS (wide DataFrames) =============
+
+def panel_sma(prices: pd.DataFrame, window: int) -> pd.DataFrame:
+    """Simple Moving Average cho mọi mã"""
+    return indicator_library.sma(prices, window)
+
+
+def panel_rsi(prices: pd.DataFrame, period: int = 14) -> pd.DataFrame:
+    """RSI (trung bình trượt đơn giản như ta_analyzer.calculate_rsi)"""
+    return indicator_library.rsi(prices, period)
+
+
+def panel_macd(prices: pd.DataFrame, fast: int = 12, slow: int = 26,
+               signal: int = 9) -> Dict[str, pd.DataFrame]:
+    """MACD line, Signal line, Histogram"""
+    macd_line, signal_line, histogram = indicator_library.macd(prices, fast, slow, signal)
+    return {'MACD': macd_line, 'MACD_Signal': signal_line, 'MACD_Hist': histogram}
+
+
+def panel_bollinger(prices: pd.DataFrame, period: int = 20, std_dev: float = 2) -> Dict[str, pd.DataFrame]:
+    """Bollinger Bands"""
+    upper, middle, lower = indicator_library.bollinger_bands(prices, period, std_dev)
+    return {'BB_Upper': upper, 'BB_Middle': middle, 'BB_Lower': lower}
+
+
+def panel_atr(high: pd.DataFrame, low: pd.DataFrame, close: pd.DataFrame,
+              period: int = 14) -> pd.DataFrame:
+    """ATR (Average True Range)"""
+    return indicator_library.atr(high, low, close, period)
+
+
+def panel_adx(high: pd.DataFrame, low: pd.DataFrame, close: pd.DataFrame,
+              period: int = 14) -> Dict[str, pd.DataFrame]:
+    """ADX, +DI, -DI"""
+    adx, plus_di, minus_di = indicator_library.adx(high, low, close, period)
+    return {'ADX': adx, 'Plus_DI': plus_di, 'Minus_DI': minus_di}
+
+
+def panel_stochastic(high: pd.DataFrame, low: pd.DataFrame, close: pd.DataFrame,
+                     k_period: int = 14, d_period: int = 3) -> Dict[str, pd.DataFrame]:
+    """Stochastic %K, %D"""
+    k_percent, d_percent = indicator_library.stochastic(high, low, close, k_period, d_period)
+    return {'Stoch_K': k_percent, 'Stoch_D': d_percent}
+
+
+def _gap_symbols(close: pd.DataFrame) -> List[str]:
+    """
+    Các mã có phiên trống (NaN) nằm giữa phiên đầu và phiên cuối của chính nó
+
+    Panel lấy hợp các ngày của mọi mã nên mã tạm ngừng giao dịch có NaN giữa
+    chuỗi. NaN ở đầu / cuối chuỗi không ảnh hưởng rolling / EWM, NaN ở giữa
+    thì làm các cửa sổ chứa nó thành NaN.
+    """
+    valid = close.notna()
+    started = valid.cummax()
+    not_ended = valid[::-1].cummax()[::-1]
+    return list(close.columns[(~valid & started & not_ended).any()])
+
+
+def _compute_indicators(panel: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """Tính chỉ báo vector hóa trên toàn panel"""
+    close, high, low = panel['close'], panel['high'], panel['low']
+
+    indicators = {
+        'Close': close,
+        'Volume': panel['volume'],
+        'MA20': panel_sma(close, 20),
+        'MA50': panel_sma(close, 50),
+        'MA200': panel_sma(close, 200),
+        'RSI': panel_rsi(close, 14),
+        'ATR': panel_atr(high, low, close, 14),
+        'Volume_MA': panel_sma(panel['volume'], 20),
+    }
+    indicators.update(panel_macd(close))
+    indicators.update(panel_bollinger(close))
+    indicators.update(panel_adx(high, low, close))
+    indicators.update(panel_stochastic(high, low, close))
+
+    return indicators
+
+
+def compute_panel_indicators(panel: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """
+    Tính toàn bộ chỉ báo cho panel trong một lượt
+
+    Mã có phiên trống giữa chuỗi được tính lại riêng trên các phiên có dữ
+    liệu của nó (giống calculate_ta_indicators tính trên dữ liệu từng mã),
+    các mã còn lại giữ kết quả vector hóa.
+
+    Returns:
+        Dict tên chỉ báo -> DataFrame (index = ngày, columns = mã)
+    """
+    indicators = _compute_indicators(panel)
+
+    patches: Dict[str, Dict[str, pd.Series]] = {}
+    for symbol in _gap_symbols(panel['close']):
+        rows = panel['close'][symbol].notna()
+        symbol_panel = {field: frame.loc[rows, [symbol]] for field, frame in panel.items()}
+        for name, frame in _compute_indicators(symbol_panel).items():
+            patches.setdefault(name, {})[symbol] = frame[symbol]
+
+    for name, columns in patches.items():
+        frame = indicators[name].copy()
+        frame[list(columns)] = pd.DataFrame(columns).reindex(frame.index)
+        indicators[name] = frame
+
+    if patches:
+        logger.debug(f"Recomputed {len(next(iter(patches.values())))} symbols with trading gaps")
+
+    return indicators
+
+
+def latest_snapshot(indicators: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    Giá trị mới nhất của từng chỉ báo cho mỗi mã
+
+    Lấy phiên có giá đóng cửa gần nhất của từng mã (mã tạm ngừng giao dịch
+    vẫn có dòng theo phiên cuối cùng của nó).
+
+    Returns:
+        DataFrame index = mã, columns = tên chỉ báo
+    """
+    close = indicators['Close']
+    if close.empty:
+        return pd.DataFrame()
+
+    # Vị trí phiên cuối có dữ liệu của từng mã
+    last_pos = close.notna().to_numpy()[::-1].argmax(axis=0)
+    rows = len(close) - 1 - last_pos
+    cols = np.arange(close.shape[1])
+
+    snapshot = pd.DataFrame({
+        name: frame.to_numpy()[rows, cols] for name, frame in indicators.items()
+    }, index=close.columns)
+    snapshot['date'] = close.index[rows]
+    snapshot.index.name = 'symbol'
+
+    return snapshot
+
+
+def screen_market(query: str, symbols: Optional[List[str]] = None, days: int = 365) -> pd.DataFrame:
+    """
+    Sàng lọc toàn thị trường theo biểu thức trên các chỉ báo mới nhất
+
+    Args:
+        query: Biểu thức pandas query, VD: "Close > MA50 and RSI < 30"
+        symbols: Danh sách mã (None = mọi mã trong price store)
+        days: Số ngày dữ liệu (>= 300 để có MA200)
+
+    Returns:
+        DataFrame các mã thỏa điều kiện (index = mã)
+    """
+    started = datetime.now()
+    snapshot = latest_snapshot(compute_panel_indicators(load_price_panel(symbols, days)))
+
+    if snapshot.empty:
+        return snapshot
+
+    result = snapshot.query(query)
+    logger.info(f"screen_market('{query}'): {len(result)}/{len(snapshot)} symbols "
+                f"in {(datetime.now() - started).total_seconds():.2f}s")
+    return result
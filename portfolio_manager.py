@@ -9,7 +9,7 @@ from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Tuple
 import logging
 from database import get_db
-from vnstock import Vnstock
+from data_store import get_price_history
 
 logger = logging.getLogger(__name__)
 
@@ -471,11 +471,7 @@ class PortfolioManager:
     def _get_current_price(self, symbol: str) -> float:
         """Get current price for a symbol"""
         try:
-            stock = Vnstock().stock(symbol=symbol, source='VCI')
-            end_date = datetime.now().strftime("%Y-%m-%d")
-            start_date = (datetime.now() - timedelta(days=5)).strftime("%Y-%m-%d")
-            
-            df = stock.quote.history(start=start_date, end=end_date)
+            df = get_price_history(symbol, days=5)
             
             if not df.empty:
                 current_price = df['close'].iloc[-1] * 1000  # Convert to VND
@@ -491,11 +487,10 @@ class PortfolioManager:
     def _get_historical_price(self, symbol: str, date: datetime) -> Optional[float]:
         """Get historical price for a symbol on a specific date"""
         try:
-            stock = Vnstock().stock(symbol=symbol, source='VCI')
             date_str = date.strftime("%Y-%m-%d")
             start_date = (date - timedelta(days=7)).strftime("%Y-%m-%d")
             
-            df = stock.quote.history(start=start_date, end=date_str)
+            df = get_price_history(symbol, start_date=start_date, end_date=date_str)
             
             if not df.empty:
                 # Get closest date
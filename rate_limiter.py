@@ -0,0 +1,162 @@
+"""
+Rate Limiter - VNStock Upstream Request Budget
+Token bucket dùng chung giữa các process (API, Dashboard, Background Scanner)
+qua file SQLite vnstock.db. Chỉ các lời gọi vnstock thực sự mới bị tính,
+dữ liệu đã có trong cache cục bộ đi qua không cần chờ.
+"""
+
+import sqlite3
+import threading
+import time
+from typing import Optional
+import logging
+
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Giới hạn của vnstock (gói Guest: 20 request/phút)
+DEFAULT_REQUESTS_PER_MINUTE = 20
+
+# Số request được phép gửi dồn liền nhau. Tốc độ nạp lại là
+# (requests_per_minute - burst) / 60 nên trong bất kỳ cửa sổ 60 giây nào
+# cũng không vượt quá requests_per_minute
+DEFAULT_BURST = 2
+
+# Settings (bảng settings) để chỉnh budget khi nâng gói vnstock
+SETTING_REQUESTS_PER_MINUTE = 'vnstock_requests_per_minute'
+SETTING_BURST = 'vnstock_rate_burst'
+
+BUCKET_NAME = 'vnstock'
+
+
+class RateLimiter:
+    """
+    Token bucket lưu trong SQLite (bảng rate_limit_buckets)
+
+    Mỗi lần acquire() mở transaction BEGIN IMMEDIATE trên connection riêng nên
+    các process cùng dùng vnstock.db chia sẻ chung một budget.
+    """
+
+    def __init__(self, db_path: str, requests_per_minute: int = DEFAULT_REQUESTS_PER_MINUTE,
+                 burst: int = DEFAULT_BURST, name: str = BUCKET_NAME):
+        """
+        Args:
+            db_path: File SQLite dùng chung (vnstock.db)
+            requests_per_minute: Budget request/phút của nhà cung cấp
+            burst: Số request tối đa gửi liền nhau
+            name: Tên bucket (mỗi nhà cung cấp một bucket)
+        """
+        if requests_per_minute <= burst:
+            raise ValueError("requests_per_minute phải lớn hơn burst")
+
+        self.name = name
+        self.capacity = float(burst)
+        self.refill_rate = (requests_per_minute - burst) / 60.0  # token/giây
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, timeout=30, isolation_level=None,
+                                     check_same_thread=False)
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+                name TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        ''')
+
+    def _try_consume(self, tokens: float) -> float:
+        """
+        Lấy token trong một transaction
+
+        Returns:
+            float: 0 nếu đã lấy được token, ngược lại số giây cần chờ
+        """
+        with self._lock:
+            cursor = self._conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+            try:
+                now = time.time()
+                row = cursor.execute(
+                    'SELECT tokens, updated_at FROM rate_limit_buckets WHERE name = ?',
+                    (self.name,)
+                ).fetchone()
+
+                if row is None:
+                    available = self.capacity
+                else:
+                    elapsed = max(0.0, now - row[1])
+                    available = min(self.capacity, row[0] + elapsed * self.refill_rate)
+
+                if available >= tokens:
+                    available -= tokens
+                    wait = 0.0
+                else:
+                    wait = (tokens - available) / self.refill_rate
+
+                cursor.execute('''
+                    INSERT OR REPLACE INTO rate_limit_buckets (name, tokens, updated_at)
+                    VALUES (?, ?, ?)
+                ''', (self.name, available, now))
+                cursor.execute('COMMIT')
+                return wait
+            except Exception:
+                cursor.execute('ROLLBACK')
+                raise
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> float:
+        """
+        Chờ đến khi được phép gửi request lên vnstock
+
+        Args:
+            tokens: Số request sắp gửi
+            timeout: Thời gian chờ tối đa (giây), None = chờ đến khi có token
+
+        Returns:
+            float: Tổng thời gian đã chờ (giây)
+
+        Raises:
+            TimeoutError: Hết timeout mà chưa có token
+        """
+        started = time.monotonic()
+        while True:
+            try:
+                wait = self._try_consume(tokens)
+            except sqlite3.OperationalError as e:
+                logger.debug(f"Rate limiter bucket busy, retrying: {e}")
+                wait = 0.05
+
+            waited = time.monotonic() - started
+            if wait == 0:
+                if waited > 0.5:
+                    logger.debug(f"Rate limiter: waited {waited:.1f}s")
+                return waited
+
+            if timeout is not None and waited + wait > timeout:
+                raise TimeoutError(f"Rate limiter: no token within {timeout}s")
+
+            time.sleep(wait)
+
+    def close(self):
+        """Đóng connection của limiter"""
+        self._conn.close()
+
+
+# Singleton instance
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Get rate limiter instance (singleton, budget đọc từ bảng settings)"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                db = get_db()
+                _rate_limiter = RateLimiter(
+                    db.db_path,
+                    requests_per_minute=int(db.get_setting(SETTING_REQUESTS_PER_MINUTE,
+                                                           DEFAULT_REQUESTS_PER_MINUTE)),
+                    burst=int(db.get_setting(SETTING_BURST, DEFAULT_BURST))
+                )
+    return _rate_limiter
@@ -0,0 +1,310 @@
+"""
+Response Cache - VNStock In-process HTTP Response Cache
+Cache response của các endpoint đọc (FA, TA, phân loại một mã) theo route +
+query params, để Dashboard poll liên tục không phải tính lại từ dữ liệu gốc.
+
+- TTL theo giờ giao dịch: trong phiên hết hạn sau vài phút (theo nhịp làm mới
+  nến ngày của data_store), ngoài phiên giữ đến giờ mở cửa phiên kế tiếp.
+- Giới hạn số response và tổng dung lượng, loại bỏ theo LRU.
+- ETag / If-None-Match: client gửi lại ETag còn khớp nhận 304 không có body.
+- Request có "Cache-Control: no-cache" bỏ qua cache và làm mới entry.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from data_store import INTRADAY_REFRESH_MINUTES, MARKET_CLOSE_HOUR
+
+logger = logging.getLogger(__name__)
+
+# Giờ mở cửa thị trường (HOSE/HNX)
+MARKET_OPEN_HOUR = 9
+
+# Route được cache -> loại TTL (chỉ áp dụng cho GET)
+CACHED_ROUTES: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r'^/stock/[^/]+/fa$'), 'fundamental'),
+    (re.compile(r'^/stock/[^/]+/fa/interpret$'), 'fundamental'),
+    (re.compile(r'^/stock/[^/]+/ta$'), 'price'),
+    (re.compile(r'^/stock/[^/]+/ta/analyze$'), 'price'),
+    (re.compile(r'^/classify/stock/[^/]+$'), 'price'),
+]
+
+# TTL trong phiên (giây) theo loại. Ngoài phiên: đến giờ mở cửa phiên kế tiếp.
+# FA cũng đổi trong phiên vì P/E tính theo giá hiện tại, nhưng chậm hơn TA.
+INTRADAY_TTL_SECONDS: Dict[str, int] = {
+    'price': INTRADAY_REFRESH_MINUTES * 60,
+    'fundamental': 60 * 60,
+}
+
+# Giới hạn mặc định
+DEFAULT_MAX_ENTRIES = 512
+DEFAULT_MAX_MB = 32
+
+# Setting (bảng settings) để chỉnh giới hạn
+SETTING_MAX_ENTRIES = 'response_cache_size'
+SETTING_MAX_MB = 'response_cache_max_mb'
+
+
+# ============= TTL =============
+
+def _next_session_open(now: datetime) -> datetime:
+    """Giờ mở cửa của phiên giao dịch kế tiếp (bỏ qua thứ 7, CN)"""
+    open_time = now.replace(hour=MARKET_OPEN_HOUR, minute=0, second=0, microsecond=0)
+    if open_time <= now:
+        open_time += timedelta(days=1)
+    while open_time.weekday() >= 5:
+        open_time += timedelta(days=1)
+    return open_time
+
+
+def market_aware_ttl(ttl_class: str, now: Optional[datetime] = None) -> int:
+    """
+    TTL (giây) cho response tính lúc now
+
+    Phiên được tính đến MARKET_CLOSE_HOUR + INTRADAY_REFRESH_MINUTES: nến ngày
+    trong data_store chỉ được tải lại bản chốt sau khoảng này, response tính
+    sớm hơn không được giữ qua đêm.
+
+    Raises:
+        ValueError: Loại TTL không tồn tại
+    """
+    if ttl_class not in INTRADAY_TTL_SECONDS:
+        raise ValueError(f"Loại TTL không hỗ trợ: {ttl_class}")
+
+    now = now or datetime.now()
+    session_open = now.replace(hour=MARKET_OPEN_HOUR, minute=0, second=0, microsecond=0)
+    session_settled = (now.replace(hour=MARKET_CLOSE_HOUR, minute=0, second=0, microsecond=0)
+                       + timedelta(minutes=INTRADAY_REFRESH_MINUTES))
+
+    if now.weekday() < 5 and session_open <= now < session_settled:
+        return INTRADAY_TTL_SECONDS[ttl_class]
+
+    return max(1, int((_next_session_open(now) - now).total_seconds()))
+
+
+def route_ttl_class(method: str, path: str) -> Optional[str]:
+    """Loại TTL của route, None nếu route không được cache"""
+    if method != 'GET':
+        return None
+    for pattern, ttl_class in CACHED_ROUTES:
+        if pattern.match(path):
+            return ttl_class
+    return None
+
+
+# ============= CACHE =============
+
+class ResponseCache:
+    """
+    Cache LRU có giới hạn cho body response đã serialize (thread-safe)
+
+    Mỗi entry là dict: body, media_type, etag, expires_at (time.monotonic).
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max(1, max_bytes)
+        self._entries: OrderedDict = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+        self.evictions = 0
+
+    def get(self, key: Tuple) -> Optional[Dict[str, Any]]:
+        """Entry còn hạn theo key, None nếu chưa có hoặc đã hết hạn"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry['expires_at'] <= time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: Tuple, body: bytes, media_type: str, ttl: int) -> Dict[str, Any]:
+        """Lưu body response với TTL (giây), trả về entry mới"""
+        entry = {
+            'body': body,
+            'media_type': media_type,
+            'etag': f'"{hashlib.sha1(body).hexdigest()[:20]}"',
+            'expires_at': time.monotonic() + ttl
+        }
+        if len(body) > self.max_bytes:
+            return entry  # Quá lớn, không cache
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = entry
+            self._size += len(body)
+            while len(self._entries) > self.max_entries or self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+        return entry
+
+    def _remove(self, key: Tuple):
+        """Xóa entry (gọi khi đang giữ lock)"""
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= len(entry['body'])
+
+    def invalidate(self, path_prefix: Optional[str] = None) -> int:
+        """
+        Xóa các entry có path bắt đầu bằng path_prefix (None = xóa hết)
+
+        Returns:
+            Số entry đã xóa
+        """
+        with self._lock:
+            keys = [key for key in self._entries if path_prefix is None or key[0].startswith(path_prefix)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        """Xóa toàn bộ cache và thống kê"""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = 0
+            self.misses = 0
+            self.not_modified = 0
+            self.evictions = 0
+
+    def stats(self) -> Dict[str, Any]:
+        """Thống kê cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'size_bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 3) if total else 0.0
+            }
+
+
+# Singleton instance
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def get_response_cache() -> ResponseCache:
+    """Get response cache instance (singleton, giới hạn đọc từ bảng settings)"""
+    global _response_cache
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                max_entries, max_mb = DEFAULT_MAX_ENTRIES, DEFAULT_MAX_MB
+                try:
+                    from database import get_db
+                    db = get_db()
+                    max_entries = int(db.get_setting(SETTING_MAX_ENTRIES, DEFAULT_MAX_ENTRIES))
+                    max_mb = float(db.get_setting(SETTING_MAX_MB, DEFAULT_MAX_MB))
+                except Exception as e:
+                    logger.warning(f"Không đọc được cấu hình response cache, dùng mặc định: {e}")
+                _response_cache = ResponseCache(max_entries, int(max_mb * 1024 * 1024))
+    return _response_cache
+
+
+# ============= HTTP MIDDLEWARE =============
+
+def _cache_key(request: Request) -> Tuple:
+    """Key theo route + query params (không phụ thuộc thứ tự params)"""
+    return (request.url.path, tuple(sorted(request.query_params.multi_items())))
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match có chứa ETag hiện tại không (so sánh weak, hỗ trợ *)"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    return '*' in candidates or etag in [tag[2:] if tag.startswith('W/') else tag for tag in candidates]
+
+
+def _has_error(data: Any) -> bool:
+    """Dict có báo lỗi không (error khác rỗng hoặc rate_limited)"""
+    return isinstance(data, dict) and bool(data.get('error') or data.get('rate_limited'))
+
+
+def _is_success(body: bytes) -> bool:
+    """
+    Response JSON không báo lỗi
+
+    Các endpoint trả lỗi bằng success=False với HTTP 200, nhưng FA / classify
+    khi bị rate limit vẫn trả success=True với lỗi nằm trong data (VD:
+    data.error, data.rate_limited, data.fa_ratios.error) - không được cache
+    những response này tới phiên sau.
+    """
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return False
+    if not isinstance(payload, dict):
+        return True
+    if payload.get('success') is False:
+        return False
+    data = payload.get('data')
+    if _has_error(data):
+        return False
+    return not (isinstance(data, dict) and any(_has_error(value) for value in data.values()))
+
+
+async def response_cache_middleware(request: Request, call_next) -> Response:
+    """
+    HTTP middleware: trả response từ cache cho route trong CACHED_ROUTES
+
+    Chỉ cache response 200 thành công. Header trả về: ETag, Cache-Control
+    (max-age = thời gian còn lại) và X-Cache (HIT / MISS).
+    """
+    ttl_class = route_ttl_class(request.method, request.url.path)
+    if ttl_class is None:
+        return await call_next(request)
+
+    cache = get_response_cache()
+    key = _cache_key(request)
+    bypass = 'no-cache' in request.headers.get('cache-control', '').lower()
+    entry = None if bypass else cache.get(key)
+    status = 'HIT'
+
+    if entry is None:
+        response = await call_next(request)
+        body = b''.join([chunk async for chunk in response.body_iterator])
+        if response.status_code != 200 or not _is_success(body):
+            headers = {k: v for k, v in response.headers.items() if k.lower() != 'content-length'}
+            return Response(content=body, status_code=response.status_code,
+                            headers=headers, media_type=response.media_type)
+        entry = cache.put(key, body, response.headers.get('content-type', 'application/json'),
+                          market_aware_ttl(ttl_class))
+        status = 'MISS'
+
+    headers = {
+        'ETag': entry['etag'],
+        'Cache-Control': f"private, max-age={max(0, int(entry['expires_at'] - time.monotonic()))}",
+        'X-Cache': status
+    }
+
+    if _etag_matches(request.headers.get('if-none-match'), entry['etag']):
+        cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=entry['body'], headers=headers, media_type=entry['media_type'])
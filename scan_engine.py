@@ -0,0 +1,180 @@
+"""
+Scan Engine - VNStock Concurrent Market Scan
+Chạy tác vụ theo từng mã trên thread pool giới hạn số worker. Request lên
+vnstock đã được rate_limiter điều phối nên các worker chỉ chờ khi thực sự
+hết budget, còn mã có dữ liệu cục bộ được xử lý song song ngay.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterator, List, Optional
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Số worker mặc định (I/O-bound: chờ vnstock / SQLite)
+DEFAULT_MAX_WORKERS = 4
+
+# Thời gian tối đa cho một mã (giây), gồm cả thời gian chờ rate limit
+DEFAULT_SYMBOL_TIMEOUT = 180
+
+# Chu kỳ kiểm tra timeout của các mã đang chạy (giây)
+TIMEOUT_CHECK_INTERVAL = 0.5
+
+# Số thread tối đa (kể cả thread của mã đã timeout nhưng chưa trả về) tính
+# theo bội số của max_workers
+MAX_THREADS_PER_WORKER = 2
+
+
+def iter_scan(symbols: List[str],
+              worker: Callable[[str], Any],
+              max_workers: int = DEFAULT_MAX_WORKERS,
+              timeout: Optional[float] = DEFAULT_SYMBOL_TIMEOUT) -> Iterator[Dict]:
+    """
+    Chạy worker(symbol) trên thread pool, trả từng kết quả ngay khi xong
+
+    Kết quả theo thứ tự hoàn thành (không giữ lại trong bộ nhớ). Dừng duyệt
+    giữa chừng (VD: client ngắt kết nối) sẽ hủy các mã chưa chạy.
+
+    Args:
+        symbols: Danh sách mã cổ phiếu
+        worker: Hàm xử lý một mã, trả về kết quả của mã đó
+        max_workers: Số worker tối đa
+        timeout: Thời gian tối đa cho một mã (giây), None = không giới hạn.
+                 Mã quá hạn được bỏ qua (thread vẫn chạy nốt nhưng kết quả bị
+                 bỏ), các mã còn lại chạy trên thread dự phòng. Tổng số thread
+                 không vượt quá max_workers * MAX_THREADS_PER_WORKER; khi mọi
+                 thread đều bị mã timeout chiếm quá timeout giây, các mã còn
+                 lại được trả về với timed_out=True
+
+    Yields:
+        Dict gồm index (vị trí trong symbols), symbol, result, error, timed_out,
+        elapsed (giây)
+    """
+    if not symbols:
+        return
+
+    max_workers = max(1, max_workers)
+    max_threads = max_workers * MAX_THREADS_PER_WORKER
+    started_at: Dict[int, float] = {}
+    futures: Dict[Any, int] = {}
+    pending = set()
+    abandoned = set()
+    next_index = 0
+    stalled_since = None
+
+    # Chỉ submit khi còn slot trống nên mỗi mã bắt đầu chạy ngay khi submit
+    # (started_at là thời điểm submit). Mã timeout vẫn chiếm thread cho tới khi
+    # worker trả về: pool có thêm thread dự phòng cho các mã này, nhưng tổng số
+    # thread (đang chạy + đã timeout) không vượt quá max_threads.
+    executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='scan')
+
+    def _outcome(index: int, now: float, **fields) -> Dict:
+        outcome = {
+            'index': index,
+            'symbol': symbols[index],
+            'result': None,
+            'error': None,
+            'timed_out': False,
+            'elapsed': round(now - started_at.pop(index, now), 2)
+        }
+        outcome.update(fields)
+        return outcome
+
+    def _fill():
+        nonlocal next_index
+        abandoned.difference_update([future for future in abandoned if future.done()])
+        while (next_index < len(symbols) and len(pending) < max_workers
+               and len(pending) + len(abandoned) < max_threads):
+            future = executor.submit(worker, symbols[next_index])
+            started_at[next_index] = time.monotonic()
+            futures[future] = next_index
+            pending.add(future)
+            next_index += 1
+
+    try:
+        _fill()
+
+        while pending or next_index < len(symbols):
+            if pending:
+                done, _ = wait(pending, timeout=TIMEOUT_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+            else:
+                # Mọi thread đều bị mã đã timeout chiếm - chờ một thread trả về
+                done = set()
+                wait(abandoned, timeout=TIMEOUT_CHECK_INTERVAL, return_when=FIRST_COMPLETED)
+            now = time.monotonic()
+            pending.difference_update(done)
+            finished = []
+
+            for future in done:
+                index = futures.pop(future)
+                try:
+                    finished.append(_outcome(index, now, result=future.result()))
+                except (Exception, SystemExit) as e:
+                    # SystemExit: vnstock rate limit trong worker thread
+                    finished.append(_outcome(index, now, error=str(e) or type(e).__name__))
+
+            if timeout is not None:
+                expired = [future for future in pending if now - started_at[futures[future]] > timeout]
+                for future in expired:
+                    pending.discard(future)
+                    abandoned.add(future)
+                    index = futures.pop(future)
+                    logger.warning(f"{symbols[index]}: timed out after {timeout}s")
+                    finished.append(_outcome(index, now, error=f"Timed out after {timeout}s", timed_out=True))
+
+            # Nạp mã mới trước khi yield để worker không phải chờ consumer
+            _fill()
+
+            # Không còn thread trống quá timeout: các mã còn lại coi như timeout
+            if pending or next_index >= len(symbols):
+                stalled_since = None
+            elif stalled_since is None:
+                stalled_since = now
+            elif now - stalled_since > timeout:
+                logger.warning(f"{len(abandoned)} worker threads stuck, "
+                               f"skipping {len(symbols) - next_index} remaining symbols")
+                for index in range(next_index, len(symbols)):
+                    finished.append(_outcome(index, now, timed_out=True,
+                                             error=f"No free worker ({len(abandoned)} threads timed out)"))
+                next_index = len(symbols)
+
+            yield from finished
+
+    finally:
+        # Không chờ các mã đã timeout / chưa chạy
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_scan(symbols: List[str],
+             worker: Callable[[str], Any],
+             max_workers: int = DEFAULT_MAX_WORKERS,
+             timeout: Optional[float] = DEFAULT_SYMBOL_TIMEOUT,
+             progress_callback: Optional[Callable[[int, int, Dict], None]] = None) -> List[Dict]:
+    """
+    Chạy worker(symbol) cho danh sách mã trên thread pool
+
+    Args:
+        symbols: Danh sách mã cổ phiếu
+        worker: Hàm xử lý một mã, trả về kết quả của mã đó
+        max_workers: Số worker tối đa
+        timeout: Thời gian tối đa cho một mã (giây), None = không giới hạn.
+                 Mã quá hạn được bỏ qua (thread vẫn chạy nốt nhưng kết quả bị bỏ)
+        progress_callback: Gọi sau mỗi mã hoàn thành: (completed, total, outcome)
+
+    Returns:
+        List[Dict]: Kết quả theo đúng thứ tự symbols, mỗi phần tử gồm
+        symbol, result, error, timed_out, elapsed (giây)
+    """
+    total = len(symbols)
+    outcomes: List[Optional[Dict]] = [None] * total
+
+    for completed, outcome in enumerate(iter_scan(symbols, worker, max_workers, timeout), 1):
+        outcomes[outcome['index']] = outcome
+        if progress_callback:
+            try:
+                progress_callback(completed, total, outcome)
+            except Exception as e:
+                logger.warning(f"Progress callback error: {e}")
+
+    return outcomes
@@ -0,0 +1,425 @@
+"""
+Scan Jobs - VNStock Background Market Scans
+Chạy các lượt quét toàn thị trường (screener, phân loại, blue-chip) dưới nền
+thay vì trong request handler. Client gửi job, nhận job_id rồi theo dõi tiến
+độ / kết quả từng mã, hủy, hoặc lấy kết quả cuối sau.
+
+Job lưu trong SQLite (bảng scan_jobs, scan_job_results) nên vẫn còn sau khi
+restart server; job đang chờ / đang chạy dở được chạy lại khi khởi động.
+Gửi job trùng loại và tham số với một job đang chạy sẽ dùng chung job đó.
+
+Mỗi loại job là một record stream (cũng dùng cho chế độ stream của API):
+record "result" cho từng mã theo thứ tự hoàn thành, cuối cùng là một record
+"summary" (hoặc "error").
+"""
+
+import heapq
+import json
+import threading
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+import logging
+
+from database import get_db
+from stock_screener import get_stock_list, iter_screener, build_screener_info
+from stock_classifier import StockClassifier
+from bluechip_detector import BlueChipDetector
+from scan_engine import iter_scan
+
+logger = logging.getLogger(__name__)
+
+# Số job chạy đồng thời (mỗi job đã có thread pool quét riêng)
+MAX_CONCURRENT_JOBS = 2
+
+# Giữ job đã kết thúc bao nhiêu ngày
+JOB_RETENTION_DAYS = 7
+
+# Trạng thái job
+STATUS_QUEUED = 'queued'
+STATUS_RUNNING = 'running'
+STATUS_COMPLETED = 'completed'
+STATUS_FAILED = 'failed'
+STATUS_CANCELLED = 'cancelled'
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+
+# ============= RECORD STREAMS =============
+
+def screener_records(exchange: str = "HOSE", limit: int = 20, pe_max: float = 15, roe_min: float = 18,
+                     price_vs_ma50: str = "above", delay: float = 0.0,
+                     prefilter: bool = True) -> Iterator[Dict[str, Any]]:
+    """Record stream của stock screener: từng mã rồi summary"""
+    stock_list = get_stock_list(exchange)
+    if not stock_list:
+        yield {"type": "error", "error": "Không lấy được danh sách cổ phiếu",
+               "timestamp": datetime.now().isoformat()}
+        return
+
+    symbols = stock_list[:limit]
+    total = len(symbols)
+    stats: Dict[str, int] = {}
+    passed_symbols: List[str] = []
+
+    for completed, outcome in enumerate(iter_screener(symbols, pe_max, roe_min, price_vs_ma50, delay,
+                                                      prefilter=prefilter, stats=stats), 1):
+        result = outcome['result']
+        if result.get("passed"):
+            passed_symbols.append(outcome['symbol'])
+        yield {
+            "type": "result",
+            "completed": completed,
+            "total": total,
+            "symbol": outcome['symbol'],
+            "elapsed": outcome['elapsed'],
+            "data": result
+        }
+
+    yield {
+        "type": "summary",
+        "data": {
+            "success": True,
+            "screener_info": build_screener_info(exchange, total, len(passed_symbols), pe_max, roe_min,
+                                                 price_vs_ma50, prefilter, stats),
+            "passed_symbols": passed_symbols
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+def classify_market_records(exchanges: List[str] = ['HOSE'], limit: int = 50,
+                            delay: float = 0.0) -> Iterator[Dict[str, Any]]:
+    """
+    Record stream của phân loại thị trường: từng mã rồi summary
+
+    Summary tính dần (đếm theo nhóm, top 10 bằng heap) nên không phải giữ
+    toàn bộ kết quả trong bộ nhớ.
+    """
+    classifier = StockClassifier()
+    stocks = classifier.get_all_stocks(exchanges=exchanges)
+    if limit:
+        stocks = stocks[:limit]
+    total = len(stocks)
+
+    counters = {key: Counter() for key in ['growth_category', 'risk_category', 'market_cap_category',
+                                           'overall_rating']}
+    score_sum = 0.0
+    classified = 0
+    top_rated: List = []
+    errors: List[str] = []
+    rate_limited: List[str] = []
+
+    for completed, outcome in enumerate(classifier.iter_classify_market(stocks, delay=delay), 1):
+        status = outcome['status']
+        row = classifier.result_to_row(outcome['result']) if status == 'classified' else None
+
+        if status == 'classified' and row is None:
+            status = 'error'
+
+        if row is not None:
+            classified += 1
+            for key, counter in counters.items():
+                counter[row[key]] += 1
+            score_sum += row['overall_score']
+            entry = (row['overall_score'], -outcome['index'],
+                     {k: row[k] for k in ['symbol', 'overall_rating', 'overall_score', 'recommendation']})
+            if len(top_rated) < 10:
+                heapq.heappush(top_rated, entry)
+            else:
+                heapq.heappushpop(top_rated, entry)
+        elif status == 'rate_limited':
+            rate_limited.append(outcome['symbol'])
+        else:
+            errors.append(outcome['symbol'])
+
+        yield {
+            "type": "result",
+            "completed": completed,
+            "total": total,
+            "symbol": outcome['symbol'],
+            "status": status,
+            "elapsed": outcome['elapsed'],
+            "data": row,
+            "error": outcome['error']
+        }
+
+    yield {
+        "type": "summary",
+        "success": classified > 0,
+        "data": {
+            "total_stocks": classified,
+            "by_growth": dict(counters['growth_category']),
+            "by_risk": dict(counters['risk_category']),
+            "by_market_cap": dict(counters['market_cap_category']),
+            "by_rating": dict(counters['overall_rating']),
+            "avg_score": round(score_sum / classified, 2) if classified else None,
+            "top_rated": [entry[2] for entry in sorted(top_rated, reverse=True)],
+            "errors": errors,
+            "rate_limited": rate_limited
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+def bluechip_records(symbols: Optional[List[str]] = None, min_score: int = 4) -> Iterator[Dict[str, Any]]:
+    """Record stream của quét blue-chip: từng mã rồi summary (như /bluechip/scan)"""
+    detector = BlueChipDetector()
+    if symbols is None:
+        symbols = detector.vn30_list
+    total = len(symbols)
+    bluechips = []
+
+    for completed, outcome in enumerate(iter_scan(symbols, detector.check_bluechip_criteria), 1):
+        result = outcome['result']
+        if result and result['is_bluechip'] and result.get('score', 0) >= min_score:
+            bluechips.append(result)
+        yield {
+            "type": "result",
+            "completed": completed,
+            "total": total,
+            "symbol": outcome['symbol'],
+            "elapsed": outcome['elapsed'],
+            "data": result,
+            "error": outcome['error']
+        }
+
+    bluechips.sort(key=lambda x: x['score'], reverse=True)
+    yield {
+        "type": "summary",
+        "data": {
+            "success": True,
+            "total": len(bluechips),
+            "bluechips": bluechips,
+            "scan_date": datetime.now().isoformat(),
+            "criteria": detector.criteria
+        },
+        "timestamp": datetime.now().isoformat()
+    }
+
+
+# Loại job -> (record stream, tham số mặc định)
+JOB_TYPES: Dict[str, Tuple[Callable[..., Iterator[Dict]], Dict[str, Any]]] = {
+    'screener': (screener_records, {
+        'exchange': 'HOSE', 'limit': 20, 'pe_max': 15.0, 'roe_min': 18.0,
+        'price_vs_ma50': 'above', 'delay': 0.0, 'prefilter': True
+    }),
+    'classify_market': (classify_market_records, {'exchanges': ['HOSE'], 'limit': 50, 'delay': 0.0}),
+    'bluechip': (bluechip_records, {'symbols': None, 'min_score': 4}),
+}
+
+
+def _symbol_list(value: Any) -> Optional[List[str]]:
+    """'ACB, vcb' hoặc ['ACB', 'vcb'] -> ['ACB', 'VCB']"""
+    if value is None:
+        return None
+    items = value.split(',') if isinstance(value, str) else value
+    return [str(item).strip().upper() for item in items if str(item).strip()]
+
+
+def normalize_params(job_type: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    Kiểm tra và chuẩn hóa tham số job (điền mặc định, ép kiểu) để hai lần
+    gửi cùng một lượt quét có cùng tham số
+
+    Raises:
+        ValueError: Loại job hoặc tham số không hợp lệ
+    """
+    if job_type not in JOB_TYPES:
+        raise ValueError(f"Loại job không hỗ trợ: {job_type} (hỗ trợ: {', '.join(JOB_TYPES)})")
+
+    _, defaults = JOB_TYPES[job_type]
+    params = dict(params or {})
+
+    unknown = set(params) - set(defaults)
+    if unknown:
+        raise ValueError(f"Tham số không hỗ trợ cho {job_type}: {', '.join(sorted(unknown))}")
+
+    normalized = {}
+    for name, default in defaults.items():
+        value = params.get(name, default)
+        if name in ('exchanges', 'symbols'):
+            value = _symbol_list(value)
+        elif name == 'exchange':
+            value = str(value).upper()
+        elif isinstance(default, bool):
+            value = value.lower() in ('1', 'true', 'yes') if isinstance(value, str) else bool(value)
+        elif isinstance(default, (int, float)):
+            try:
+                value = type(default)(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"Tham số {name} phải là số: {value}")
+        normalized[name] = value
+
+    return normalized
+
+
+def _params_key(job_type: str, params: Dict[str, Any]) -> str:
+    return f"{job_type}:{json.dumps(params, sort_keys=True)}"
+
+
+# ============= JOB MANAGER =============
+
+class ScanJobManager:
+    """Chạy và theo dõi scan job (thread pool riêng, trạng thái lưu trong SQLite)"""
+
+    def __init__(self, max_jobs: int = MAX_CONCURRENT_JOBS):
+        self.db = get_db()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_jobs), thread_name_prefix='scan-job')
+        self._cancel_events: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, job_type: str, params: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """
+        Gửi scan job
+
+        Returns:
+            Dict job (kèm shared=True nếu dùng chung job đang chạy cùng tham số)
+
+        Raises:
+            ValueError: Loại job hoặc tham số không hợp lệ
+        """
+        params = normalize_params(job_type, params)
+        params_key = _params_key(job_type, params)
+
+        with self._lock:
+            existing = self.db.find_active_scan_job(params_key)
+            if existing:
+                logger.info(f"Job {existing['job_id']} ({job_type}) đang chạy, dùng chung")
+                return {**self._describe(existing), 'shared': True}
+
+            job_id = uuid.uuid4().hex[:12]
+            if not self.db.create_scan_job(job_id, job_type, params, params_key):
+                raise RuntimeError("Không tạo được job")
+            self._start(job_id, job_type, params)
+
+        logger.info(f"Đã tạo job {job_id} ({job_type}): {params}")
+        return {**self._describe(self.db.get_scan_job(job_id)), 'shared': False}
+
+    def _start(self, job_id: str, job_type: str, params: Dict[str, Any]):
+        event = threading.Event()
+        self._cancel_events[job_id] = event
+        self._executor.submit(self._run, job_id, job_type, params, event)
+
+    def _run(self, job_id: str, job_type: str, params: Dict[str, Any], cancel: threading.Event):
+        """Chạy record stream của job, lưu từng kết quả và trạng thái cuối"""
+        if cancel.is_set():
+            self.db.update_scan_job(job_id, status=STATUS_CANCELLED, finished_at=datetime.now().isoformat())
+            self._cancel_events.pop(job_id, None)
+            return
+
+        self.db.clear_scan_job_results(job_id)
+        self.db.update_scan_job(job_id, status=STATUS_RUNNING, completed=0, total=0,
+                                started_at=datetime.now().isoformat())
+        logger.info(f"Bắt đầu job {job_id} ({job_type})")
+
+        records_func, _ = JOB_TYPES[job_type]
+        records = records_func(**params)
+        summary = None
+        error = None
+        seq = 0
+
+        try:
+            for record in records:
+                if record['type'] == 'result':
+                    seq += 1
+                    self.db.add_scan_job_result(job_id, seq, record.get('symbol'), record)
+                    self.db.update_scan_job(job_id, completed=record['completed'], total=record['total'])
+                elif record['type'] == 'summary':
+                    summary = record['data']
+                else:
+                    error = record.get('error', 'Unknown error')
+
+                # Hủy có hiệu lực sau mã đang chạy; đóng stream sẽ hủy các mã chưa chạy
+                if cancel.is_set():
+                    break
+        except Exception as e:
+            logger.error(f"Job {job_id} lỗi: {e}")
+            error = str(e)
+        finally:
+            records.close()
+            self._cancel_events.pop(job_id, None)
+
+        finished_at = datetime.now().isoformat()
+        if cancel.is_set():
+            self.db.update_scan_job(job_id, status=STATUS_CANCELLED, finished_at=finished_at)
+            logger.info(f"Job {job_id} đã hủy sau {seq} mã")
+        elif error or summary is None:
+            self.db.update_scan_job(job_id, status=STATUS_FAILED, error=error or "No summary",
+                                    finished_at=finished_at)
+        else:
+            self.db.update_scan_job(job_id, status=STATUS_COMPLETED, result=summary, finished_at=finished_at)
+            logger.info(f"Hoàn thành job {job_id} ({job_type}): {seq} mã")
+
+    def cancel(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Hủy job đang chờ / đang chạy
+
+        Returns:
+            Dict job, None nếu không có job
+        """
+        job = self.db.get_scan_job(job_id)
+        if job is None:
+            return None
+
+        if job['status'] in ACTIVE_STATUSES:
+            event = self._cancel_events.get(job_id)
+            if event is not None:
+                event.set()
+            else:
+                # Job không chạy trong process này (VD: process cũ đã dừng)
+                self.db.update_scan_job(job_id, status=STATUS_CANCELLED, finished_at=datetime.now().isoformat())
+
+        return self._describe(self.db.get_scan_job(job_id))
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Trạng thái, tiến độ và kết quả cuối (khi xong) của job"""
+        job = self.db.get_scan_job(job_id)
+        return self._describe(job) if job else None
+
+    def list(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """Danh sách job gần nhất"""
+        return [self._describe(job) for job in self.db.get_scan_jobs(status, limit)]
+
+    def results(self, job_id: str, after: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
+        """Kết quả từng mã đã có (seq > after), dùng được khi job đang chạy"""
+        return self.db.get_scan_job_results(job_id, after, limit)
+
+    def resume_pending(self) -> int:
+        """Chạy lại các job chưa xong của lần chạy server trước (gọi khi khởi động)"""
+        resumed = 0
+        with self._lock:
+            for status in ACTIVE_STATUSES:
+                for job in self.db.get_scan_jobs(status, limit=1000):
+                    if job['job_id'] in self._cancel_events or job['job_type'] not in JOB_TYPES:
+                        continue
+                    self.db.update_scan_job(job['job_id'], status=STATUS_QUEUED, completed=0)
+                    self._start(job['job_id'], job['job_type'], job['params'])
+                    resumed += 1
+        if resumed:
+            logger.info(f"Chạy lại {resumed} job chưa hoàn thành")
+        return resumed
+
+    def _describe(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        total = job.get('total') or 0
+        job['progress'] = round(job.get('completed', 0) / total * 100, 1) if total else 0.0
+        return job
+
+
+# Singleton instance
+_job_manager = None
+_job_manager_lock = threading.Lock()
+
+
+def get_job_manager() -> ScanJobManager:
+    """Get scan job manager (singleton); dọn job cũ và chạy lại job dở khi khởi tạo"""
+    global _job_manager
+    if _job_manager is None:
+        with _job_manager_lock:
+            if _job_manager is None:
+                manager = ScanJobManager()
+                manager.db.delete_old_scan_jobs(JOB_RETENTION_DAYS)
+                manager.resume_pending()
+                _job_manager = manager
+    return _job_manager
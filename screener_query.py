@@ -0,0 +1,397 @@
+"""
+Screener Query - VNStock Declarative Screening
+Sàng lọc toàn thị trường bằng biểu thức tiêu chí trên bảng symbol_metrics
+(chỉ số mới nhất của từng mã trong vnstock.db). Biểu thức được biên dịch
+thành câu SQL có tham số nên lọc / sắp xếp / giới hạn đều chạy trong SQLite,
+không cần quét lại thị trường.
+
+Cú pháp:
+    PE < 15 AND ROE > 18 AND RSI BETWEEN 30 AND 50
+    price > ma50 * 1.05 OR (rating IN ('A+', 'A') AND NOT risk_category = 'high_risk')
+    pe IS NOT NULL
+
+Bảng symbol_metrics được cập nhật bởi:
+    - refresh_technical_metrics(): chỉ báo kỹ thuật từ price store (panel_indicators)
+    - record_fundamentals(): sau mỗi lần calculate_fa_ratios thành công
+    - record_classification() / record_classifications(): khi StockClassifier
+      lưu kết quả (từng mã hoặc theo lô khi quét thị trường)
+"""
+
+import re
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import logging
+
+from database import get_db, SYMBOL_METRIC_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+# Số mã trả về mặc định / tối đa
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 2000
+
+# Tên trường trong biểu thức -> cột symbol_metrics (không phân biệt hoa thường)
+FIELDS: Dict[str, str] = {column.upper(): column for column in SYMBOL_METRIC_COLUMNS + ['symbol']}
+FIELDS.update({
+    'CLOSE': 'price',
+    'RATING': 'overall_rating',
+    'SCORE': 'overall_score',
+    'MARKETCAP': 'market_cap',
+    'GROWTH': 'growth_category',
+    'RISK': 'risk_category',
+    'MOMENTUM': 'momentum_category',
+})
+
+# Cột lấy từ panel snapshot khi refresh_technical_metrics
+TECHNICAL_COLUMNS = {
+    'Close': 'price', 'Volume': 'volume', 'Volume_MA': 'volume_ma',
+    'MA20': 'ma20', 'MA50': 'ma50', 'MA200': 'ma200', 'RSI': 'rsi',
+    'MACD': 'macd', 'MACD_Signal': 'macd_signal', 'MACD_Hist': 'macd_hist',
+    'BB_Upper': 'bb_upper', 'BB_Lower': 'bb_lower', 'ATR': 'atr', 'ADX': 'adx', 'Stoch_K': 'stoch_k',
+}
+
+# Tỷ số FA (calculate_fa_ratios) -> cột
+FUNDAMENTAL_COLUMNS = {'PE': 'pe', 'ROE': 'roe', 'EPS': 'eps', 'NPM': 'npm', 'DE': 'de'}
+
+KEYWORDS = {'AND', 'OR', 'NOT', 'BETWEEN', 'IN', 'IS', 'NULL'}
+COMPARISON_OPERATORS = {'<', '<=', '>', '>=', '=', '==', '!=', '<>'}
+
+TOKEN_PATTERN = re.compile(r'''
+    \s*(?:
+        (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)
+      | (?P<string>'(?:[^']|'')*')
+      | (?P<name>[A-Za-z_][A-Za-z0-9_]*)
+      | (?P<op><=|>=|!=|<>|==|[<>=(),+\-*/])
+    )
+''', re.VERBOSE)
+
+
+class QueryError(ValueError):
+    """Biểu thức sàng lọc không hợp lệ"""
+
+
+def _tokenize(expression: str) -> List[Tuple[str, Any]]:
+    """Tách biểu thức thành tokens (kind, value)"""
+    tokens = []
+    position = 0
+    expression = expression.rstrip()
+
+    while position < len(expression):
+        match = TOKEN_PATTERN.match(expression, position)
+        if not match or match.end() == position:
+            raise QueryError(f"Ký tự không hợp lệ tại vị trí {position}: {expression[position:position + 10]!r}")
+        position = match.end()
+
+        if match.group('number') is not None:
+            tokens.append(('number', float(match.group('number'))))
+        elif match.group('string') is not None:
+            tokens.append(('string', match.group('string')[1:-1].replace("''", "'")))
+        elif match.group('name') is not None:
+            name = match.group('name').upper()
+            if name in KEYWORDS:
+                tokens.append(('keyword', name))
+            elif name in FIELDS:
+                tokens.append(('field', FIELDS[name]))
+            else:
+                raise QueryError(f"Trường không hỗ trợ: {match.group('name')}")
+        else:
+            tokens.append(('op', match.group('op')))
+
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent parser, sinh SQL với placeholder ?
+
+    expr       := and_expr (OR and_expr)*
+    and_expr   := not_expr (AND not_expr)*
+    not_expr   := NOT not_expr | '(' expr ')' | predicate
+    predicate  := value (cmp value | [NOT] BETWEEN value AND value
+                         | [NOT] IN '(' value (',' value)* ')' | IS [NOT] NULL)
+    value      := term (('+' | '-') term)*
+    term       := unary (('*' | '/') unary)*
+    unary      := '-' unary | number | string | field | '(' value ')'
+    """
+
+    def __init__(self, tokens: List[Tuple[str, Any]]):
+        self.tokens = tokens
+        self.position = 0
+        self.params: List[Any] = []
+
+    def peek(self, offset: int = 0) -> Tuple[Optional[str], Any]:
+        index = self.position + offset
+        return self.tokens[index] if index < len(self.tokens) else (None, None)
+
+    def accept(self, kind: str, value: Any = None) -> bool:
+        token_kind, token_value = self.peek()
+        if token_kind == kind and (value is None or token_value == value):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, kind: str, value: Any = None):
+        if not self.accept(kind, value):
+            found = self.peek()[1]
+            raise QueryError(f"Cần {value or kind} nhưng gặp {found if found is not None else 'cuối biểu thức'}")
+
+    def parse(self) -> str:
+        if not self.tokens:
+            raise QueryError("Biểu thức rỗng")
+        sql = self.expr()
+        if self.position != len(self.tokens):
+            raise QueryError(f"Thừa token: {self.peek()[1]}")
+        return sql
+
+    def expr(self) -> str:
+        parts = [self.and_expr()]
+        while self.accept('keyword', 'OR'):
+            parts.append(self.and_expr())
+        return parts[0] if len(parts) == 1 else '(' + ' OR '.join(parts) + ')'
+
+    def and_expr(self) -> str:
+        parts = [self.not_expr()]
+        while self.accept('keyword', 'AND'):
+            parts.append(self.not_expr())
+        return parts[0] if len(parts) == 1 else '(' + ' AND '.join(parts) + ')'
+
+    def not_expr(self) -> str:
+        if self.accept('keyword', 'NOT'):
+            return f'NOT {self.not_expr()}'
+
+        if self.peek() == ('op', '('):
+            # '(' có thể mở nhóm điều kiện hoặc biểu thức số: thử nhóm điều kiện trước
+            saved_position, saved_params = self.position, len(self.params)
+            try:
+                self.position += 1
+                sql = self.expr()
+                self.expect('op', ')')
+                if self.peek()[0] != 'op' or self.peek()[1] == ')':
+                    return f'({sql})'
+            except QueryError:
+                pass
+            self.position = saved_position
+            del self.params[saved_params:]
+
+        return self.predicate()
+
+    def predicate(self) -> str:
+        left = self.value()
+        kind, token = self.peek()
+
+        if kind == 'op' and token in COMPARISON_OPERATORS:
+            self.position += 1
+            operator = {'==': '=', '!=': '<>'}.get(token, token)
+            return f'{left} {operator} {self.value()}'
+
+        negate = ''
+        if kind == 'keyword' and token == 'NOT' and self.peek(1)[1] in ('BETWEEN', 'IN'):
+            self.position += 1
+            negate = 'NOT '
+
+        if self.accept('keyword', 'BETWEEN'):
+            low = self.value()
+            self.expect('keyword', 'AND')
+            return f'{left} {negate}BETWEEN {low} AND {self.value()}'
+
+        if self.accept('keyword', 'IN'):
+            self.expect('op', '(')
+            items = [self.value()]
+            while self.accept('op', ','):
+                items.append(self.value())
+            self.expect('op', ')')
+            return f"{left} {negate}IN ({', '.join(items)})"
+
+        if self.accept('keyword', 'IS'):
+            not_null = self.accept('keyword', 'NOT')
+            self.expect('keyword', 'NULL')
+            return f"{left} IS {'NOT ' if not_null else ''}NULL"
+
+        raise QueryError(f"Cần toán tử so sánh sau {left}")
+
+    def value(self) -> str:
+        sql = self.term()
+        while self.peek()[0] == 'op' and self.peek()[1] in ('+', '-'):
+            operator = self.peek()[1]
+            self.position += 1
+            sql = f'({sql} {operator} {self.term()})'
+        return sql
+
+    def term(self) -> str:
+        sql = self.unary()
+        while self.peek()[0] == 'op' and self.peek()[1] in ('*', '/'):
+            operator = self.peek()[1]
+            self.position += 1
+            sql = f'({sql} {operator} {self.unary()})'
+        return sql
+
+    def unary(self) -> str:
+        kind, token = self.peek()
+
+        if kind == 'op' and token == '-':
+            self.position += 1
+            return f'(-{self.unary()})'
+        if kind in ('number', 'string'):
+            self.position += 1
+            self.params.append(token)
+            return '?'
+        if kind == 'field':
+            self.position += 1
+            return token
+        if kind == 'op' and token == '(':
+            self.position += 1
+            sql = self.value()
+            self.expect('op', ')')
+            return f'({sql})'
+
+        raise QueryError(f"Cần giá trị nhưng gặp {token if token is not None else 'cuối biểu thức'}")
+
+
+def compile_query(expression: str) -> Tuple[str, List[Any]]:
+    """
+    Biên dịch biểu thức sàng lọc thành điều kiện WHERE
+
+    Args:
+        expression: VD "PE < 15 AND ROE > 18 AND RSI BETWEEN 30 AND 50"
+
+    Returns:
+        Tuple (SQL WHERE với placeholder ?, danh sách tham số)
+
+    Raises:
+        QueryError: Biểu thức không hợp lệ hoặc dùng trường không hỗ trợ
+    """
+    parser = _Parser(_tokenize(expression))
+    return parser.parse(), parser.params
+
+
+def compile_order_by(order_by: str) -> str:
+    """
+    Biên dịch tiêu chí sắp xếp, VD: "overall_score DESC, pe" hoặc "-score, pe"
+
+    Mã thiếu dữ liệu (NULL) luôn xếp cuối.
+    """
+    clauses = []
+    for part in order_by.split(','):
+        words = part.split()
+        if not words:
+            continue
+
+        descending = False
+        name = words[0]
+        if name.startswith('-'):
+            descending, name = True, name[1:]
+        if len(words) > 2 or (len(words) == 2 and words[1].upper() not in ('ASC', 'DESC')):
+            raise QueryError(f"Sắp xếp không hợp lệ: {part.strip()}")
+        if len(words) == 2:
+            descending = words[1].upper() == 'DESC'
+
+        column = FIELDS.get(name.upper())
+        if column is None:
+            raise QueryError(f"Trường không hỗ trợ: {name}")
+        clauses.append(f"{column} {'DESC' if descending else 'ASC'} NULLS LAST")
+
+    return ', '.join(clauses)
+
+
+def run_query(expression: Optional[str] = None, order_by: Optional[str] = None,
+              limit: int = DEFAULT_LIMIT) -> List[Dict]:
+    """
+    Sàng lọc toàn thị trường trên bảng symbol_metrics
+
+    Args:
+        expression: Biểu thức tiêu chí (None = mọi mã)
+        order_by: Tiêu chí sắp xếp (mặc định overall_score DESC)
+        limit: Số mã tối đa (<= MAX_LIMIT)
+
+    Returns:
+        List[Dict]: Chỉ số của các mã thỏa điều kiện
+
+    Raises:
+        QueryError: Biểu thức không hợp lệ
+    """
+    started = datetime.now()
+    where, params = compile_query(expression) if expression and expression.strip() else (None, [])
+    order_sql = compile_order_by(order_by or 'overall_score DESC, symbol')
+    limit = max(1, min(int(limit or DEFAULT_LIMIT), MAX_LIMIT))
+
+    rows = get_db().query_symbol_metrics(where, params, order_sql, limit)
+    logger.info(f"Screener query '{expression}': {len(rows)} symbols "
+                f"in {(datetime.now() - started).total_seconds() * 1000:.1f}ms")
+    return rows
+
+
+# ============= METRICS REFRESH =============
+
+def refresh_technical_metrics(symbols: Optional[List[str]] = None, days: int = 365) -> int:
+    """
+    Cập nhật chỉ báo kỹ thuật mới nhất từ price store cho toàn thị trường
+
+    Args:
+        symbols: Danh sách mã (None = mọi mã trong price store)
+        days: Số ngày dữ liệu (>= 300 để có MA200)
+
+    Returns:
+        int: Số mã đã cập nhật
+    """
+    from panel_indicators import compute_panel_indicators, latest_snapshot, load_price_panel
+
+    snapshot = latest_snapshot(compute_panel_indicators(load_price_panel(symbols, days)))
+    if snapshot.empty:
+        return 0
+
+    rows = []
+    for symbol, values in snapshot.iterrows():
+        row = {'symbol': symbol, 'ta_date': values['date'].strftime('%Y-%m-%d')}
+        for source, column in TECHNICAL_COLUMNS.items():
+            value = values[source]
+            row[column] = None if value != value else float(value)  # NaN -> NULL
+        rows.append(row)
+
+    updated = get_db().upsert_symbol_metrics(rows, source='ta')
+    logger.info(f"Refreshed technical metrics for {updated} symbols")
+    return updated
+
+
+def record_fundamentals(symbol: str, ratios: Dict[str, Any]) -> bool:
+    """Lưu tỷ số FA mới nhất của một mã (từ calculate_fa_ratios)"""
+    row = {'symbol': symbol}
+    row.update({column: ratios.get(name) for name, column in FUNDAMENTAL_COLUMNS.items()})
+    return get_db().upsert_symbol_metrics([row], source='fa') == 1
+
+
+def _classification_row(symbol: str, result: Dict[str, Any], exchange: Optional[str] = None) -> Dict[str, Any]:
+    """Dòng symbol_metrics từ kết quả của StockClassifier"""
+    classifications = result.get('classifications', {})
+    overall = result.get('overall_rating', {})
+
+    row = {
+        'symbol': symbol,
+        'market_cap': classifications.get('market_cap', {}).get('market_cap'),
+        'growth_category': classifications.get('growth', {}).get('category'),
+        'risk_category': classifications.get('risk', {}).get('category'),
+        'market_cap_category': classifications.get('market_cap', {}).get('category'),
+        'momentum_category': classifications.get('momentum', {}).get('category'),
+        'overall_rating': overall.get('rating'),
+        'overall_score': overall.get('score'),
+    }
+    if exchange:
+        row['exchange'] = exchange.upper()
+    return row
+
+
+def record_classification(symbol: str, result: Dict[str, Any], exchange: Optional[str] = None) -> bool:
+    """Lưu kết quả phân loại mới nhất của một mã (từ StockClassifier)"""
+    return get_db().upsert_symbol_metrics([_classification_row(symbol, result, exchange)]) == 1
+
+
+def record_classifications(items: List[Tuple[str, Dict[str, Any], Optional[str]]]) -> int:
+    """
+    Lưu kết quả phân loại của nhiều mã trong một transaction
+
+    Args:
+        items: List (symbol, result, exchange)
+
+    Returns:
+        Số mã đã cập nhật
+    """
+    return get_db().upsert_symbol_metrics([_classification_row(*item) for item in items])
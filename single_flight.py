@@ -0,0 +1,107 @@
+"""
+Single Flight - VNStock Upstream Request Coalescing
+Gộp các lời gọi upstream giống hệt nhau đang chạy đồng thời: request đầu tiên
+cho một key thực hiện lời gọi, các request cùng key đến trong lúc đó chờ và
+dùng chung kết quả (hoặc lỗi). Giảm số request tới vnstock khi nhiều người
+cùng xem một mã (VD: blue chip lúc mở cửa).
+
+Chỉ gộp các lời gọi đang chạy, không cache kết quả sau khi lời gọi xong.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """Lời gọi đang chạy cho một key"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Gộp lời gọi đồng thời theo key (thread-safe)
+
+    Caller dùng chung cùng một object kết quả, nếu có thể bị sửa thì caller
+    phải copy trước khi sửa.
+    """
+
+    def __init__(self):
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, func: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Chạy func() cho key, hoặc chờ lời gọi cùng key đang chạy
+
+        Lỗi của lời gọi (kể cả SystemExit khi vnstock bị rate limit) được
+        raise lại cho mọi caller đang chờ.
+
+        Returns:
+            Tuple (kết quả, shared) - shared=True nếu dùng lại lời gọi của
+            request khác
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                call.followers += 1
+                self.shared += 1
+
+        if not leader:
+            logger.debug(f"Dùng chung lời gọi upstream đang chạy: {key}")
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        if call.followers:
+            logger.info(f"Lời gọi upstream {key} dùng chung cho {call.followers} request")
+        return call.result, False
+
+    def stats(self) -> Dict[str, int]:
+        """Thống kê số lời gọi thực hiện và số request dùng chung"""
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executed': self.executed,
+                'shared': self.shared
+            }
+
+
+# Singleton instance
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight() -> SingleFlight:
+    """Get single-flight instance (singleton, dùng chung cho mọi lời gọi upstream)"""
+    global _single_flight
+    if _single_flight is None:
+        with _single_flight_lock:
+            if _single_flight is None:
+                _single_flight = SingleFlight()
+    return _single_flight
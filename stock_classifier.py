@@ -4,26 +4,42 @@ Stock Classification System - VNStock
 Phân loại toàn bộ cổ phiếu thị trường theo nhiều tiêu chí
 """
 
-from vnstock import Vnstock
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Optional
-from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from datetime import datetime
 import logging
 import time
-from database import get_db
+from database import BatchWriter, get_db
 from fa_calculator import calculate_fa_ratios
 from ta_analyzer import calculate_ta_indicators
+from data_store import SymbolDataBundle, get_price_history
+from scan_engine import DEFAULT_MAX_WORKERS, DEFAULT_SYMBOL_TIMEOUT, iter_scan
+from screener_query import record_classification, record_classifications
 
 logger = logging.getLogger(__name__)
 
+# Retry queue cho các mã bị vnstock rate limit
+RETRY_TASK = 'classify'
+RETRY_BASE_DELAY_SECONDS = 120
+RETRY_MAX_DELAY_SECONDS = 3600
+RETRY_MAX_ATTEMPTS = 8
+
+# Cột tóm tắt khi đọc cache phân loại (bảng kết quả screener, /classify/filter)
+SUMMARY_COLUMNS = ['symbol', 'exchange', 'overall_rating', 'overall_score', 'growth_category',
+                   'risk_category', 'market_cap_category', 'momentum_category', 'recommendation',
+                   'age_hours']
+
+# Quét thị trường: ghi kết quả vào cache theo lô N mã hoặc sau N giây
+CLASSIFICATION_BATCH_SIZE = 50
+CLASSIFICATION_BATCH_SECONDS = 10.0
+
 
 class StockClassifier:
     """Phân loại cổ phiếu toàn thị trường"""
     
     def __init__(self):
         self.db = get_db()
-        self.stock = Vnstock()
         
         # Classification thresholds
         self.thresholds = {
@@ -85,14 +101,14 @@ class StockClassifier:
             logger.error(f"Error getting stock list: {e}")
             return []
     
-    def calculate_volatility(self, symbol: str, days: int = 365) -> float:
+    def calculate_volatility(self, symbol: str, days: int = 365,
+                             bundle: Optional[SymbolDataBundle] = None) -> float:
         """Tính độ biến động giá"""
         try:
-            stock_obj = self.stock.stock(symbol=symbol, source='VCI')
-            end_date = datetime.now().strftime("%Y-%m-%d")
-            start_date = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
-            
-            df = stock_obj.quote.history(start=start_date, end=end_date)
+            if bundle is not None:
+                df = bundle.get_history(days)
+            else:
+                df = get_price_history(symbol, days=days)
             
             if df.empty or len(df) < 10:
                 return 100
@@ -107,28 +123,36 @@ class StockClassifier:
             logger.debug(f"Error calculating volatility for {symbol}: {e}")
             return 50  # Default medium volatility
     
-    def estimate_market_cap(self, symbol: str, fa_data: Dict) -> float:
+    def estimate_market_cap(self, symbol: str, fa_data: Dict,
+                            bundle: Optional[SymbolDataBundle] = None) -> float:
         """Ước tính vốn hóa thị trường"""
         try:
             ratios = fa_data.get('ratios', {})
             
-            # Get current price
-            stock_obj = self.stock.stock(symbol=symbol, source='VCI')
-            end_date = datetime.now().strftime("%Y-%m-%d")
-            start_date = (datetime.now() - timedelta(days=5)).strftime("%Y-%m-%d")
-            df = stock_obj.quote.history(start=start_date, end=end_date)
+            if bundle is None:
+                bundle = SymbolDataBundle(symbol, history_days=5)
             
-            if df.empty:
+            # Get current price
+            if bundle.current_price is None:
                 return 0
             
-            current_price = df['close'].iloc[-1] * 1000  # VND
+            current_price = bundle.current_price * 1000  # VND
             
-            # Estimate from balance sheet
-            stock_obj = self.stock.stock(symbol=symbol, source='VCI')
-            balance_sheet = stock_obj.finance.balance_sheet(period='quarter', lang='en')
+            # Estimate from balance sheet (same quarterly report as FA)
+            balance_sheet = bundle.balance_sheet
             
             if not balance_sheet.empty:
-                equity = balance_sheet['totalStockholderEquity'].iloc[0] * 1_000_000_000
+                equity_col = next(
+                    (col for col in balance_sheet.columns if 'vốn chủ sở hữu' in col.lower()),
+                    None
+                )
+                if equity_col is None:
+                    return 0
+                
+                equity = float(balance_sheet[equity_col].iloc[0])
+                if 'tỷ' in equity_col.lower():
+                    equity *= 1_000_000_000  # Billion to VND
+                
                 # Assume P/B ratio of 2 for estimate
                 market_cap = equity * 2
                 return market_cap
@@ -310,7 +334,8 @@ class StockClassifier:
             'signal_count': {'bullish': bullish_count, 'bearish': bearish_count}
         }
     
-    def classify_stock(self, symbol: str, use_cache: bool = True, save_cache: bool = True) -> Dict:
+    def classify_stock(self, symbol: str, use_cache: bool = True, save_cache: bool = True,
+                       writer: Optional[BatchWriter] = None) -> Dict:
         """
         Phân loại toàn diện 1 mã cổ phiếu
         
@@ -318,6 +343,8 @@ class StockClassifier:
             symbol: Mã cổ phiếu
             use_cache: Dùng cache nếu có (< 24h)
             save_cache: Tự động lưu kết quả vào cache
+            writer: BatchWriter từ classification_writer() để ghi theo lô;
+                    None = ghi ngay
         
         Returns:
             Dict: Kết quả classification
@@ -339,25 +366,33 @@ class StockClassifier:
                 'error': None
             }
             
+            # Fetch each dataset once and share it across FA, TA, volatility and market cap
+            bundle = SymbolDataBundle(symbol, history_days=365)
+            
             # Get FA data
-            fa_data = calculate_fa_ratios(symbol)
+            fa_data = calculate_fa_ratios(symbol, bundle=bundle)
             logger.info(f"FA data for {symbol}: FULL fa_data={fa_data}")
             logger.info(f"FA data for {symbol}: ratios={fa_data.get('ratios')}")
             
             if 'error' in fa_data:
                 result['error'] = fa_data['error']
+                if fa_data.get('rate_limited'):
+                    result['rate_limited'] = True
+                    if save_cache:
+                        self._queue_retry(symbol, fa_data['error'])
                 return result
             
             # Get TA data
             try:
-                ta_data = calculate_ta_indicators(symbol, period_days=365)
+                ta_data = calculate_ta_indicators(symbol, period_days=365, bundle=bundle,
+                                                  latest_only=True)
             except Exception as e:
                 logger.warning(f"Could not get TA data for {symbol}: {e}")
                 ta_data = {}
             
             # Calculate additional metrics
-            volatility = self.calculate_volatility(symbol)
-            market_cap = self.estimate_market_cap(symbol, fa_data)
+            volatility = self.calculate_volatility(symbol, bundle=bundle)
+            market_cap = self.estimate_market_cap(symbol, fa_data, bundle=bundle)
             
             # Classify
             result['classifications']['growth'] = self.classify_growth_potential(fa_data)
@@ -373,11 +408,27 @@ class StockClassifier:
             # Save to cache if enabled and no error
             if save_cache and not result.get('error'):
                 exchange = 'HOSE'  # Default, can be improved by detecting from symbol
-                self.db.save_classification_result(symbol, result, exchange)
-                logger.info(f"💾 Saved {symbol} to cache")
+                if writer is not None:
+                    writer.add((symbol, result, exchange))
+                else:
+                    self.db.save_classification_result(symbol, result, exchange)
+                    record_classification(symbol, result, exchange)
+                    self.db.remove_retry(symbol, task=RETRY_TASK)
+                    logger.info(f"💾 Saved {symbol} to cache")
             
             return result
             
+        except SystemExit as e:
+            # VNStock calls sys.exit() on rate limit
+            logger.error(f"Rate limit hit while classifying {symbol}: {e}")
+            if save_cache:
+                self._queue_retry(symbol, str(e))
+            return {
+                'symbol': symbol,
+                'error': f"Rate limit exceeded for {symbol}. Please wait and try again.",
+                'rate_limited': True,
+                'timestamp': datetime.now().isoformat()
+            }
         except Exception as e:
             logger.error(f"Error classifying {symbol}: {e}")
             return {
@@ -386,6 +437,76 @@ class StockClassifier:
                 'timestamp': datetime.now().isoformat()
             }
     
+    def classification_writer(self) -> BatchWriter:
+        """BatchWriter ghi kết quả phân loại theo lô (cache, symbol_metrics, retry queue)"""
+        return BatchWriter(self._save_classifications, max_size=CLASSIFICATION_BATCH_SIZE,
+                           max_delay=CLASSIFICATION_BATCH_SECONDS)
+    
+    def _save_classifications(self, items: List[Tuple[str, Dict, str]]) -> int:
+        """Ghi một lô (symbol, result, exchange): mỗi bảng một transaction"""
+        saved = self.db.save_classification_results(items)
+        if saved:
+            record_classifications(items)
+            self.db.remove_retries([symbol for symbol, _, _ in items], task=RETRY_TASK)
+            logger.info(f"💾 Saved {saved} classifications to cache")
+        return saved
+    
+    def _queue_retry(self, symbol: str, error: str):
+        """Đưa mã bị rate limit vào retry queue (backoff tăng dần)"""
+        self.db.enqueue_retry(
+            symbol,
+            task=RETRY_TASK,
+            error=error,
+            base_delay_seconds=RETRY_BASE_DELAY_SECONDS,
+            max_delay_seconds=RETRY_MAX_DELAY_SECONDS
+        )
+    
+    def process_retry_queue(self, limit: Optional[int] = None) -> Dict:
+        """
+        Phân loại lại các mã bị rate limit đã đến hạn thử lại
+        
+        Dừng ngay khi vẫn bị rate limit (budget chưa hồi phục); các mã còn lại
+        giữ nguyên lịch hẹn cho lần chạy sau.
+        
+        Args:
+            limit: Số mã tối đa xử lý trong một lần
+        
+        Returns:
+            Dict: retried, succeeded, requeued, dropped
+        """
+        due = self.db.get_due_retries(task=RETRY_TASK, limit=limit)
+        stats = {'retried': 0, 'succeeded': 0, 'requeued': 0, 'dropped': 0}
+        
+        if due:
+            logger.info(f"🔁 Retrying {len(due)} rate-limited stocks...")
+        
+        for item in due:
+            symbol = item['symbol']
+            
+            if item['attempts'] >= RETRY_MAX_ATTEMPTS:
+                logger.warning(f"Giving up on {symbol} after {item['attempts']} rate-limited attempts")
+                self.db.remove_retry(symbol, task=RETRY_TASK)
+                stats['dropped'] += 1
+                continue
+            
+            stats['retried'] += 1
+            result = self.classify_stock(symbol, use_cache=False, save_cache=True)
+            
+            if result.get('rate_limited'):
+                # Đã được đưa lại vào queue với backoff dài hơn
+                stats['requeued'] += 1
+                logger.warning(f"Still rate limited at {symbol}, stopping retry drain")
+                break
+            
+            if result.get('error'):
+                # Lỗi khác rate limit - không thử lại tự động
+                self.db.remove_retry(symbol, task=RETRY_TASK)
+                stats['dropped'] += 1
+            else:
+                stats['succeeded'] += 1
+        
+        return stats
+    
     def _calculate_overall_rating(self, classifications: Dict) -> Dict:
         """Tính điểm tổng thể"""
         growth_score = classifications['growth']['score']
@@ -431,44 +552,114 @@ class StockClassifier:
             }
         }
     
+    def iter_classify_market(self,
+                             stocks: List[str],
+                             delay: float = 0.0,
+                             use_cache: bool = True,
+                             max_workers: int = DEFAULT_MAX_WORKERS,
+                             timeout: Optional[float] = DEFAULT_SYMBOL_TIMEOUT) -> Iterator[Dict]:
+        """
+        Phân loại danh sách mã, trả kết quả từng mã ngay khi xong
+
+        Args:
+            stocks: Danh sách mã
+            (các tham số khác như scan_and_classify_market)
+
+        Yields:
+            Dict gồm index, symbol, status ('classified', 'rate_limited',
+            'error'), result (kết quả classify_stock), error, elapsed (giây)
+        """
+        writer = self.classification_writer()
+
+        def classify(symbol: str) -> Dict:
+            classification = self.classify_stock(symbol, use_cache=use_cache, writer=writer)
+            # Nghỉ thêm nếu được yêu cầu (rate limit do rate_limiter đảm nhận)
+            if delay:
+                time.sleep(delay)
+            return classification
+
+        total = len(stocks)
+
+        try:
+            for completed, outcome in enumerate(iter_scan(stocks, classify, max_workers=max_workers,
+                                                          timeout=timeout), 1):
+                symbol = outcome['symbol']
+                classification = outcome['result']
+                logger.info(f"[{completed}/{total}] {symbol} done in {outcome['elapsed']}s")
+
+                if outcome['error']:
+                    status, error = 'error', outcome['error']
+                    logger.error(f"  ❌ {symbol}: {outcome['error'][:50]}")
+                elif 'error' not in classification or classification['error'] is None:
+                    status, error = 'classified', None
+                    logger.info(f"  ✅ {symbol}: {classification['overall_rating']['rating']}")
+                elif classification.get('rate_limited'):
+                    status, error = 'rate_limited', classification['error']
+                    logger.warning(f"  ⏳ {symbol}: Rate limited, queued for retry")
+                else:
+                    status, error = 'error', classification['error']
+                    logger.warning(f"  ❌ {symbol}: Has error field")
+
+                yield {
+                    'index': outcome['index'],
+                    'symbol': symbol,
+                    'status': status,
+                    'result': classification,
+                    'error': error,
+                    'elapsed': outcome['elapsed']
+                }
+        finally:
+            writer.close()  # Ghi nốt lô cuối (kể cả khi caller dừng giữa chừng)
+
     def scan_and_classify_market(self, 
                                  exchanges: List[str] = ['HOSE'],
                                  limit: Optional[int] = None,
-                                 delay: float = 3.0) -> pd.DataFrame:
-        """Quét và phân loại toàn bộ thị trường"""
+                                 delay: float = 0.0,
+                                 use_cache: bool = True,
+                                 max_workers: int = DEFAULT_MAX_WORKERS,
+                                 timeout: Optional[float] = DEFAULT_SYMBOL_TIMEOUT,
+                                 progress_callback: Optional[Callable] = None) -> pd.DataFrame:
+        """
+        Quét và phân loại toàn bộ thị trường
+        
+        Args:
+            exchanges: Danh sách sàn
+            limit: Số mã tối đa
+            delay: Thời gian nghỉ thêm sau mỗi mã (giây). Mặc định 0 - request
+                   lên vnstock đã được rate_limiter điều phối, mã có cache không phải chờ
+            use_cache: Dùng kết quả phân loại trong cache (< 24h) nếu có
+            max_workers: Số mã xử lý song song
+            timeout: Thời gian tối đa cho một mã (giây)
+            progress_callback: Gọi sau mỗi mã hoàn thành: (completed, total, outcome)
+        """
         stocks = self.get_all_stocks(exchanges=exchanges)
         
         if limit:
             stocks = stocks[:limit]
         
-        results = []
+        classified = []
         errors = []
-        
-        logger.info(f"Scanning {len(stocks)} stocks from {exchanges}")
-        
-        for i, symbol in enumerate(stocks, 1):
-            logger.info(f"[{i}/{len(stocks)}] Processing {symbol}...")
-            
-            try:
-                classification = self.classify_stock(symbol)
-                
-                if 'error' not in classification or classification['error'] is None:
-                    results.append(classification)
-                    rating = classification['overall_rating']['rating']
-                    logger.info(f"  ✅ {symbol}: {rating}")
-                else:
-                    errors.append(symbol)
-                    logger.warning(f"  ❌ {symbol}: Has error field")
-                
-            except Exception as e:
-                errors.append(symbol)
-                logger.error(f"  ❌ {symbol}: {str(e)[:50]}")
+        rate_limited = []
+        
+        logger.info(f"Scanning {len(stocks)} stocks from {exchanges} ({max_workers} workers)")
+        
+        for completed, outcome in enumerate(self.iter_classify_market(stocks, delay, use_cache,
+                                                                      max_workers, timeout), 1):
+            if outcome['status'] == 'classified':
+                classified.append((outcome['index'], outcome['result']))
+            elif outcome['status'] == 'rate_limited':
+                rate_limited.append(outcome['symbol'])
+            else:
+                errors.append(outcome['symbol'])
             
-            # Rate limit protection
-            if i < len(stocks):
-                time.sleep(delay)
+            if progress_callback:
+                progress_callback(completed, len(stocks), outcome)
         
-        logger.info(f"Scan complete: {len(results)} classified, {len(errors)} errors")
+        # Giữ đúng thứ tự danh sách mã
+        results = [classification for _, classification in sorted(classified, key=lambda item: item[0])]
+        
+        logger.info(f"Scan complete: {len(results)} classified, {len(errors)} errors, "
+                    f"{len(rate_limited)} queued for retry")
         
         if errors:
             logger.warning(f"Failed symbols: {', '.join(errors[:10])}" + ("..." if len(errors) > 10 else ""))
@@ -478,39 +669,43 @@ class StockClassifier:
         
         return df
     
+    def result_to_row(self, r: Dict) -> Optional[Dict]:
+        """Chuyển một kết quả phân loại thành một dòng phẳng (None nếu lỗi)"""
+        if 'error' in r and r['error']:
+            return None
+        
+        try:
+            return {
+                'symbol': r['symbol'],
+                'growth_category': r['classifications']['growth']['category'],
+                'growth_score': r['classifications']['growth']['score'],
+                'growth_desc': r['classifications']['growth']['description'],
+                'risk_category': r['classifications']['risk']['category'],
+                'risk_score': r['classifications']['risk']['risk_score'],
+                'risk_desc': r['classifications']['risk']['description'],
+                'volatility': r['classifications']['risk']['volatility'],
+                'market_cap_category': r['classifications']['market_cap']['category'],
+                'market_cap_trillion': r['classifications']['market_cap']['market_cap_trillion'],
+                'momentum_category': r['classifications']['momentum']['category'],
+                'momentum_score': r['classifications']['momentum']['momentum_score'],
+                'momentum_desc': r['classifications']['momentum']['description'],
+                'overall_rating': r['overall_rating']['rating'],
+                'overall_score': r['overall_rating']['score'],
+                'recommendation': r['overall_rating']['recommendation'],
+                'timestamp': r['timestamp']
+            }
+        except Exception as e:
+            logger.error(f"Error converting result to dataframe: {e}")
+            return None
+    
     def _results_to_dataframe(self, results: List[Dict]) -> pd.DataFrame:
         """Convert results to DataFrame"""
         data = []
         
         for r in results:
-            if 'error' in r and r['error']:
-                continue
-            
-            try:
-                row = {
-                    'symbol': r['symbol'],
-                    'growth_category': r['classifications']['growth']['category'],
-                    'growth_score': r['classifications']['growth']['score'],
-                    'growth_desc': r['classifications']['growth']['description'],
-                    'risk_category': r['classifications']['risk']['category'],
-                    'risk_score': r['classifications']['risk']['risk_score'],
-                    'risk_desc': r['classifications']['risk']['description'],
-                    'volatility': r['classifications']['risk']['volatility'],
-                    'market_cap_category': r['classifications']['market_cap']['category'],
-                    'market_cap_trillion': r['classifications']['market_cap']['market_cap_trillion'],
-                    'momentum_category': r['classifications']['momentum']['category'],
-                    'momentum_score': r['classifications']['momentum']['momentum_score'],
-                    'momentum_desc': r['classifications']['momentum']['description'],
-                    'overall_rating': r['overall_rating']['rating'],
-                    'overall_score': r['overall_rating']['score'],
-                    'recommendation': r['overall_rating']['recommendation'],
-                    'timestamp': r['timestamp']
-                }
-                
+            row = self.result_to_row(r)
+            if row is not None:
                 data.append(row)
-            except Exception as e:
-                logger.error(f"Error converting result to dataframe: {e}")
-                continue
         
         return pd.DataFrame(data)
     
@@ -542,7 +737,7 @@ class StockClassifier:
 def scan_market(exchanges: List[str] = ['HOSE'], limit: int = 50):
     """Quick scan market"""
     classifier = StockClassifier()
-    df = classifier.scan_and_classify_market(exchanges=exchanges, limit=limit, delay=3.0)
+    df = classifier.scan_and_classify_market(exchanges=exchanges, limit=limit)
     
     if df.empty:
         print("\n⚠️ No stocks classified successfully")
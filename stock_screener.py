@@ -5,12 +5,13 @@ Sàng lọc cổ phiếu theo các tiêu chí FA và TA
 
 import pandas as pd
 from datetime import datetime
-from typing import Dict, List, Any, Optional
+from typing import Callable, Dict, Iterator, List, Any, Optional
 import logging
 import time
 
 from fa_calculator import calculate_fa_ratios
 from ta_analyzer import calculate_ta_indicators
+from scan_engine import DEFAULT_MAX_WORKERS, DEFAULT_SYMBOL_TIMEOUT, iter_scan
 
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
@@ -29,10 +30,12 @@ def get_stock_list(exchange: str = "HOSE") -> List[str]:
     """
     try:
         from vnstock import Listing
+        from rate_limiter import get_rate_limiter
         
         logger.info(f"Lấy danh sách cổ phiếu sàn {exchange}...")
         
         # Lấy danh sách cổ phiếu
+        get_rate_limiter().acquire()
         listing = Listing()
         stock_list = listing.all_symbols()
         
@@ -51,20 +54,185 @@ def get_stock_list(exchange: str = "HOSE") -> List[str]:
         return []
 
 
+def evaluate_price_criterion(symbol: str, price_vs_ma50: str = "above") -> Dict[str, Any]:
+    """
+    Tiêu chí rẻ: giá hiện tại so với MA50, tính từ price store cục bộ
+    (tối đa một request lịch sử giá khi dữ liệu chưa có / đã cũ)
+    
+    Returns:
+        Dictionary gồm ta_data, check (kết quả tiêu chí), passed, error
+    """
+    # Chỉ cần giá hiện tại, MA50 (và RSI để hiển thị), không cần DataFrame
+    ta_result = calculate_ta_indicators(symbol, period_days=90, indicators=['MA50', 'RSI'],
+                                        latest_only=True)  # 90 ngày để nhanh hơn
+    
+    if ta_result.get("error"):
+        return {"ta_data": {}, "check": None, "passed": False, "error": f"TA Error: {ta_result['error']}"}
+    
+    # Lấy giá hiện tại và MA50
+    current_price = ta_result.get("current_price")
+    ma50 = ta_result.get("indicators", {}).get("MA50", {}).get("latest_value")
+    
+    ta_data = {
+        "current_price": current_price,
+        "MA50": ma50,
+        "MA200": ta_result.get("indicators", {}).get("MA200", {}).get("latest_value"),
+        "RSI": ta_result.get("indicators", {}).get("RSI", {}).get("latest_value")
+    }
+    
+    passed = False
+    if current_price is not None and ma50 is not None:
+        price_above_ma50 = current_price > ma50
+        passed = (price_vs_ma50 == "above" and price_above_ma50) or (price_vs_ma50 == "below" and not price_above_ma50)
+    
+    check = {
+        "current_price": current_price,
+        "MA50": ma50,
+        "passed": passed,
+        "criteria": f"Price {price_vs_ma50} MA50"
+    }
+    
+    return {"ta_data": ta_data, "check": check, "passed": passed, "error": None}
+
+
+def evaluate_fundamental_criteria(symbol: str, pe_max: float = 15, roe_min: float = 18) -> Dict[str, Any]:
+    """
+    Tiêu chí đắt: P/E và ROE (cần báo cáo tài chính từ vnstock)
+    
+    Returns:
+        Dictionary gồm fa_data, checks (PE, ROE), error
+    """
+    fa_result = calculate_fa_ratios(symbol)
+    
+    if fa_result.get("error"):
+        return {"fa_data": {}, "checks": {}, "error": f"FA Error: {fa_result['error']}"}
+    
+    # Lấy các chỉ số FA
+    ratios = fa_result.get("ratios", {})
+    pe_ratio = ratios.get("PE")
+    roe = ratios.get("ROE")
+    
+    fa_data = {
+        "PE": pe_ratio,
+        "ROE": roe,
+        "EPS": ratios.get("EPS"),
+        "NPM": ratios.get("NPM"),
+        "DE": ratios.get("DE")
+    }
+    
+    checks = {
+        # Tiêu chí 1: P/E < pe_max
+        "PE": {"value": pe_ratio, "passed": pe_ratio is not None and pe_ratio < pe_max,
+               "criteria": f"< {pe_max}"},
+        # Tiêu chí 2: ROE > roe_min
+        "ROE": {"value": roe, "passed": roe is not None and roe > roe_min,
+                "criteria": f"> {roe_min}%"}
+    }
+    
+    return {"fa_data": fa_data, "checks": checks, "error": None}
+
+
+def _build_screen_result(symbol: str, pe_max: float, roe_min: float, price_vs_ma50: str,
+                         price_eval: Dict[str, Any],
+                         fa_eval: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Ghép kết quả các tiêu chí thành kết quả sàng lọc của một mã
+    
+    fa_eval = None: mã đã bị loại ở tiêu chí giá nên không lấy dữ liệu FA
+    """
+    result = {
+        "symbol": symbol,
+        "timestamp": datetime.now().isoformat(),
+        "passed": False,
+        "fa_data": {},
+        "ta_data": price_eval["ta_data"],
+        "criteria_check": {},
+        "error": None
+    }
+    
+    if price_eval["error"]:
+        result["error"] = price_eval["error"]
+        return result
+    if fa_eval is not None and fa_eval["error"]:
+        result["error"] = fa_eval["error"]
+        return result
+    
+    criteria_passed = []
+    criteria_failed = []
+    
+    if fa_eval is not None:
+        result["fa_data"] = fa_eval["fa_data"]
+        pe_check = fa_eval["checks"]["PE"]
+        roe_check = fa_eval["checks"]["ROE"]
+        
+        if pe_check["value"] is None:
+            criteria_failed.append("PE data missing")
+        elif pe_check["passed"]:
+            criteria_passed.append(f"PE < {pe_max}")
+        else:
+            criteria_failed.append(f"PE >= {pe_max}")
+        
+        if roe_check["value"] is None:
+            criteria_failed.append("ROE data missing")
+        elif roe_check["passed"]:
+            criteria_passed.append(f"ROE > {roe_min}%")
+        else:
+            criteria_failed.append(f"ROE <= {roe_min}%")
+        
+        result["criteria_check"]["PE"] = pe_check
+        result["criteria_check"]["ROE"] = roe_check
+    else:
+        # Bỏ qua FA: mã đã trượt tiêu chí giá
+        result["criteria_check"]["PE"] = {"value": None, "passed": False, "criteria": f"< {pe_max}", "skipped": True}
+        result["criteria_check"]["ROE"] = {"value": None, "passed": False, "criteria": f"> {roe_min}%", "skipped": True}
+    
+    # Tiêu chí 3: Giá so với MA50
+    price_check = price_eval["check"]
+    if price_check["current_price"] is None or price_check["MA50"] is None:
+        criteria_failed.append("Price or MA50 data missing")
+    elif price_check["passed"]:
+        criteria_passed.append(f"Price {price_vs_ma50} MA50")
+    else:
+        criteria_failed.append(f"Price not {price_vs_ma50} MA50")
+    result["criteria_check"]["Price_vs_MA50"] = price_check
+    
+    # Kiểm tra tất cả tiêu chí
+    all_criteria_passed = len(criteria_passed) == 3 and len(criteria_failed) == 0
+    
+    result["passed"] = all_criteria_passed
+    result["criteria_passed"] = criteria_passed
+    result["criteria_failed"] = criteria_failed
+    result["summary"] = f"{len(criteria_passed)}/3 criteria passed"
+    if fa_eval is None:
+        result["summary"] += " (FA skipped)"
+    
+    if all_criteria_passed:
+        logger.info(f"✅ {symbol} - PASSED all criteria")
+    else:
+        logger.info(f"❌ {symbol} - FAILED: {', '.join(criteria_failed)}")
+    
+    return result
+
+
 def screen_stock(
     symbol: str,
     pe_max: float = 15,
     roe_min: float = 18,
-    price_vs_ma50: str = "above"
+    price_vs_ma50: str = "above",
+    prefilter: bool = False
 ) -> Dict[str, Any]:
     """
     Sàng lọc một mã cổ phiếu theo các tiêu chí FA và TA
     
+    Tiêu chí rẻ (giá vs MA50, dữ liệu cục bộ) được kiểm tra trước tiêu chí
+    đắt (P/E, ROE cần báo cáo tài chính).
+    
     Args:
         symbol: Mã cổ phiếu
         pe_max: P/E tối đa (mặc định 15)
         roe_min: ROE tối thiểu % (mặc định 18)
         price_vs_ma50: Giá so với MA50 ("above" hoặc "below")
+        prefilter: True = không lấy dữ liệu FA nếu mã đã trượt tiêu chí giá
     
     Returns:
         Dictionary chứa thông tin sàng lọc
@@ -72,125 +240,17 @@ def screen_stock(
     try:
         logger.info(f"Sàng lọc mã {symbol}...")
         
-        result = {
-            "symbol": symbol,
-            "timestamp": datetime.now().isoformat(),
-            "passed": False,
-            "fa_data": {},
-            "ta_data": {},
-            "criteria_check": {},
-            "error": None
-        }
-        
-        # 1. Lấy dữ liệu FA
-        logger.debug(f"Lấy FA data cho {symbol}")
-        fa_result = calculate_fa_ratios(symbol)
-        
-        if fa_result.get("error"):
-            result["error"] = f"FA Error: {fa_result['error']}"
-            return result
-        
-        # Lấy các chỉ số FA
-        pe_ratio = fa_result.get("ratios", {}).get("PE")
-        roe = fa_result.get("ratios", {}).get("ROE")
-        
-        result["fa_data"] = {
-            "PE": pe_ratio,
-            "ROE": roe,
-            "EPS": fa_result.get("ratios", {}).get("EPS"),
-            "NPM": fa_result.get("ratios", {}).get("NPM"),
-            "DE": fa_result.get("ratios", {}).get("DE")
-        }
-        
-        # 2. Lấy dữ liệu TA
+        # 1. Tiêu chí giá (rẻ)
         logger.debug(f"Lấy TA data cho {symbol}")
-        ta_result = calculate_ta_indicators(symbol, period_days=90)  # 90 ngày để nhanh hơn
-        
-        if ta_result.get("error"):
-            result["error"] = f"TA Error: {ta_result['error']}"
-            return result
-        
-        # Lấy giá hiện tại và MA50
-        current_price = ta_result.get("current_price")
-        ma50 = ta_result.get("indicators", {}).get("MA50", {}).get("latest_value")
-        
-        result["ta_data"] = {
-            "current_price": current_price,
-            "MA50": ma50,
-            "MA200": ta_result.get("indicators", {}).get("MA200", {}).get("latest_value"),
-            "RSI": ta_result.get("indicators", {}).get("RSI", {}).get("latest_value")
-        }
-        
-        # 3. Kiểm tra các tiêu chí
-        criteria_passed = []
-        criteria_failed = []
-        
-        # Tiêu chí 1: P/E < pe_max
-        if pe_ratio is not None:
-            if pe_ratio < pe_max:
-                criteria_passed.append(f"PE < {pe_max}")
-                result["criteria_check"]["PE"] = {"value": pe_ratio, "passed": True, "criteria": f"< {pe_max}"}
-            else:
-                criteria_failed.append(f"PE >= {pe_max}")
-                result["criteria_check"]["PE"] = {"value": pe_ratio, "passed": False, "criteria": f"< {pe_max}"}
-        else:
-            criteria_failed.append("PE data missing")
-            result["criteria_check"]["PE"] = {"value": None, "passed": False, "criteria": f"< {pe_max}"}
-        
-        # Tiêu chí 2: ROE > roe_min
-        if roe is not None:
-            if roe > roe_min:
-                criteria_passed.append(f"ROE > {roe_min}%")
-                result["criteria_check"]["ROE"] = {"value": roe, "passed": True, "criteria": f"> {roe_min}%"}
-            else:
-                criteria_failed.append(f"ROE <= {roe_min}%")
-                result["criteria_check"]["ROE"] = {"value": roe, "passed": False, "criteria": f"> {roe_min}%"}
-        else:
-            criteria_failed.append("ROE data missing")
-            result["criteria_check"]["ROE"] = {"value": None, "passed": False, "criteria": f"> {roe_min}%"}
-        
-        # Tiêu chí 3: Giá > MA50
-        if current_price is not None and ma50 is not None:
-            price_above_ma50 = current_price > ma50
-            if (price_vs_ma50 == "above" and price_above_ma50) or (price_vs_ma50 == "below" and not price_above_ma50):
-                criteria_passed.append(f"Price {price_vs_ma50} MA50")
-                result["criteria_check"]["Price_vs_MA50"] = {
-                    "current_price": current_price,
-                    "MA50": ma50,
-                    "passed": True,
-                    "criteria": f"Price {price_vs_ma50} MA50"
-                }
-            else:
-                criteria_failed.append(f"Price not {price_vs_ma50} MA50")
-                result["criteria_check"]["Price_vs_MA50"] = {
-                    "current_price": current_price,
-                    "MA50": ma50,
-                    "passed": False,
-                    "criteria": f"Price {price_vs_ma50} MA50"
-                }
-        else:
-            criteria_failed.append("Price or MA50 data missing")
-            result["criteria_check"]["Price_vs_MA50"] = {
-                "current_price": current_price,
-                "MA50": ma50,
-                "passed": False,
-                "criteria": f"Price {price_vs_ma50} MA50"
-            }
+        price_eval = evaluate_price_criterion(symbol, price_vs_ma50)
         
-        # Kiểm tra tất cả tiêu chí
-        all_criteria_passed = len(criteria_passed) == 3 and len(criteria_failed) == 0
+        # 2. Tiêu chí FA (đắt)
+        fa_eval = None
+        if not price_eval["error"] and (price_eval["passed"] or not prefilter):
+            logger.debug(f"Lấy FA data cho {symbol}")
+            fa_eval = evaluate_fundamental_criteria(symbol, pe_max, roe_min)
         
-        result["passed"] = all_criteria_passed
-        result["criteria_passed"] = criteria_passed
-        result["criteria_failed"] = criteria_failed
-        result["summary"] = f"{len(criteria_passed)}/3 criteria passed"
-        
-        if all_criteria_passed:
-            logger.info(f"✅ {symbol} - PASSED all criteria")
-        else:
-            logger.info(f"❌ {symbol} - FAILED: {', '.join(criteria_failed)}")
-        
-        return result
+        return _build_screen_result(symbol, pe_max, roe_min, price_vs_ma50, price_eval, fa_eval)
         
     except Exception as e:
         logger.error(f"Lỗi khi sàng lọc {symbol}: {str(e)}")
@@ -202,24 +262,130 @@ def screen_stock(
         }
 
 
+def iter_screener(
+    symbols: List[str],
+    pe_max: float = 15,
+    roe_min: float = 18,
+    price_vs_ma50: str = "above",
+    delay: float = 0.0,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    timeout: Optional[float] = DEFAULT_SYMBOL_TIMEOUT,
+    prefilter: bool = True,
+    stats: Optional[Dict[str, int]] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    Sàng lọc hai pha, trả kết quả cuối của từng mã ngay khi có
+
+    Mã bị loại ở pha 1 (giá vs MA50) được trả ngay trong pha 1, các mã còn lại
+    được trả khi pha 2 (FA) của mã đó xong. Thứ tự là thứ tự hoàn thành.
+
+    Args:
+        symbols: Danh sách mã cần sàng lọc
+        stats: Dict (tùy chọn) nhận số liệu pha: fa_fetched, fa_skipped
+        (các tham số khác như run_screener)
+
+    Yields:
+        Outcome của scan_engine (symbol, error, timed_out, elapsed) với
+        result là kết quả sàng lọc cuối của mã
+    """
+    def scan_error(outcome: Dict) -> Dict[str, Any]:
+        return {
+            "symbol": outcome['symbol'],
+            "timestamp": datetime.now().isoformat(),
+            "passed": False,
+            "error": outcome['error']
+        }
+
+    # Pha 1: tiêu chí giá từ dữ liệu cục bộ (song song, không tốn request FA)
+    price_evals: Dict[str, Dict[str, Any]] = {}
+
+    for outcome in iter_scan(symbols, lambda symbol: evaluate_price_criterion(symbol, price_vs_ma50),
+                             max_workers=max_workers, timeout=timeout):
+        if outcome['error']:
+            yield {**outcome, 'result': scan_error(outcome)}
+            continue
+        price_eval = outcome['result']
+        if price_eval['error'] or (prefilter and not price_eval['passed']):
+            yield {**outcome, 'result': _build_screen_result(outcome['symbol'], pe_max, roe_min,
+                                                             price_vs_ma50, price_eval, None)}
+            continue
+        price_evals[outcome['symbol']] = price_eval
+
+    survivors = [symbol for symbol in symbols if symbol in price_evals]
+    logger.info(f"Pha 1 (giá {price_vs_ma50} MA50): {len(survivors)}/{len(symbols)} mã cần lấy FA")
+    if stats is not None:
+        stats['fa_fetched'] = len(survivors)
+        stats['fa_skipped'] = len(symbols) - len(survivors)
+
+    # Pha 2: tiêu chí FA chỉ cho các mã còn lại
+    def screen_fundamentals(symbol: str) -> Dict[str, Any]:
+        fa_eval = evaluate_fundamental_criteria(symbol, pe_max, roe_min)
+        # Nghỉ thêm nếu được yêu cầu (rate limit do rate_limiter đảm nhận)
+        if delay:
+            time.sleep(delay)
+        return fa_eval
+
+    for outcome in iter_scan(survivors, screen_fundamentals, max_workers=max_workers, timeout=timeout):
+        if outcome['error']:
+            yield {**outcome, 'result': scan_error(outcome)}
+            continue
+        yield {**outcome, 'result': _build_screen_result(outcome['symbol'], pe_max, roe_min, price_vs_ma50,
+                                                         price_evals[outcome['symbol']], outcome['result'])}
+
+
+def build_screener_info(exchange: str, total: int, total_passed: int, pe_max: float, roe_min: float,
+                        price_vs_ma50: str, prefilter: bool, stats: Dict[str, int]) -> Dict[str, Any]:
+    """Thông tin tổng hợp của một lượt sàng lọc (screener_info)"""
+    return {
+        "exchange": exchange,
+        "total_screened": total,
+        "total_passed": total_passed,
+        "pass_rate": round((total_passed / total * 100), 2) if total else 0,
+        "criteria": {
+            "pe_max": pe_max,
+            "roe_min": roe_min,
+            "price_vs_ma50": price_vs_ma50
+        },
+        "prefilter": {
+            "enabled": prefilter,
+            "criterion": f"Price {price_vs_ma50} MA50",
+            "fa_fetched": stats.get('fa_fetched', 0),
+            "fa_skipped": stats.get('fa_skipped', 0)
+        }
+    }
+
+
 def run_screener(
     exchange: str = "HOSE",
     limit: int = 20,
     pe_max: float = 15,
     roe_min: float = 18,
     price_vs_ma50: str = "above",
-    delay: float = 1.0
+    delay: float = 0.0,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    timeout: Optional[float] = DEFAULT_SYMBOL_TIMEOUT,
+    progress_callback: Optional[Callable] = None,
+    prefilter: bool = True
 ) -> Dict[str, Any]:
     """
     Chạy stock screener cho nhiều mã cổ phiếu
     
+    Sàng lọc hai pha: pha 1 kiểm tra tiêu chí giá vs MA50 từ price store cục
+    bộ cho mọi mã, pha 2 chỉ lấy dữ liệu FA (3 request vnstock/mã) cho các mã
+    còn lại.
+    
     Args:
         exchange: Sàn giao dịch (HOSE, HNX, UPCOM)
         limit: Số lượng mã cần test (mặc định 20)
         pe_max: P/E tối đa (mặc định 15)
         roe_min: ROE tối thiểu % (mặc định 18)
         price_vs_ma50: Giá so với MA50 ("above" hoặc "below")
-        delay: Thời gian delay giữa các request (giây)
+        delay: Thời gian nghỉ thêm sau mỗi mã ở pha FA (giây). Mặc định 0 -
+               số request lên vnstock đã được rate_limiter điều phối
+        max_workers: Số mã sàng lọc song song
+        timeout: Thời gian tối đa cho một mã (giây)
+        progress_callback: Gọi sau mỗi mã có kết quả cuối: (completed, total, outcome)
+        prefilter: False = lấy FA cho mọi mã (kết quả đầy đủ cả mã trượt tiêu chí giá)
     
     Returns:
         Dictionary chứa kết quả sàng lọc
@@ -240,45 +406,35 @@ def run_screener(
         
         # Giới hạn số lượng để test
         test_symbols = stock_list[:limit]
-        logger.info(f"Sàng lọc {len(test_symbols)} mã cổ phiếu...")
+        total = len(test_symbols)
+        logger.info(f"Sàng lọc {total} mã cổ phiếu...")
         
-        # Sàng lọc từng mã
-        results = []
-        passed_stocks = []
+        results: Dict[str, Dict[str, Any]] = {}
+        stats: Dict[str, int] = {}
         
-        for idx, symbol in enumerate(test_symbols, 1):
-            logger.info(f"[{idx}/{len(test_symbols)}] Sàng lọc {symbol}...")
-            
-            result = screen_stock(symbol, pe_max, roe_min, price_vs_ma50)
-            results.append(result)
-            
-            if result.get("passed"):
-                passed_stocks.append(result)
-            
-            # Delay để tránh quá tải API
-            if idx < len(test_symbols):
-                time.sleep(delay)
+        for completed, outcome in enumerate(iter_screener(test_symbols, pe_max, roe_min, price_vs_ma50,
+                                                          delay, max_workers, timeout, prefilter, stats), 1):
+            results[outcome['symbol']] = outcome['result']
+            logger.info(f"[{completed}/{total}] Đã sàng lọc {outcome['symbol']}")
+            if progress_callback:
+                progress_callback(completed, total, outcome)
+        
+        # Kết quả giữ đúng thứ tự danh sách
+        ordered_results = [results[symbol] for symbol in test_symbols]
+        passed_stocks = [result for result in ordered_results if result.get("passed")]
         
         # Tổng hợp kết quả
         summary = {
             "success": True,
-            "screener_info": {
-                "exchange": exchange,
-                "total_screened": len(test_symbols),
-                "total_passed": len(passed_stocks),
-                "pass_rate": round((len(passed_stocks) / len(test_symbols) * 100), 2) if test_symbols else 0,
-                "criteria": {
-                    "pe_max": pe_max,
-                    "roe_min": roe_min,
-                    "price_vs_ma50": price_vs_ma50
-                }
-            },
+            "screener_info": build_screener_info(exchange, total, len(passed_stocks), pe_max, roe_min,
+                                                 price_vs_ma50, prefilter, stats),
             "passed_stocks": passed_stocks,
-            "all_results": results,
+            "all_results": ordered_results,
             "timestamp": datetime.now().isoformat()
         }
         
-        logger.info(f"Hoàn thành sàng lọc: {len(passed_stocks)}/{len(test_symbols)} mã đạt tiêu chí")
+        logger.info(f"Hoàn thành sàng lọc: {len(passed_stocks)}/{total} mã đạt tiêu chí "
+                    f"(bỏ qua FA cho {stats.get('fa_skipped', 0)} mã)")
         
         return summary
         
@@ -384,7 +540,7 @@ if __name__ == "__main__":
     PE_MAX = 15        # P/E < 15
     ROE_MIN = 18       # ROE > 18%
     PRICE_VS_MA50 = "above"  # Giá > MA50
-    DELAY = 1.0        # Delay 1 giây giữa các request
+    DELAY = 0.0        # Không cần delay - rate_limiter điều phối request
     
     print(f"📋 Cấu hình:")
     print(f"   - Sàn: {EXCHANGE}")
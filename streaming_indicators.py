@@ -0,0 +1,462 @@
+"""
+Streaming Indicators - VNStock Incremental TA
+Chỉ báo kỹ thuật cập nhật O(1) cho mỗi phiên mới: EMA, RSI (Wilder/SMA),
+MACD, rolling mean/std (MA, Bollinger) và OBV.
+
+Trạng thái của từng (mã, chỉ báo, tham số) được lưu trong bảng indicator_state
+nên scanner chỉ cần nạp các phiên mới từ price store thay vì tính lại cả năm.
+Giá tính theo VND (close * 1000) giống calculate_ta_indicators.
+"""
+
+import json
+import math
+from collections import deque
+from datetime import datetime
+from typing import Dict, List, Optional
+import logging
+
+from data_store import last_settled_date
+from database import get_db
+
+logger = logging.getLogger(__name__)
+
+# Số phiên dùng để khởi tạo trạng thái lần đầu (đủ cho MA200)
+WARMUP_DAYS = 400
+
+
+class EMAState:
+    """EMA (adjust=False như pandas ewm): ema = alpha * x + (1 - alpha) * ema"""
+
+    kind = 'ema'
+
+    def __init__(self, period: int):
+        self.period = period
+        self.alpha = 2 / (period + 1)
+        self.value: Optional[float] = None
+
+    def update(self, x: float) -> float:
+        self.value = x if self.value is None else self.alpha * x + (1 - self.alpha) * self.value
+        return self.value
+
+    @property
+    def params(self) -> Dict:
+        return {'period': self.period}
+
+    def to_dict(self) -> Dict:
+        return {'value': self.value}
+
+    @classmethod
+    def from_dict(cls, params: Dict, state: Dict) -> 'EMAState':
+        obj = cls(**params)
+        obj.value = state['value']
+        return obj
+
+
+class RollingState:
+    """Rolling mean/std trên cửa sổ cố định (std mẫu, ddof=1 như pandas)"""
+
+    kind = 'rolling'
+
+    def __init__(self, window: int):
+        self.window = window
+        self.values = deque(maxlen=window)
+        self.total = 0.0
+        self.total_sq = 0.0
+
+    def update(self, x: float) -> Optional[float]:
+        if len(self.values) == self.window:
+            dropped = self.values[0]
+            self.total -= dropped
+            self.total_sq -= dropped * dropped
+        self.values.append(x)
+        self.total += x
+        self.total_sq += x * x
+        return self.mean
+
+    @property
+    def value(self) -> Optional[float]:
+        return self.mean
+
+    @property
+    def mean(self) -> Optional[float]:
+        if len(self.values) < self.window:
+            return None
+        return self.total / self.window
+
+    @property
+    def std(self) -> Optional[float]:
+        if len(self.values) < self.window or self.window < 2:
+            return None
+        variance = (self.total_sq - self.total * self.total / self.window) / (self.window - 1)
+        return math.sqrt(max(variance, 0.0))
+
+    @property
+    def params(self) -> Dict:
+        return {'window': self.window}
+
+    def to_dict(self) -> Dict:
+        return {'values': list(self.values)}
+
+    @classmethod
+    def from_dict(cls, params: Dict, state: Dict) -> 'RollingState':
+        obj = cls(**params)
+        for x in state['values']:
+            obj.update(x)
+        return obj
+
+
+class RSIState:
+    """
+    RSI cập nhật theo phiên
+
+    smoothing='wilder': trung bình Wilder (SMA cho `period` phiên đầu, sau đó
+    avg = (avg * (period - 1) + x) / period)
+    smoothing='sma': trung bình trượt đơn giản như indicator_library.rsi
+    """
+
+    kind = 'rsi'
+
+    def __init__(self, period: int = 14, smoothing: str = 'wilder'):
+        if smoothing not in ('wilder', 'sma'):
+            raise ValueError("smoothing phải là 'wilder' hoặc 'sma'")
+        self.period = period
+        self.smoothing = smoothing
+        self.prev_close: Optional[float] = None
+        self.count = 0
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.gains = RollingState(period)
+        self.losses = RollingState(period)
+
+    def update(self, close: float) -> Optional[float]:
+        if self.prev_close is None:
+            self.prev_close = close
+            if self.smoothing == 'sma':
+                # pandas: diff() đầu tiên là NaN và được tính như gain/loss = 0
+                self.gains.update(0.0)
+                self.losses.update(0.0)
+            return None
+
+        delta = close - self.prev_close
+        self.prev_close = close
+        gain, loss = max(delta, 0.0), max(-delta, 0.0)
+
+        if self.smoothing == 'sma':
+            self.gains.update(gain)
+            self.losses.update(loss)
+            return self.value
+
+        self.count += 1
+        if self.count <= self.period:
+            # Giai đoạn khởi tạo: cộng dồn rồi lấy trung bình
+            self.avg_gain += (gain - self.avg_gain) / self.count
+            self.avg_loss += (loss - self.avg_loss) / self.count
+        else:
+            self.avg_gain = (self.avg_gain * (self.period - 1) + gain) / self.period
+            self.avg_loss = (self.avg_loss * (self.period - 1) + loss) / self.period
+        return self.value
+
+    @property
+    def value(self) -> Optional[float]:
+        if self.smoothing == 'sma':
+            avg_gain, avg_loss = self.gains.mean, self.losses.mean
+            if avg_gain is None:
+                return None
+        else:
+            if self.count < self.period:
+                return None
+            avg_gain, avg_loss = self.avg_gain, self.avg_loss
+
+        if avg_loss == 0:
+            return 100.0 if avg_gain > 0 else None
+        return 100 - 100 / (1 + avg_gain / avg_loss)
+
+    @property
+    def params(self) -> Dict:
+        return {'period': self.period, 'smoothing': self.smoothing}
+
+    def to_dict(self) -> Dict:
+        return {
+            'prev_close': self.prev_close,
+            'count': self.count,
+            'avg_gain': self.avg_gain,
+            'avg_loss': self.avg_loss,
+            'gains': self.gains.to_dict(),
+            'losses': self.losses.to_dict()
+        }
+
+    @classmethod
+    def from_dict(cls, params: Dict, state: Dict) -> 'RSIState':
+        obj = cls(**params)
+        obj.prev_close = state['prev_close']
+        obj.count = state['count']
+        obj.avg_gain = state['avg_gain']
+        obj.avg_loss = state['avg_loss']
+        obj.gains = RollingState.from_dict({'window': obj.period}, state['gains'])
+        obj.losses = RollingState.from_dict({'window': obj.period}, state['losses'])
+        return obj
+
+
+class MACDState:
+    """MACD = EMA(fast) - EMA(slow), Signal = EMA(signal) của MACD"""
+
+    kind = 'macd'
+
+    def __init__(self, fast: int = 12, slow: int = 26, signal: int = 9):
+        self.fast = EMAState(fast)
+        self.slow = EMAState(slow)
+        self.signal = EMAState(signal)
+
+    def update(self, close: float) -> float:
+        macd = self.fast.update(close) - self.slow.update(close)
+        self.signal.update(macd)
+        return macd
+
+    @property
+    def value(self) -> Optional[Dict]:
+        if self.signal.value is None:
+            return None
+        macd = self.fast.value - self.slow.value
+        return {'macd': macd, 'signal': self.signal.value, 'histogram': macd - self.signal.value}
+
+    @property
+    def params(self) -> Dict:
+        return {'fast': self.fast.period, 'slow': self.slow.period, 'signal': self.signal.period}
+
+    def to_dict(self) -> Dict:
+        return {'fast': self.fast.value, 'slow': self.slow.value, 'signal': self.signal.value}
+
+    @classmethod
+    def from_dict(cls, params: Dict, state: Dict) -> 'MACDState':
+        obj = cls(**params)
+        obj.fast.value = state['fast']
+        obj.slow.value = state['slow']
+        obj.signal.value = state['signal']
+        return obj
+
+
+class BollingerState:
+    """Bollinger Bands: MA(window) ± num_std * std(window)"""
+
+    kind = 'bollinger'
+
+    def __init__(self, window: int = 20, num_std: float = 2):
+        self.num_std = num_std
+        self.rolling = RollingState(window)
+
+    def update(self, close: float) -> Optional[Dict]:
+        self.rolling.update(close)
+        return self.value
+
+    @property
+    def value(self) -> Optional[Dict]:
+        middle, std = self.rolling.mean, self.rolling.std
+        if middle is None or std is None:
+            return None
+        return {'upper': middle + self.num_std * std, 'middle': middle,
+                'lower': middle - self.num_std * std}
+
+    @property
+    def params(self) -> Dict:
+        return {'window': self.rolling.window, 'num_std': self.num_std}
+
+    def to_dict(self) -> Dict:
+        return self.rolling.to_dict()
+
+    @classmethod
+    def from_dict(cls, params: Dict, state: Dict) -> 'BollingerState':
+        obj = cls(**params)
+        obj.rolling = RollingState.from_dict({'window': params['window']}, state)
+        return obj
+
+
+class OBVState:
+    """On-Balance Volume (phiên đầu = volume, như advanced_indicators.calculate_obv)"""
+
+    kind = 'obv'
+
+    def __init__(self):
+        self.prev_close: Optional[float] = None
+        self.value: Optional[float] = None
+
+    def update(self, close: float, volume: float) -> float:
+        if self.prev_close is None:
+            self.value = volume
+        elif close > self.prev_close:
+            self.value += volume
+        elif close < self.prev_close:
+            self.value -= volume
+        self.prev_close = close
+        return self.value
+
+    @property
+    def params(self) -> Dict:
+        return {}
+
+    def to_dict(self) -> Dict:
+        return {'prev_close': self.prev_close, 'value': self.value}
+
+    @classmethod
+    def from_dict(cls, params: Dict, state: Dict) -> 'OBVState':
+        obj = cls()
+        obj.prev_close = state['prev_close']
+        obj.value = state['value']
+        return obj
+
+
+STATE_CLASSES = {cls.kind: cls for cls in
+                 (EMAState, RollingState, RSIState, MACDState, BollingerState, OBVState)}
+
+
+def default_indicators() -> Dict[str, object]:
+    """Bộ chỉ báo mặc định giống calculate_ta_indicators"""
+    return {
+        'MA50': RollingState(50),
+        'MA200': RollingState(200),
+        'RSI': RSIState(14, smoothing='sma'),
+        'RSI_Wilder': RSIState(14, smoothing='wilder'),
+        'MACD': MACDState(12, 26, 9),
+        'BB': BollingerState(20, 2),
+        'Volume_MA': RollingState(20),
+        'OBV': OBVState(),
+    }
+
+
+class SymbolIndicators:
+    """
+    Trạng thái chỉ báo của một mã
+
+    update_bar() bỏ qua các phiên đã nạp (date <= last_bar) nên có thể gọi lại
+    với cùng dữ liệu mà không bị tính trùng.
+    """
+
+    def __init__(self, symbol: str, indicators: Optional[Dict[str, object]] = None,
+                 last_bar: Optional[str] = None):
+        self.symbol = symbol.upper()
+        self.indicators = indicators if indicators is not None else default_indicators()
+        self.last_bar = last_bar
+
+    def update_bar(self, bar: Dict) -> bool:
+        """
+        Nạp một phiên (dict date, close, volume - giá nghìn đồng như price store)
+
+        Returns:
+            bool: True nếu là phiên mới
+        """
+        if self.last_bar is not None and bar['date'] <= self.last_bar:
+            return False
+
+        close = bar['close'] * 1000  # VND
+        volume = bar.get('volume') or 0
+        for name, state in self.indicators.items():
+            if isinstance(state, OBVState):
+                state.update(close, volume)
+            elif name == 'Volume_MA':
+                state.update(volume)
+            else:
+                state.update(close)
+
+        self.last_bar = bar['date']
+        return True
+
+    def update_bars(self, bars: List[Dict]) -> int:
+        """Nạp nhiều phiên theo thứ tự ngày, trả về số phiên mới"""
+        return sum(1 for bar in bars if self.update_bar(bar))
+
+    def latest(self) -> Dict:
+        """Giá trị mới nhất của các chỉ báo"""
+        return {name: state.value for name, state in self.indicators.items()}
+
+
+def load_symbol_indicators(symbol: str) -> Optional[SymbolIndicators]:
+    """Đọc trạng thái chỉ báo đã lưu của một mã (None nếu chưa có)"""
+    rows = get_db().get_indicator_states(symbol)
+    if not rows:
+        return None
+
+    indicators = {}
+    last_bars = set()
+    for row in rows:
+        cls = STATE_CLASSES[row['kind']]
+        indicators[row['indicator']] = cls.from_dict(json.loads(row['params']), json.loads(row['state']))
+        last_bars.add(row['last_bar'])
+
+    # Các chỉ báo phải cùng tiến độ, nếu lệch thì khởi tạo lại
+    if len(last_bars) != 1 or set(indicators) != set(default_indicators()):
+        return None
+
+    return SymbolIndicators(symbol, indicators, last_bars.pop())
+
+
+def save_symbol_indicators(symbol_indicators: SymbolIndicators) -> bool:
+    """Lưu trạng thái chỉ báo của một mã"""
+    return get_db().save_indicator_states(symbol_indicators.symbol, [
+        {
+            'indicator': name,
+            'kind': state.kind,
+            'params': json.dumps(state.params, sort_keys=True),
+            'state': json.dumps(state.to_dict()),
+            'last_bar': symbol_indicators.last_bar
+        }
+        for name, state in symbol_indicators.indicators.items()
+    ])
+
+
+def refresh_symbol_indicators(symbol: str) -> Optional[Dict]:
+    """
+    Cập nhật chỉ báo của một mã từ các phiên mới trong price store
+
+    Lần đầu khởi tạo từ WARMUP_DAYS phiên gần nhất; các lần sau chỉ nạp phiên
+    có ngày > last_bar (thường 1 phiên/ngày). Chỉ nạp nến đã chốt: nến trong
+    phiên còn thay đổi, nếu nạp sớm thì giá đóng cửa cuối cùng bị bỏ qua.
+
+    Returns:
+        Dict giá trị chỉ báo mới nhất, None nếu chưa có dữ liệu giá
+    """
+    db = get_db()
+    state = load_symbol_indicators(symbol)
+
+    if state is None:
+        state = SymbolIndicators(symbol)
+        bars = db.get_price_history(symbol)[-WARMUP_DAYS:]
+    else:
+        bars = db.get_price_history(symbol, start_date=state.last_bar)
+
+    settled = last_settled_date(symbol)
+    if settled is not None:
+        bars = [bar for bar in bars if bar['date'] <= settled]
+
+    new_bars = state.update_bars(bars)
+    if state.last_bar is None:
+        return None
+
+    if new_bars:
+        save_symbol_indicators(state)
+        logger.debug(f"{symbol}: applied {new_bars} new bars (last bar {state.last_bar})")
+
+    return {'symbol': state.symbol, 'last_bar': state.last_bar, **state.latest()}
+
+
+def refresh_market_indicators(symbols: Optional[List[str]] = None) -> List[Dict]:
+    """
+    Cập nhật chỉ báo cho nhiều mã (mặc định mọi mã có trong price store)
+
+    Returns:
+        List[Dict]: Giá trị chỉ báo mới nhất của từng mã
+    """
+    if symbols is None:
+        symbols = get_db().get_price_history_symbols()
+
+    started = datetime.now()
+    results = []
+    for symbol in symbols:
+        try:
+            latest = refresh_symbol_indicators(symbol)
+            if latest:
+                results.append(latest)
+        except Exception as e:
+            logger.error(f"Error refreshing indicators for {symbol}: {e}")
+
+    logger.info(f"Refreshed indicators for {len(results)}/{len(symbols)} symbols "
+                f"in {(datetime.now() - started).total_seconds():.1f}s")
+    return results
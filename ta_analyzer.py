@@ -6,36 +6,68 @@ Phân tích kỹ thuật và vẽ biểu đồ cho cổ phiếu Việt Nam
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-from typing import Dict, Any, Optional, Tuple
+from typing import Dict, Any, Iterable, Optional, Tuple
 import logging
 import os
 
+from data_store import SymbolDataBundle, get_price_history
+import indicator_library
+
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def calculate_ta_indicators(symbol: str, period_days: int = 365) -> Dict[str, Any]:
+# Chỉ báo của calculate_ta_indicators:
+# tên -> (chỉ báo trong indicator_library, cột đầu vào, tham số, cột kết quả)
+TA_INDICATORS = {
+    'MA50': ('SMA', 'Close', {'period': 50}, ['MA50']),
+    'MA200': ('SMA', 'Close', {'period': 200}, ['MA200']),
+    'RSI': ('RSI', 'Close', {'period': 14}, ['RSI']),
+    'MACD': ('MACD', 'Close', {}, ['MACD', 'MACD_Signal', 'MACD_Hist']),
+    'BB': ('BB', 'Close', {}, ['BB_Upper', 'BB_Middle', 'BB_Lower']),
+    'Volume_MA': ('SMA', 'Volume', {'period': 20}, ['Volume_MA']),
+}
+
+
+def _latest(series: pd.Series) -> Optional[float]:
+    """Giá trị phiên cuối (None nếu NaN)"""
+    value = series.iloc[-1]
+    return None if pd.isna(value) else float(value)
+
+
+def calculate_ta_indicators(symbol: str, period_days: int = 365,
+                            bundle: Optional[SymbolDataBundle] = None,
+                            indicators: Optional[Iterable[str]] = None,
+                            latest_only: bool = False) -> Dict[str, Any]:
     """
     Tính toán các chỉ báo kỹ thuật (TA) cho một mã cổ phiếu
     
     Args:
         symbol: Mã cổ phiếu (VD: FPT, VIC, VCB)
         period_days: Số ngày lấy dữ liệu (mặc định 365 ngày = 1 năm)
+        bundle: Dữ liệu đã tải sẵn của mã (None = lấy từ price store)
+        indicators: Các chỉ báo cần tính (tên trong TA_INDICATORS: MA50, MA200,
+                    RSI, MACD, BB, Volume_MA). None = tất cả
+        latest_only: True = chỉ tính giá trị mới nhất trên số phiên cuối cần
+                     thiết và không trả về DataFrame ("data" = None)
     
     Returns:
         Dictionary chứa:
-        - Dữ liệu OHLCV
-        - Các chỉ báo: MA(50), MA(200), RSI(14)
+        - Dữ liệu OHLCV kèm các cột chỉ báo (None nếu latest_only)
+        - Giá trị mới nhất của các chỉ báo được yêu cầu
         - Metadata
     """
     try:
-        from vnstock import Vnstock
-        
         logger.info(f"Bắt đầu phân tích TA cho mã {symbol}")
         
-        # Khởi tạo vnstock client
-        stock = Vnstock().stock(symbol=symbol, source='VCI')
+        if indicators is None:
+            requested = list(TA_INDICATORS)
+        else:
+            requested = [name for name in TA_INDICATORS if name in set(indicators)]
+            unknown = set(indicators) - set(TA_INDICATORS)
+            if unknown:
+                raise ValueError(f"Chỉ báo không hỗ trợ: {', '.join(sorted(unknown))}")
         
         # Tính toán khoảng thời gian
         end_date = datetime.now().strftime("%Y-%m-%d")
@@ -43,8 +75,11 @@ def calculate_ta_indicators(symbol: str, period_days: int = 365) -> Dict[str, An
         
         logger.info(f"Lấy dữ liệu OHLCV từ {start_date} đến {end_date}")
         
-        # Lấy dữ liệu OHLCV
-        df = stock.quote.history(start=start_date, end=end_date)
+        # Lấy dữ liệu OHLCV (từ bundle hoặc price store cục bộ, chỉ tải phần mới)
+        if bundle is not None:
+            df = bundle.get_history(period_days)
+        else:
+            df = get_price_history(symbol, start_date=start_date, end_date=end_date)
         
         if df.empty:
             logger.warning(f"Không có dữ liệu cho mã {symbol}")
@@ -54,6 +89,17 @@ def calculate_ta_indicators(symbol: str, period_days: int = 365) -> Dict[str, An
                 "data": None
             }
         
+        trading_days = len(df)
+        logger.info(f"Lấy được {trading_days} ngày giao dịch")
+        
+        # Chỉ cần giá trị mới nhất: cắt về số phiên cuối mà các chỉ báo cần
+        # (EMA/MACD phụ thuộc toàn bộ chuỗi nên giữ nguyên)
+        if latest_only:
+            windows = [indicator_library.lookback(TA_INDICATORS[name][0], **TA_INDICATORS[name][2])
+                       for name in requested]
+            if None not in windows:
+                df = df.tail(max(windows, default=1))
+        
         # Đổi tên cột để phù hợp với mplfinance
         df = df.rename(columns={
             'time': 'Date',
@@ -72,29 +118,55 @@ def calculate_ta_indicators(symbol: str, period_days: int = 365) -> Dict[str, An
         for col in ['Open', 'High', 'Low', 'Close']:
             df[col] = df[col] * 1000
         
-        logger.info(f"Lấy được {len(df)} ngày giao dịch")
-        
         # === Tính toán các chỉ báo kỹ thuật ===
-        
-        # 1. Moving Averages (MA)
-        logger.info("Tính toán Moving Averages...")
-        df['MA50'] = df['Close'].rolling(window=50).mean()
-        df['MA200'] = df['Close'].rolling(window=200).mean()
-        
-        # 2. RSI (Relative Strength Index)
-        logger.info("Tính toán RSI(14)...")
-        df['RSI'] = calculate_rsi(df['Close'], period=14)
-        
-        # 3. MACD (Moving Average Convergence Divergence)
-        logger.info("Tính toán MACD...")
-        df['MACD'], df['MACD_Signal'], df['MACD_Hist'] = calculate_macd(df['Close'])
-        
-        # 4. Bollinger Bands
-        logger.info("Tính toán Bollinger Bands...")
-        df['BB_Upper'], df['BB_Middle'], df['BB_Lower'] = calculate_bollinger_bands(df['Close'])
-        
-        # 5. Volume MA
-        df['Volume_MA'] = df['Volume'].rolling(window=20).mean()
+        # Các chỉ báo lấy từ indicator_library (memoization theo mã + phiên cuối)
+        logger.info(f"Tính toán {', '.join(requested)}...")
+        values = {}
+        for name in requested:
+            library_name, column, params, columns = TA_INDICATORS[name]
+            output = indicator_library.compute(library_name, df[column], symbol, **params)
+            series = output if isinstance(output, tuple) else (output,)
+            for output_column, output_series in zip(columns, series):
+                values[output_column] = _latest(output_series)
+                if not latest_only:
+                    df[output_column] = output_series
+        
+        indicator_values = {}
+        if 'MA50' in requested:
+            indicator_values["MA50"] = {
+                "latest_value": values['MA50'],
+                "description": "Moving Average 50 ngày"
+            }
+        if 'MA200' in requested:
+            indicator_values["MA200"] = {
+                "latest_value": values['MA200'],
+                "description": "Moving Average 200 ngày"
+            }
+        if 'RSI' in requested:
+            indicator_values["RSI"] = {
+                "latest_value": values['RSI'],
+                "description": "Relative Strength Index (14 ngày)",
+                "signal": get_rsi_signal(values['RSI']) if values['RSI'] is not None else None
+            }
+        if 'MACD' in requested:
+            indicator_values["MACD"] = {
+                "latest_value": values['MACD'],
+                "signal_value": values['MACD_Signal'],
+                "histogram": values['MACD_Hist'],
+                "description": "Moving Average Convergence Divergence"
+            }
+        if 'BB' in requested:
+            indicator_values["BB"] = {
+                "upper": values['BB_Upper'],
+                "middle": values['BB_Middle'],
+                "lower": values['BB_Lower'],
+                "description": "Bollinger Bands (20 ngày, 2 độ lệch chuẩn)"
+            }
+        if 'Volume_MA' in requested:
+            indicator_values["Volume_MA"] = {
+                "latest_value": values['Volume_MA'],
+                "description": "Khối lượng trung bình 20 ngày"
+            }
         
         # Tạo kết quả
         result = {
@@ -103,30 +175,10 @@ def calculate_ta_indicators(symbol: str, period_days: int = 365) -> Dict[str, An
                 "start_date": start_date,
                 "end_date": end_date,
                 "total_days": period_days,
-                "trading_days": len(df)
-            },
-            "data": df,
-            "indicators": {
-                "MA50": {
-                    "latest_value": float(df['MA50'].iloc[-1]) if not pd.isna(df['MA50'].iloc[-1]) else None,
-                    "description": "Moving Average 50 ngày"
-                },
-                "MA200": {
-                    "latest_value": float(df['MA200'].iloc[-1]) if not pd.isna(df['MA200'].iloc[-1]) else None,
-                    "description": "Moving Average 200 ngày"
-                },
-                "RSI": {
-                    "latest_value": float(df['RSI'].iloc[-1]) if not pd.isna(df['RSI'].iloc[-1]) else None,
-                    "description": "Relative Strength Index (14 ngày)",
-                    "signal": get_rsi_signal(df['RSI'].iloc[-1]) if not pd.isna(df['RSI'].iloc[-1]) else None
-                },
-                "MACD": {
-                    "latest_value": float(df['MACD'].iloc[-1]) if not pd.isna(df['MACD'].iloc[-1]) else None,
-                    "signal_value": float(df['MACD_Signal'].iloc[-1]) if not pd.isna(df['MACD_Signal'].iloc[-1]) else None,
-                    "histogram": float(df['MACD_Hist'].iloc[-1]) if not pd.isna(df['MACD_Hist'].iloc[-1]) else None,
-                    "description": "Moving Average Convergence Divergence"
-                }
+                "trading_days": trading_days
             },
+            "data": None if latest_only else df,
+            "indicators": indicator_values,
             "current_price": float(df['Close'].iloc[-1]),
             "price_unit": "VND",
             "calculation_date": datetime.now().isoformat()
@@ -155,18 +207,7 @@ def calculate_rsi(prices: pd.Series, period: int = 14) -> pd.Series:
     Returns:
         Series chứa giá trị RSI
     """
-    # Tính delta
-    delta = prices.diff()
-    
-    # Tách gain và loss
-    gain = (delta.where(delta > 0, 0)).rolling(window=period).mean()
-    loss = (-delta.where(delta < 0, 0)).rolling(window=period).mean()
-    
-    # Tính RS và RSI
-    rs = gain / loss
-    rsi = 100 - (100 / (1 + rs))
-    
-    return rsi
+    return indicator_library.rsi(prices, period)
 
 
 def calculate_macd(prices: pd.Series, fast: int = 12, slow: int = 26, signal: int = 9) -> Tuple[pd.Series, pd.Series, pd.Series]:
@@ -182,20 +223,7 @@ def calculate_macd(prices: pd.Series, fast: int = 12, slow: int = 26, signal: in
     Returns:
         Tuple (MACD line, Signal line, Histogram)
     """
-    # Tính EMA
-    ema_fast = prices.ewm(span=fast, adjust=False).mean()
-    ema_slow = prices.ewm(span=slow, adjust=False).mean()
-    
-    # MACD line
-    macd_line = ema_fast - ema_slow
-    
-    # Signal line
-    signal_line = macd_line.ewm(span=signal, adjust=False).mean()
-    
-    # Histogram
-    histogram = macd_line - signal_line
-    
-    return macd_line, signal_line, histogram
+    return indicator_library.macd(prices, fast, slow, signal)
 
 
 def calculate_bollinger_bands(prices: pd.Series, period: int = 20, std_dev: int = 2) -> Tuple[pd.Series, pd.Series, pd.Series]:
@@ -210,17 +238,7 @@ def calculate_bollinger_bands(prices: pd.Series, period: int = 20, std_dev: int
     Returns:
         Tuple (Upper band, Middle band, Lower band)
     """
-    # Middle band (SMA)
-    middle_band = prices.rolling(window=period).mean()
-    
-    # Standard deviation
-    std = prices.rolling(window=period).std()
-    
-    # Upper và Lower bands
-    upper_band = middle_band + (std * std_dev)
-    lower_band = middle_band - (std * std_dev)
-    
-    return upper_band, middle_band, lower_band
+    return indicator_library.bollinger_bands(prices, period, std_dev)
 
 
 def get_rsi_signal(rsi_value: float) -> str:
@@ -388,13 +406,14 @@ def get_ta_analysis(symbol: str, period_days: int = 365) -> Dict[str, Any]:
     try:
         logger.info(f"Phân tích TA toàn diện cho mã {symbol}")
         
-        # Tính toán các chỉ báo
-        ta_result = calculate_ta_indicators(symbol, period_days)
+        # Tính toán các chỉ báo (chỉ cần giá trị mới nhất)
+        ta_result = calculate_ta_indicators(symbol, period_days,
+                                            indicators=['MA50', 'MA200', 'RSI', 'MACD'],
+                                            latest_only=True)
         
         if ta_result.get("error"):
             return ta_result
         
-        df = ta_result["data"]
         indicators = ta_result["indicators"]
         
         # Diễn giải các chỉ báo
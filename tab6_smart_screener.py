@@ -9,7 +9,7 @@ with tab6:
     
     # Import database
     from database import get_db
-    from stock_classifier import StockClassifier
+    from stock_classifier import StockClassifier, SUMMARY_COLUMNS
     
     db = get_db()
     classifier = StockClassifier()
@@ -166,11 +166,13 @@ with tab6:
                         exchange = None if scan_exchange == "All" else scan_exchange
                         min_rating = None if filter_rating == "All" else filter_rating
                         
+                        # Chỉ đọc cột tóm tắt, không decode JSON từng mã
                         results = db.get_all_cached_classifications(
                             exchange=exchange,
                             max_age_hours=cache_age,
                             min_rating=min_rating,
-                            limit=scan_limit
+                            limit=scan_limit,
+                            columns=SUMMARY_COLUMNS
                         )
                         
                         if results:
@@ -278,7 +280,8 @@ with tab6:
         
         with col1:
             if st.button("🔝 Top 20", use_container_width=True):
-                results = db.get_all_cached_classifications(max_age_hours=24, limit=20)
+                results = db.get_all_cached_classifications(max_age_hours=24, limit=20,
+                                                            columns=SUMMARY_COLUMNS)
                 if results:
                     st.session_state['screener_results'] = results
                     st.session_state['screener_mode'] = 'quick_top'
@@ -318,6 +321,18 @@ with tab6:
             # Convert to DataFrame
             df_list = []
             for stock in results:
+                if 'classifications' not in stock:
+                    # Dòng tóm tắt từ cache (columns=SUMMARY_COLUMNS)
+                    df_list.append({
+                        'symbol': stock.get('symbol'),
+                        'rating': stock.get('overall_rating') or 'N/A',
+                        'score': stock.get('overall_score') or 0,
+                        'growth': stock.get('growth_category') or 'N/A',
+                        'risk': stock.get('risk_category') or 'N/A',
+                        'momentum': stock.get('momentum_category') or 'N/A',
+                        'recommendation': stock.get('recommendation') or 'N/A'
+                    })
+                    continue
                 df_list.append({
                     'symbol': stock.get('symbol'),
                     'rating': stock.get('overall_rating', {}).get('rating', 'N/A'),
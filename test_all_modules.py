@@ -4,8 +4,11 @@ Comprehensive Testing Suite - VNStock
 Test all modules and features
 """
 
+import os
 import pytest
 import sys
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime, timedelta
 
 # Test imports
@@ -16,7 +19,8 @@ try:
     from vnstock import Vnstock
     print("✓ vnstock")
     
-    from database import get_db, VNStockDB
+    import database
+    from database import BatchWriter, get_db, VNStockDB
     print("✓ database")
     
     from notifications import NotificationManager, get_notifier
@@ -48,6 +52,36 @@ try:
     from backtesting_strategy import run_ma_crossover_backtest
     print("✓ backtesting_strategy")
     
+    from data_store import get_financial_statement, get_price_history
+    print("✓ data_store")
+    
+    from scan_engine import iter_scan, run_scan
+    print("✓ scan_engine")
+    
+    from streaming_indicators import load_symbol_indicators, refresh_symbol_indicators
+    print("✓ streaming_indicators")
+    
+    from panel_indicators import compute_panel_indicators, latest_snapshot
+    print("✓ panel_indicators")
+    
+    from indicator_library import IndicatorCache, compute, get_indicator_cache
+    print("✓ indicator_library")
+    
+    from screener_query import QueryError, compile_query, run_query
+    print("✓ screener_query")
+    
+    from scan_jobs import ScanJobManager, normalize_params
+    print("✓ scan_jobs")
+    
+    from api_concurrency import get_limiter, run_blocking
+    print("✓ api_concurrency")
+    
+    from response_cache import ResponseCache, market_aware_ttl, route_ttl_class
+    print("✓ response_cache")
+    
+    from single_flight import SingleFlight
+    print("✓ single_flight")
+    
     print("\n✅ All imports successful!\n")
     
 except ImportError as e:
@@ -55,6 +89,27 @@ except ImportError as e:
     sys.exit(1)
 
 
+# ========== TEST DATABASE ==========
+
+@contextmanager
+def temp_database(directory: str):
+    """Trỏ get_db() tới DB tạm trong directory (không ghi vào vnstock.db)"""
+    previous = database._db_instance
+    database._db_instance = VNStockDB(os.path.join(directory, 'test.db'))
+    try:
+        yield database._db_instance
+    finally:
+        database._db_instance.close()
+        database._db_instance = previous
+
+
+@pytest.fixture(autouse=True)
+def temp_db(tmp_path):
+    """Mỗi test chạy trên DB tạm riêng"""
+    with temp_database(str(tmp_path)) as db:
+        yield db
+
+
 # ========== DATABASE TESTS ==========
 
 def test_database():
@@ -63,9 +118,10 @@ def test_database():
     print("TESTING DATABASE MODULE")
     print("=" * 60)
     
+    db = get_db()
+    alert_id = pos_id = None
+    
     try:
-        db = get_db()
-        
         # Test watchlist
         print("\n1. Testing Watchlist...")
         db.add_to_watchlist('TEST', notes='Test stock', target_price=50000)
@@ -88,23 +144,227 @@ def test_database():
         assert len(portfolio) > 0, "Portfolio should not be empty"
         print(f"   ✓ Portfolio works (ID: {pos_id})")
         
+        # Test retry queue
+        print("\n4. Testing Retry Queue...")
+        assert db.enqueue_retry('TEST', error='rate limit') == 1, "First attempt should be 1"
+        assert db.enqueue_retry('TEST', error='rate limit') == 2, "Attempts should increase"
+        assert not any(r['symbol'] == 'TEST' for r in db.get_due_retries()), "Should wait for backoff"
+        assert db.remove_retry('TEST'), "Should remove retry"
+        print("   ✓ Retry queue works")
+        
+        # Test classification cache freshness
+        print("\n5. Testing Classification Cache...")
+        db.save_classification_result('TEST', {'overall_rating': {'rating': 'B', 'score': 6, 'recommendation': 'HOLD'}})
+        assert db.get_cached_classification('TEST') is not None, "Fresh entry should be returned"
+        assert db.get_cached_classification('TEST', max_age_hours=0) is None, "Stale entry should be skipped"
+        assert not any(r['symbol'] == 'TEST' for r in db.get_outdated_classifications()), "Fresh entry is not outdated"
+        plan = db.conn.execute('EXPLAIN QUERY PLAN SELECT symbol FROM stock_classification_cache '
+                               'WHERE scan_epoch > ?', (0,)).fetchall()
+        assert 'idx_scan_epoch' in str([tuple(row) for row in plan]), "Freshness filter should use index"
+        summary = db.get_all_cached_classifications(columns=['symbol', 'overall_rating'], rating='B')
+        assert {'symbol': 'TEST', 'overall_rating': 'B'} in summary, "Projection should return only requested columns"
+        summary = db.get_all_cached_classifications(columns=['symbol', 'recommendation'])
+        assert {'symbol': 'TEST', 'recommendation': 'HOLD'} in summary, "Recommendation should be a plain column"
+        df = db.get_all_cached_classifications(columns=['symbol', 'overall_score'], as_dataframe=True)
+        assert list(df.columns) == ['symbol', 'overall_score'], "DataFrame should have projected columns"
+        db.conn.execute("DELETE FROM stock_classification_cache WHERE symbol = 'TEST'")
+        db.conn.commit()
+        print("   ✓ Classification cache freshness uses scan_epoch index, projection works")
+        
+        # Test classification history
+        print("\n6. Testing Classification History...")
+        last_week = (datetime.now() - timedelta(days=10)).strftime('%Y-%m-%d')
+        db.conn.execute("INSERT OR REPLACE INTO classification_history (scan_date, symbol, scan_epoch, rating_rank) "
+                        "VALUES (?, 'TEST', 0, 2)", (last_week,))
+        db.save_classification_result('TEST', {'overall_rating': {'rating': 'A', 'score': 7}})
+        upgrades = db.get_rating_changes(days=7, direction='upgrade')
+        assert any(c['symbol'] == 'TEST' and c['from_rating'] == 'C' and c['to_rating'] == 'A' for c in upgrades), \
+            "Should report C -> A upgrade"
+        assert len(db.get_classification_history('TEST', days=30)) == 2, "Should keep one row per scan date"
+        db.conn.execute("DELETE FROM classification_history WHERE symbol = 'TEST'")
+        db.conn.execute("DELETE FROM stock_classification_cache WHERE symbol = 'TEST'")
+        db.conn.commit()
+        print("   ✓ Rating changes detected from history")
+        
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            history_db = VNStockDB(os.path.join(tmp_dir, 'history.db'))
+            # Tuần 30/12/2024 - 05/01/2025 vắt qua năm mới
+            for scan_date in ['2024-12-27', '2024-12-30', '2025-01-01', '2025-01-03']:
+                history_db.conn.execute("INSERT INTO classification_history (scan_date, symbol, scan_epoch, rating_rank) "
+                                        "VALUES (?, 'TEST', 0, 3)", (scan_date,))
+            history_db.conn.commit()
+            history_db.compact_classification_history(daily_days=0, max_days=100000)
+            kept = [row['scan_date'] for row in history_db.conn.execute(
+                "SELECT scan_date FROM classification_history ORDER BY scan_date")]
+            history_db.close()
+        assert kept == ['2024-12-27', '2025-01-03'], f"Should keep the last row of each ISO week, got {kept}"
+        print("   ✓ Compaction keeps one row per week across New Year")
+        
+        # Test batch writer
+        print("\n7. Testing Batch Writer...")
+        batches = []
+        with BatchWriter(lambda items: batches.append(list(items)) or len(items), max_size=3) as writer:
+            for i in range(7):
+                writer.add(('TEST', {'overall_rating': {'rating': 'B', 'score': i}}, 'HOSE'))
+        assert [len(b) for b in batches] == [3, 3, 1], f"Should flush by size then on close, got {batches}"
+        assert db.save_classification_results([(f'TEST{i}', {}, 'HOSE') for i in range(3)]) == 3
+        unserializable = ('TESTBAD', {'overall_rating': {'rating': 'B'}, 'raw': object()}, 'HOSE')
+        assert db.save_classification_results([('TEST0', {}, 'HOSE'), unserializable, ('TEST1', {}, 'HOSE')]) == 2, \
+            "A result that cannot be serialized should only skip itself"
+        def flaky_flush(items):
+            if 'BAD' in items:
+                raise ValueError("bad record")
+            return len(items)
+        with BatchWriter(flaky_flush, max_size=10) as writer:
+            for item in ['A', 'BAD', 'B']:
+                writer.add(item)
+        assert writer.written == 2, "Failed batch should fall back to per-record writes"
+        db.conn.execute("DELETE FROM stock_classification_cache WHERE symbol LIKE 'TEST%'")
+        db.conn.commit()
+        print("   ✓ Batch writer flushes by size and on close")
+        
+        # Test per-thread connections
+        print("\n8. Testing Per-thread Connections...")
+        import threading
+        thread_conns = []
+        worker = threading.Thread(target=lambda: thread_conns.append(db.conn))
+        worker.start()
+        worker.join()
+        assert thread_conns[0] is not db.conn, "Each thread should get its own connection"
+        assert db.conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal', "Should use WAL"
+        print("   ✓ WAL mode, one connection per thread")
+        
         # Test stats
-        print("\n4. Testing Stats...")
+        print("\n9. Testing Stats...")
         stats = db.get_stats()
         print(f"   Stats: {stats}")
         print("   ✓ Stats work")
         
-        # Cleanup
-        db.remove_from_watchlist('TEST')
-        db.remove_alert(alert_id)
-        db.close_position(pos_id, 52000)
-        
         print("\n✅ Database tests PASSED\n")
         return True
         
     except Exception as e:
         print(f"\n❌ Database test FAILED: {e}\n")
-        return False
+        raise
+    
+    finally:
+        # Cleanup
+        db.remove_from_watchlist('TEST')
+        if alert_id:
+            db.remove_alert(alert_id)
+        if pos_id:
+            db.close_position(pos_id, 52000)
+
+
+# ========== PRICE STORE TESTS ==========
+
+def test_price_store():
+    """Test local OHLCV store (không gọi vnstock khi dữ liệu đã đủ)"""
+    print("=" * 60)
+    print("TESTING PRICE STORE MODULE")
+    print("=" * 60)
+    
+    db = get_db()
+    today = datetime.now()
+    start = (today - timedelta(days=2)).strftime("%Y-%m-%d")
+    end = today.strftime("%Y-%m-%d")
+    
+    print("\n1. Testing Save/Get Price Bars...")
+    bars = [
+        {'date': (today - timedelta(days=i)).strftime("%Y-%m-%d"),
+         'open': 25.0, 'high': 26.0, 'low': 24.5, 'close': 25.5 + i, 'volume': 1000 * (i + 1)}
+        for i in range(3)
+    ]
+    saved = db.save_price_history('TEST', bars)
+    assert saved == 3, "Should save 3 bars"
+    rows = db.get_price_history('TEST', start, end)
+    assert len(rows) == 3, "Should get 3 bars"
+    assert rows[0]['date'] < rows[-1]['date'], "Bars should be sorted by date"
+    print("   ✓ Save/get works")
+    
+    print("\n2. Testing Local Serving...")
+    db.update_price_coverage('TEST', start, end)
+    df = get_price_history('TEST', start_date=start, end_date=end)
+    assert list(df.columns) == ['time', 'open', 'high', 'low', 'close', 'volume'], "Should match vnstock columns"
+    assert len(df) == 3, "Should serve 3 bars from local store"
+    assert df['close'].iloc[-1] == 25.5, "Latest bar should be today's close"
+    print("   ✓ Served from local store without upstream call")
+    ta = calculate_ta_indicators('TEST', period_days=2, indicators=['MA50'], latest_only=True)
+    assert ta['data'] is None, "latest_only should not return the DataFrame"
+    assert list(ta['indicators']) == ['MA50'], "Should compute only requested indicators"
+    assert ta['current_price'] == 25500, "Current price should be in VND"
+    print("   ✓ Requested indicators computed from local store")
+    
+    print("\n3. Testing Streaming Indicators...")
+    yesterday = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+    def set_fetched_at(hour):
+        db.conn.execute("UPDATE price_history_coverage SET updated_at = ? WHERE symbol = 'TEST'",
+                        (today.replace(hour=hour, minute=0, second=0, microsecond=0).isoformat(),))
+        db.conn.commit()
+    set_fetched_at(10)  # Nến hôm nay tải trong phiên - chưa chốt
+    latest = refresh_symbol_indicators('TEST')
+    assert latest['last_bar'] == yesterday, "Intraday bar should not be applied"
+    set_fetched_at(16)
+    latest = refresh_symbol_indicators('TEST')
+    assert latest['last_bar'] == end, "Settled bar should be applied on the next refresh"
+    assert latest['OBV'] is not None, "OBV should be available from the first bar"
+    assert latest['MA50'] is None, "MA50 needs 50 bars"
+    assert load_symbol_indicators('TEST').last_bar == end, "State should be persisted"
+    db.delete_indicator_states('TEST')
+    print("   ✓ Indicator state updated and persisted")
+    
+    print("\n4. Testing Financial Statement Cache...")
+    import pandas as pd
+    last_year = today.year - 1
+    statement = pd.DataFrame({
+        'CP': ['TEST', 'TEST'],
+        'Năm': [last_year, last_year],
+        'Kỳ': [4, 3],
+        'Lợi nhuận sau thuế (Tỷ đồng)': [120.5, 98.0]
+    })
+    db.save_financial_statement('TEST', 'income_statement', 'quarterly', 'vi',
+                                statement.to_json(orient='split', force_ascii=False),
+                                f"{last_year}-Q4")
+    cached = get_financial_statement('TEST', 'income_statement')
+    assert list(cached.columns) == list(statement.columns), "Should keep statement columns"
+    assert cached['Lợi nhuận sau thuế (Tỷ đồng)'].iloc[0] == 120.5, "Should serve cached statement"
+    print("   ✓ Served statement from local cache")
+    
+    print("\n5. Testing Adjusted Price Revalidation...")
+    import data_store
+    yesterday = (today - timedelta(days=1)).strftime("%Y-%m-%d")
+    db.delete_price_history('TEST')
+    db.save_price_history('TEST', bars[1:])
+    db.update_price_coverage('TEST', start, yesterday)
+    refresh_symbol_indicators('TEST')
+    
+    calls = []
+    def adjusted_history(symbol, start_date, end_date):
+        # Giá sau chia tách 1:2 - mọi nến cũ đều giảm một nửa
+        calls.append((start_date, end_date))
+        return pd.DataFrame([
+            {'time': bar['date'], 'open': bar['open'] / 2, 'high': bar['high'] / 2,
+             'low': bar['low'] / 2, 'close': bar['close'] / 2, 'volume': bar['volume'] * 2}
+            for bar in bars if start_date <= bar['date'] <= end_date
+        ])
+    
+    original_fetch = data_store._fetch_upstream_history
+    data_store._fetch_upstream_history = adjusted_history
+    try:
+        df = get_price_history('TEST', start_date=start, end_date=end)
+    finally:
+        data_store._fetch_upstream_history = original_fetch
+    assert calls == [(yesterday, end), (start, end)], "Should re-fetch the full range after a mismatch"
+    assert list(df['close']) == [27.5 / 2, 26.5 / 2, 25.5 / 2], "Stored bars should be adjusted"
+    assert db.get_indicator_states('TEST') == [], "Indicator state should be dropped"
+    print("   ✓ Adjusted history re-downloaded and indicator state reset")
+    
+    # Cleanup
+    db.delete_price_history('TEST')
+    db.delete_financial_statements('TEST')
+    assert db.get_price_coverage('TEST') is None, "Coverage should be removed"
+    
+    print("\n✅ Price store tests PASSED\n")
 
 
 # ========== DRAWING TOOLS TESTS ==========
@@ -342,6 +602,58 @@ def test_advanced_indicators():
         assert len(k_percent) == len(df), "Stochastic should match data length"
         print("   ✓ Stochastic works")
         
+        print("\n4. Testing Panel Indicators...")
+        panel = {field.lower(): pd.DataFrame({'AAA': df[field], 'BBB': df[field] * 2})
+                 for field in ['Open', 'High', 'Low', 'Close', 'Volume']}
+        snapshot = latest_snapshot(compute_panel_indicators(panel))
+        assert list(snapshot.index) == ['AAA', 'BBB'], "Should have one row per symbol"
+        assert abs(snapshot.loc['AAA', 'ADX'] - adx.iloc[-1]) < 1e-9, "Panel ADX should match per-symbol ADX"
+        assert abs(snapshot.loc['AAA', 'Stoch_K'] - k_percent.iloc[-1]) < 1e-9, "Panel Stochastic should match"
+        print("   ✓ Panel indicators work")
+        
+        # GAP tạm ngừng giao dịch 5 phiên: panel có NaN giữa chuỗi của GAP
+        from data_store import SymbolDataBundle
+        from ta_analyzer import calculate_ta_indicators
+        import indicator_library
+        traded = df.drop(df.index[40:45])
+        panel = {field.lower(): pd.DataFrame({'AAA': df[field], 'GAP': traded[field]})
+                 for field in ['Open', 'High', 'Low', 'Close', 'Volume']}
+        snapshot = latest_snapshot(compute_panel_indicators(panel))
+        bundle = SymbolDataBundle('GAPTEST')
+        bundle._history = pd.DataFrame({
+            'time': traded.index,
+            'open': traded['Open'].values / 1000, 'high': traded['High'].values / 1000,
+            'low': traded['Low'].values / 1000, 'close': traded['Close'].values / 1000,
+            'volume': traded['Volume'].values
+        })
+        ta = calculate_ta_indicators('GAPTEST', bundle=bundle, latest_only=True)
+        expected = {
+            'MA50': ta['indicators']['MA50']['latest_value'],
+            'RSI': ta['indicators']['RSI']['latest_value'],
+            'MACD': ta['indicators']['MACD']['latest_value'],
+            'BB_Upper': ta['indicators']['BB']['upper'],
+            'Volume_MA': ta['indicators']['Volume_MA']['latest_value'],
+            'ATR': indicator_library.atr(traded['High'], traded['Low'], traded['Close'], 14).iloc[-1]
+        }
+        for name, value in expected.items():
+            assert value is not None and abs(snapshot.loc['GAP', name] - value) < 1e-6 * abs(value), \
+                f"Panel {name} with a trading gap should match per-symbol TA"
+        print("   ✓ Symbols with trading gaps match per-symbol TA")
+        
+        print("\n5. Testing Indicator Library cache...")
+        cache = get_indicator_cache()
+        hits = cache.hits
+        rsi_first = compute('RSI', df['Close'], 'TEST')
+        rsi_again = compute('RSI', df['Close'], 'TEST', period=14)
+        assert rsi_again is rsi_first, "Same symbol/bar/params should hit the cache"
+        assert cache.hits == hits + 1, "Second call should be a cache hit"
+        assert abs(snapshot.loc['AAA', 'RSI'] - rsi_first.iloc[-1]) < 1e-9, "Panel RSI should match library RSI"
+        lru = IndicatorCache(max_entries=2)
+        for key in ['a', 'b', 'c']:
+            lru.get_or_compute((key,), lambda: key)
+        assert lru.stats()['entries'] == 2, "LRU should evict oldest entry"
+        print("   ✓ Indicator library works")
+        
         print("\n✅ Advanced indicators tests PASSED\n")
         return True
         
@@ -350,22 +662,360 @@ def test_advanced_indicators():
         return False
 
 
+# ========== SCAN ENGINE TESTS ==========
+
+def test_scan_engine():
+    """Test concurrent scan engine"""
+    print("=" * 60)
+    print("TESTING SCAN ENGINE MODULE")
+    print("=" * 60)
+    
+    import time
+    
+    def worker(symbol):
+        if symbol == 'ERR':
+            raise SystemExit("Rate limit")  # vnstock style
+        if symbol == 'SLOW':
+            time.sleep(2)
+        return symbol.lower()
+    
+    print("\n1. Testing Ordered Results...")
+    progress = []
+    outcomes = run_scan(['AAA', 'ERR', 'BBB', 'CCC'], worker, max_workers=3,
+                        progress_callback=lambda done, total, outcome: progress.append(done))
+    assert [o['symbol'] for o in outcomes] == ['AAA', 'ERR', 'BBB', 'CCC'], "Should keep input order"
+    assert outcomes[0]['result'] == 'aaa', "Should return worker result"
+    assert outcomes[1]['error'] == 'Rate limit', "Should capture SystemExit"
+    assert progress == [1, 2, 3, 4], "Should report progress for every symbol"
+    print("   ✓ Ordered results and progress work")
+    
+    print("\n2. Testing Per-symbol Timeout...")
+    outcomes = run_scan(['SLOW', 'AAA'], worker, max_workers=2, timeout=0.5)
+    assert outcomes[0]['timed_out'], "Slow symbol should time out"
+    assert outcomes[1]['result'] == 'aaa', "Other symbols should still finish"
+    print("   ✓ Timeout works")
+    
+    print("\n3. Testing Streaming Results...")
+    outcomes = list(iter_scan(['SLOW', 'AAA'], worker, max_workers=2))
+    assert [o['symbol'] for o in outcomes] == ['AAA', 'SLOW'], "Should yield in completion order"
+    assert outcomes[1]['index'] == 0, "Should report input position"
+    print("   ✓ Streaming results work")
+    
+    print("\n4. Testing Timeout Frees Worker Slot...")
+    def blocking_worker(symbol):
+        if symbol == 'STUCK':
+            time.sleep(8)
+        return symbol.lower()
+    
+    start = time.monotonic()
+    outcomes = run_scan(['STUCK', 'AAA', 'BBB'], blocking_worker, max_workers=1, timeout=1)
+    wall_time = time.monotonic() - start
+    assert outcomes[0]['timed_out'], "Stuck symbol should time out"
+    assert [o['result'] for o in outcomes[1:]] == ['aaa', 'bbb'], "Queued symbols should still run"
+    assert wall_time < 3, f"Timed-out worker should not block the queue ({wall_time:.1f}s)"
+    print(f"   ✓ Queue continues after timeout ({wall_time:.1f}s)")
+    
+    print("\n5. Testing Thread Cap With Hanging Workers...")
+    import threading
+    running = {'now': 0, 'peak': 0}
+    lock = threading.Lock()
+    def hanging_worker(symbol):
+        with lock:
+            running['now'] += 1
+            running['peak'] = max(running['peak'], running['now'])
+        try:
+            if symbol.startswith('HANG'):
+                time.sleep(1.5)
+            return symbol.lower()
+        finally:
+            with lock:
+                running['now'] -= 1
+    
+    symbols = [f'HANG{i}' for i in range(6)] + ['AAA']
+    outcomes = run_scan(symbols, hanging_worker, max_workers=1, timeout=0.3)
+    assert running['peak'] <= 2, f"Live threads should stay within the cap, got {running['peak']}"
+    assert all(o['timed_out'] for o in outcomes[:6]), "Hanging symbols should time out"
+    assert len(outcomes) == len(symbols) and None not in outcomes, "Every symbol should get an outcome"
+    print(f"   ✓ At most {running['peak']} live threads for 1 worker")
+    
+    print("\n✅ Scan engine tests PASSED\n")
+
+
+# ========== SCAN JOBS TESTS ==========
+
+def test_scan_jobs():
+    """Test background scan jobs"""
+    print("=" * 60)
+    print("TESTING SCAN JOBS MODULE")
+    print("=" * 60)
+    
+    import time
+    import scan_jobs
+    
+    print("\n1. Testing Parameter Normalization...")
+    params = normalize_params('screener', {'exchange': 'hose', 'limit': '30'})
+    assert params['exchange'] == 'HOSE' and params['limit'] == 30, "Should coerce params"
+    assert params['pe_max'] == 15, "Should fill defaults"
+    for job_type, bad in [('unknown', {}), ('screener', {'foo': 1})]:
+        try:
+            normalize_params(job_type, bad)
+            assert False, f"Should reject: {job_type} {bad}"
+        except ValueError:
+            pass
+    print("   ✓ Normalization works")
+    
+    print("\n2. Testing Job Lifecycle...")
+    def echo_records(symbols=None):
+        for i, symbol in enumerate(symbols, 1):
+            time.sleep(0.2)
+            yield {'type': 'result', 'completed': i, 'total': len(symbols), 'symbol': symbol, 'data': i}
+        yield {'type': 'summary', 'data': {'count': len(symbols)}}
+    
+    scan_jobs.JOB_TYPES['test_echo'] = (echo_records, {'symbols': None})
+    manager = ScanJobManager()
+    job = manager.submit('test_echo', {'symbols': 'AAA,BBB'})
+    shared = manager.submit('test_echo', {'symbols': ['aaa', 'bbb']})
+    assert shared['shared'] and shared['job_id'] == job['job_id'], "Duplicate scan should share the job"
+    
+    for _ in range(50):
+        status = manager.get(job['job_id'])
+        if status['status'] not in scan_jobs.ACTIVE_STATUSES:
+            break
+        time.sleep(0.1)
+    assert status['status'] == 'completed' and status['result'] == {'count': 2}, "Job should complete"
+    assert [r['symbol'] for r in manager.results(job['job_id'])] == ['AAA', 'BBB'], "Should persist results"
+    print("   ✓ Submit, share, poll and results work")
+    
+    # Cleanup
+    get_db().delete_scan_job(job['job_id'])
+    del scan_jobs.JOB_TYPES['test_echo']
+    
+    print("\n✅ Scan jobs tests PASSED\n")
+
+
+# ========== API CONCURRENCY TESTS ==========
+
+def test_api_concurrency():
+    """Test blocking work dispatch with per-class limits"""
+    print("=" * 60)
+    print("TESTING API CONCURRENCY MODULE")
+    print("=" * 60)
+    
+    import time
+    import anyio
+    
+    print("\n1. Testing Per-class Limits...")
+    running = {'now': 0, 'max': 0}
+    
+    def blocking_work():
+        running['now'] += 1
+        running['max'] = max(running['max'], running['now'])
+        time.sleep(0.2)
+        running['now'] -= 1
+    
+    async def main():
+        limit = int(get_limiter('scan').total_tokens)
+        started = time.perf_counter()
+        async with anyio.create_task_group() as tg:
+            for _ in range(limit + 2):
+                tg.start_soon(run_blocking, 'scan', blocking_work)
+            # Event loop vẫn rảnh trong khi việc blocking đang chạy
+            await anyio.sleep(0.05)
+            assert time.perf_counter() - started < 0.15, "Event loop should not be blocked"
+        return limit
+    
+    limit = anyio.run(main)
+    assert running['max'] == limit, f"Should run at most {limit} at once, got {running['max']}"
+    print(f"   ✓ At most {limit} concurrent scan calls, event loop stays free")
+    
+    print("\n✅ API concurrency tests PASSED\n")
+
+
+# ========== RESPONSE CACHE TESTS ==========
+
+def test_response_cache():
+    """Test response cache TTL, LRU eviction and route matching"""
+    print("=" * 60)
+    print("TESTING RESPONSE CACHE MODULE")
+    print("=" * 60)
+    
+    print("\n1. Testing Market-hours TTL...")
+    in_session = market_aware_ttl('price', datetime(2026, 10, 16, 10, 0))  # Thứ 6
+    after_close = market_aware_ttl('price', datetime(2026, 10, 16, 16, 0))
+    assert in_session <= 15 * 60, "In-session TTL should be short"
+    assert after_close == (datetime(2026, 10, 19, 9, 0) - datetime(2026, 10, 16, 16, 0)).total_seconds(), \
+        "After close should live until next session open (Monday)"
+    print(f"   ✓ In session: {in_session}s, after close: {after_close}s")
+    
+    print("\n2. Testing LRU Eviction and Expiry...")
+    cache = ResponseCache(max_entries=2)
+    first = cache.put(('/a', ()), b'{"success": true}', 'application/json', 60)
+    cache.put(('/b', ()), b'{}', 'application/json', 60)
+    assert cache.get(('/a', ()))['etag'] == first['etag'], "Should hit"
+    cache.put(('/c', ()), b'{}', 'application/json', 60)
+    assert cache.get(('/b', ())) is None, "Least recently used should be evicted"
+    cache.put(('/d', ()), b'{}', 'application/json', 0)
+    assert cache.get(('/d', ())) is None, "Expired entry should miss"
+    print(f"   ✓ Stats: {cache.stats()}")
+    
+    print("\n3. Testing Route Matching...")
+    assert route_ttl_class('GET', '/stock/FPT/ta') == 'price'
+    assert route_ttl_class('GET', '/stock/FPT/fa') == 'fundamental'
+    assert route_ttl_class('GET', '/stock/FPT/ta/chart') is None, "Charts are not cached"
+    assert route_ttl_class('POST', '/stock/FPT/fa') is None, "Only GET is cached"
+    print("   ✓ Cached routes matched")
+    
+    print("\n4. Testing Errors Inside Data Are Not Cached...")
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from response_cache import get_response_cache, response_cache_middleware
+    
+    app = FastAPI()
+    app.middleware("http")(response_cache_middleware)
+    upstream = {'rate_limited': True}
+    
+    @app.get("/stock/{symbol}/fa")
+    def fa(symbol: str):
+        if upstream['rate_limited']:
+            return {'success': True, 'data': {'error': 'Rate limit exceeded', 'rate_limited': True}}
+        return {'success': True, 'data': {'pe': 10.5}}
+    
+    get_response_cache().invalidate('/stock/CACHETEST')
+    client = TestClient(app)
+    limited = client.get('/stock/CACHETEST/fa')
+    assert 'x-cache' not in limited.headers, "Rate-limited payload should not be cached"
+    upstream['rate_limited'] = False
+    recovered = client.get('/stock/CACHETEST/fa')
+    assert recovered.json()['data'] == {'pe': 10.5}, "Should recompute after upstream recovers"
+    assert recovered.headers['x-cache'] == 'MISS'
+    assert client.get('/stock/CACHETEST/fa').headers['x-cache'] == 'HIT'
+    get_response_cache().invalidate('/stock/CACHETEST')
+    print("   ✓ data.error / data.rate_limited responses bypass the cache")
+    
+    print("\n✅ Response cache tests PASSED\n")
+
+
+# ========== SINGLE FLIGHT TESTS ==========
+
+def test_single_flight():
+    """Test coalescing of concurrent identical calls"""
+    print("=" * 60)
+    print("TESTING SINGLE FLIGHT MODULE")
+    print("=" * 60)
+    
+    import threading
+    import time
+    
+    flight = SingleFlight()
+    calls = {'count': 0}
+    
+    def upstream():
+        calls['count'] += 1
+        time.sleep(0.2)
+        return {'close': 100}
+    
+    print("\n1. Testing Concurrent Calls Share One Upstream Call...")
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do(('history', 'FPT'), upstream)))
+               for _ in range(5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert calls['count'] == 1, f"Should call upstream once, got {calls['count']}"
+    assert sum(1 for _, shared in results if shared) == 4, "Four callers should share"
+    assert all(result is results[0][0] for result, _ in results), "All callers get the same result"
+    print(f"   ✓ Stats: {flight.stats()}")
+    
+    print("\n2. Testing Errors and Sequential Calls...")
+    def failing():
+        raise SystemExit("rate limited")
+    try:
+        flight.do(('history', 'VIC'), failing)
+        assert False, "Should re-raise upstream error"
+    except SystemExit:
+        pass
+    flight.do(('history', 'FPT'), upstream)
+    assert calls['count'] == 2, "Finished calls should not be cached"
+    print("   ✓ Errors propagate, completed calls are not reused")
+    
+    print("\n✅ Single flight tests PASSED\n")
+
+
+# ========== SCREENER QUERY TESTS ==========
+
+def test_screener_query():
+    """Test declarative screener query over symbol_metrics"""
+    print("=" * 60)
+    print("TESTING SCREENER QUERY MODULE")
+    print("=" * 60)
+    
+    db = get_db()
+    
+    print("\n1. Testing Query Compilation...")
+    where, params = compile_query("PE < 15 AND ROE > 18 AND RSI BETWEEN 30 AND 50")
+    assert where == "(pe < ? AND roe > ? AND rsi BETWEEN ? AND ?)", "Should compile to SQL"
+    assert params == [15, 18, 30, 50], "Values should be parameters"
+    for bad in ["PE <", "unknown > 1", "pe > 1; DROP TABLE watchlist"]:
+        try:
+            compile_query(bad)
+            assert False, f"Should reject: {bad}"
+        except QueryError:
+            pass
+    print("   ✓ Compilation works")
+    
+    print("\n2. Testing SQL Screening...")
+    db.upsert_symbol_metrics([
+        {'symbol': 'TESTA', 'pe': 10, 'roe': 20, 'rsi': 40, 'overall_score': 8},
+        {'symbol': 'TESTB', 'pe': 25, 'roe': 20, 'rsi': 40, 'overall_score': 9},
+    ], source='fa')
+    rows = run_query("symbol IN ('TESTA', 'TESTB') AND PE < 15 AND ROE > 18 AND RSI BETWEEN 30 AND 50")
+    assert [r['symbol'] for r in rows] == ['TESTA'], "Should return matching symbols only"
+    rows = run_query("symbol IN ('TESTA', 'TESTB')", order_by="pe DESC")
+    assert [r['symbol'] for r in rows] == ['TESTB', 'TESTA'], "Should sort in SQL"
+    print("   ✓ Screening works")
+    
+    # Cleanup
+    db.delete_symbol_metrics('TESTA')
+    db.delete_symbol_metrics('TESTB')
+    
+    print("\n✅ Screener query tests PASSED\n")
+
+
 # ========== MAIN TEST RUNNER ==========
 
+def _run_test(test) -> bool:
+    """Chạy một test, lỗi (assertion) được tính là FAILED"""
+    try:
+        return test() is not False
+    except Exception as e:
+        print(f"\n❌ {test.__name__} FAILED: {e}\n")
+        return False
+
+
 def run_all_tests():
     """Run all tests"""
     print("\n" + "=" * 60)
     print("VNSTOCK COMPREHENSIVE TEST SUITE")
     print("=" * 60 + "\n")
     
-    results = {
-        'Database': test_database(),
-        'Drawing Tools': test_drawing_tools(),
-        'Portfolio Manager': test_portfolio_manager(),
-        'News & Sentiment': test_news_sentiment(),
-        'Notifications': test_notifications(),
-        'Advanced Indicators': test_advanced_indicators()
-    }
+    # Chạy trên DB tạm, không ghi dữ liệu test vào vnstock.db
+    with tempfile.TemporaryDirectory() as tmp_dir, temp_database(tmp_dir):
+        results = {
+            'Database': _run_test(test_database),
+            'Price Store': _run_test(test_price_store),
+            'Drawing Tools': test_drawing_tools(),
+            'Portfolio Manager': test_portfolio_manager(),
+            'News & Sentiment': test_news_sentiment(),
+            'Notifications': test_notifications(),
+            'Advanced Indicators': test_advanced_indicators(),
+            'Scan Engine': _run_test(test_scan_engine),
+            'Screener Query': _run_test(test_screener_query),
+            'Scan Jobs': _run_test(test_scan_jobs),
+            'API Concurrency': _run_test(test_api_concurrency),
+            'Response Cache': _run_test(test_response_cache),
+            'Single Flight': _run_test(test_single_flight)
+        }
     
     # Summary
     print("\n" + "=" * 60)
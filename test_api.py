@@ -136,6 +136,34 @@ def test_api():
     except Exception as e:
         print(f"❌ Complete stock data error: {str(e)}")
     
+    print()
+    
+    # Test 6: Multi-symbol batch (POST)
+    print("6️⃣ Test Multi-symbol Batch via POST (VIC, VCB, FPT)...")
+    try:
+        payload = {
+            "symbols": ["VIC", "VCB", "FPT"],
+            "sections": ["overview", "financial"]
+        }
+        
+        response = requests.post(
+            f"{base_url}/stock/batch",
+            json=payload,
+            headers={"Content-Type": "application/json"}
+        )
+        
+        if response.status_code == 200 and response.json().get('success'):
+            batch = response.json()['data']
+            print("✅ Multi-symbol batch: OK")
+            print(f"   Summary: {batch.get('summary')}")
+            for symbol, errors in batch.get('errors', {}).items():
+                print(f"   ❌ {symbol}: {errors}")
+        else:
+            print(f"❌ Multi-symbol batch failed: {response.status_code}")
+            print(f"   Response: {response.text}")
+    except Exception as e:
+        print(f"❌ Multi-symbol batch error: {str(e)}")
+    
     print()
     print("🏁 Test hoàn thành!")
     print("=" * 50)
@@ -10,10 +10,26 @@ from typing import Dict, List, Optional, Any
 import logging
 from decimal import Decimal
 
+from scan_engine import DEFAULT_MAX_WORKERS, DEFAULT_SYMBOL_TIMEOUT, run_scan
+
 # Cấu hình logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Các phần dữ liệu (section) -> key trong kết quả
+DATA_SECTIONS = {
+    'overview': 'overview',
+    'historical': 'historical_data',
+    'financial': 'financial_data',
+    'market': 'market_data',
+}
+
+# Số mã tối đa cho một batch request
+MAX_BATCH_SYMBOLS = 100
+
+# Số ngày giá gần nhất trong phần overview
+OVERVIEW_DAYS = 7
+
 class VNStockDataCollector:
     """
     Class chính để thu thập toàn bộ dữ liệu cổ phiếu từ vnstock
@@ -102,44 +118,41 @@ class VNStockDataCollector:
         Lấy thông tin tổng quan về cổ phiếu
         """
         try:
-            from vnstock import Vnstock
-            
-            # Khởi tạo vnstock client
-            stock = Vnstock().stock(symbol=symbol, source='VCI')
+            from data_store import fetch_upstream_history
             
             # Lấy dữ liệu giá gần nhất (7 ngày)
             end_date = datetime.now().strftime("%Y-%m-%d")
-            start_date = (datetime.now() - timedelta(days=7)).strftime("%Y-%m-%d")
+            start_date = (datetime.now() - timedelta(days=OVERVIEW_DAYS)).strftime("%Y-%m-%d")
             
-            current_data = stock.quote.history(start=start_date, end=end_date)
+            # Tải từ vnstock (chờ budget request chung, gộp request đồng thời cùng mã)
+            current_data = fetch_upstream_history(symbol, start_date, end_date)
             
-            # Format dữ liệu tiền tệ để đảm bảo chính xác
-            formatted_data = self._format_dataframe_currency(current_data)
-            
-            overview_data = {
-                "symbol": symbol,
-                "current_price_info": formatted_data.to_dict('records') if not formatted_data.empty else {},
-                "data_collection_time": datetime.now().isoformat(),
-                "currency_unit": "VND",
-                "currency_conversion": "Stock prices converted from thousands VND to full VND (multiplied by 1000)",
-                "note": "Basic stock data from vnstock - Prices in full VND units, no rounding applied"
-            }
-            
-            return overview_data
+            return self._build_overview(symbol, current_data)
             
         except Exception as e:
             logger.error(f"Lỗi khi lấy thông tin tổng quan cho {symbol}: {str(e)}")
             return {"error": str(e), "symbol": symbol}
     
+    def _build_overview(self, symbol: str, current_data: pd.DataFrame) -> Dict[str, Any]:
+        """Tạo phần overview từ dữ liệu giá gần nhất"""
+        # Format dữ liệu tiền tệ để đảm bảo chính xác
+        formatted_data = self._format_dataframe_currency(current_data)
+        
+        return {
+            "symbol": symbol,
+            "current_price_info": formatted_data.to_dict('records') if not formatted_data.empty else {},
+            "data_collection_time": datetime.now().isoformat(),
+            "currency_unit": "VND",
+            "currency_conversion": "Stock prices converted from thousands VND to full VND (multiplied by 1000)",
+            "note": "Basic stock data from vnstock - Prices in full VND units, no rounding applied"
+        }
+    
     def get_historical_data(self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, Any]:
         """
         Lấy dữ liệu lịch sử giá cổ phiếu
         """
         try:
-            from vnstock import Vnstock
-            
-            # Khởi tạo vnstock client
-            stock = Vnstock().stock(symbol=symbol, source='VCI')
+            from data_store import fetch_upstream_history
             
             start = start_date or self.start_date
             end = end_date or self.end_date
@@ -151,45 +164,44 @@ class VNStockDataCollector:
             # Ghi log khoảng thời gian yêu cầu
             logger.info(f"Lấy dữ liệu từ {start} đến {end} ({(end_dt - start_dt).days} ngày)")
             
-            # Lấy dữ liệu theo ngày
-            daily_data = stock.quote.history(start=start, end=end)
+            # Lấy dữ liệu theo ngày (chờ budget request chung, gộp request đồng thời cùng khoảng)
+            daily_data = fetch_upstream_history(symbol, start, end)
             
-            # Format dữ liệu tiền tệ để đảm bảo chính xác
-            formatted_daily_data = self._format_dataframe_currency(daily_data)
-            
-            historical_data = {
-                "symbol": symbol,
-                "period": {
-                    "start_date": start,
-                    "end_date": end
-                },
-                "daily_data": formatted_daily_data.to_dict('records') if not formatted_daily_data.empty else [],
-                "total_trading_days": len(formatted_daily_data) if not formatted_daily_data.empty else 0,
-                "currency_unit": "VND",
-                "currency_conversion": "Stock prices converted from thousands VND to full VND (multiplied by 1000)",
-                "note": "Historical price data from vnstock - Prices in full VND units, no rounding applied"
-            }
-            
-            return historical_data
+            return self._build_historical(symbol, daily_data, start, end)
             
         except Exception as e:
             logger.error(f"Lỗi khi lấy dữ liệu lịch sử cho {symbol}: {str(e)}")
             return {"error": str(e), "symbol": symbol}
     
+    def _build_historical(self, symbol: str, daily_data: pd.DataFrame, start: str, end: str) -> Dict[str, Any]:
+        """Tạo phần historical_data từ dữ liệu giá theo ngày"""
+        # Format dữ liệu tiền tệ để đảm bảo chính xác
+        formatted_daily_data = self._format_dataframe_currency(daily_data)
+        
+        return {
+            "symbol": symbol,
+            "period": {
+                "start_date": start,
+                "end_date": end
+            },
+            "daily_data": formatted_daily_data.to_dict('records') if not formatted_daily_data.empty else [],
+            "total_trading_days": len(formatted_daily_data) if not formatted_daily_data.empty else 0,
+            "currency_unit": "VND",
+            "currency_conversion": "Stock prices converted from thousands VND to full VND (multiplied by 1000)",
+            "note": "Historical price data from vnstock - Prices in full VND units, no rounding applied"
+        }
+    
     def get_financial_data(self, symbol: str) -> Dict[str, Any]:
         """
         Lấy dữ liệu tài chính của công ty
         """
         try:
-            from vnstock import Vnstock
+            from data_store import get_financial_statement
             
-            # Khởi tạo vnstock client
-            stock = Vnstock().stock(symbol=symbol, source='VCI')
-            
-            # Thử lấy báo cáo tài chính
+            # Thử lấy báo cáo tài chính (dùng chung cache BCTC với FA)
             balance_sheet = pd.DataFrame()
             try:
-                balance_sheet = stock.finance.balance_sheet(period='quarterly', lang='vi')
+                balance_sheet = get_financial_statement(symbol, 'balance_sheet', period='quarterly', lang='vi')
             except:
                 pass
             
@@ -228,11 +240,26 @@ class VNStockDataCollector:
             logger.error(f"Lỗi khi lấy dữ liệu thị trường cho {symbol}: {str(e)}")
             return {"error": str(e), "symbol": symbol}
     
-    def get_complete_stock_data(self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, Any]:
+    def get_complete_stock_data(self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                                sections: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Lấy toàn bộ dữ liệu của một mã cổ phiếu
+        
+        Các section độc lập được lấy song song (request lên vnstock vẫn qua
+        rate limiter), thời gian xấp xỉ section chậm nhất thay vì tổng.
+        
+        Args:
+            symbol: Mã cổ phiếu
+            start_date: Ngày bắt đầu của historical (YYYY-MM-DD)
+            end_date: Ngày kết thúc của historical (YYYY-MM-DD)
+            sections: Các phần cần lấy (overview, historical, financial, market),
+                      None = tất cả
+        
+        Raises:
+            ValueError: Section không hợp lệ
         """
-        logger.info(f"Bắt đầu thu thập dữ liệu cho mã cổ phiếu: {symbol}")
+        sections = self._normalize_sections(sections)
+        logger.info(f"Bắt đầu thu thập dữ liệu cho mã cổ phiếu: {symbol} ({', '.join(sections)})")
         
         # Chuẩn hóa mã cổ phiếu
         symbol = symbol.upper().strip()
@@ -242,23 +269,28 @@ class VNStockDataCollector:
                 "symbol": symbol,
                 "start_date": start_date or self.start_date,
                 "end_date": end_date or self.end_date,
+                "sections": sections,
                 "collection_timestamp": datetime.now().isoformat(),
                 "data_source": "vnstock"
             }
         }
         
-        # Thu thập từng loại dữ liệu
-        logger.info("Thu thập thông tin tổng quan...")
-        complete_data["overview"] = self.get_stock_overview(symbol)
-        
-        logger.info("Thu thập dữ liệu lịch sử...")
-        complete_data["historical_data"] = self.get_historical_data(symbol, start_date, end_date)
+        fetchers = {
+            'overview': lambda: self.get_stock_overview(symbol),
+            'historical': lambda: self.get_historical_data(symbol, start_date, end_date),
+            'financial': lambda: self.get_financial_data(symbol),
+            'market': lambda: self.get_market_data(symbol),
+        }
         
-        logger.info("Thu thập dữ liệu tài chính...")
-        complete_data["financial_data"] = self.get_financial_data(symbol)
+        # Thu thập các section song song
+        outcomes = run_scan(sections, lambda section: fetchers[section](), max_workers=len(sections))
         
-        logger.info("Thu thập dữ liệu thị trường...")
-        complete_data["market_data"] = self.get_market_data(symbol)
+        for outcome in outcomes:
+            section = outcome['symbol']
+            complete_data[DATA_SECTIONS[section]] = (
+                outcome['result'] if not outcome['error'] else {"error": outcome['error'], "symbol": symbol}
+            )
+            logger.info(f"Đã thu thập {section} cho {symbol} ({outcome['elapsed']}s)")
         
         # Thêm metadata cho AI analysis
         complete_data["ai_analysis_metadata"] = {
@@ -277,13 +309,149 @@ class VNStockDataCollector:
         logger.info(f"Hoàn thành thu thập dữ liệu cho {symbol}")
         return complete_data
     
+    def get_batch_stock_data(self, symbols: List[str], sections: Optional[List[str]] = None,
+                             start_date: Optional[str] = None, end_date: Optional[str] = None,
+                             max_workers: int = DEFAULT_MAX_WORKERS,
+                             timeout: Optional[float] = DEFAULT_SYMBOL_TIMEOUT) -> Dict[str, Any]:
+        """
+        Lấy dữ liệu nhiều mã song song
+        
+        Mã trùng chỉ lấy một lần. Overview và historical dùng chung một lần đọc
+        giá từ price store cục bộ (chỉ tải phần còn thiếu, qua rate limiter).
+        
+        Args:
+            symbols: Danh sách mã (tối đa MAX_BATCH_SYMBOLS)
+            sections: Các phần cần lấy (overview, historical, financial, market),
+                      None = tất cả
+            start_date: Ngày bắt đầu của historical (YYYY-MM-DD)
+            end_date: Ngày kết thúc của historical (YYYY-MM-DD)
+            max_workers: Số mã lấy song song
+            timeout: Thời gian tối đa cho một mã (giây)
+        
+        Returns:
+            Dict gồm request_info, results (mã -> các phần), errors
+            (mã -> phần -> lỗi) và summary
+        
+        Raises:
+            ValueError: Danh sách mã / section không hợp lệ
+        """
+        sections = self._normalize_sections(sections)
+        
+        # Chuẩn hóa và bỏ mã trùng, giữ thứ tự
+        unique_symbols = list(dict.fromkeys(s.upper().strip() for s in symbols if s and s.strip()))
+        if not unique_symbols:
+            raise ValueError("Danh sách mã cổ phiếu trống")
+        if len(unique_symbols) > MAX_BATCH_SYMBOLS:
+            raise ValueError(f"Tối đa {MAX_BATCH_SYMBOLS} mã mỗi batch (nhận {len(unique_symbols)})")
+        
+        start = start_date or self.start_date
+        end = end_date or datetime.now().strftime("%Y-%m-%d")
+        started = datetime.now()
+        logger.info(f"Batch {len(unique_symbols)} mã, sections={sections}")
+        
+        outcomes = run_scan(unique_symbols,
+                            lambda symbol: self._collect_sections(symbol, sections, start, end),
+                            max_workers=max_workers, timeout=timeout)
+        
+        results: Dict[str, Dict[str, Any]] = {}
+        errors: Dict[str, Dict[str, str]] = {}
+        
+        for outcome in outcomes:
+            symbol = outcome['symbol']
+            if outcome['error']:
+                errors[symbol] = {section: outcome['error'] for section in sections}
+                continue
+            
+            results[symbol] = outcome['result']
+            section_errors = {
+                section: outcome['result'][DATA_SECTIONS[section]]['error']
+                for section in sections
+                if 'error' in outcome['result'][DATA_SECTIONS[section]]
+            }
+            if section_errors:
+                errors[symbol] = section_errors
+        
+        return {
+            "request_info": {
+                "symbols": unique_symbols,
+                "sections": sections,
+                "start_date": start,
+                "end_date": end,
+                "collection_timestamp": datetime.now().isoformat(),
+                "data_source": "vnstock"
+            },
+            "results": results,
+            "errors": errors,
+            "summary": {
+                "requested": len(unique_symbols),
+                "succeeded": len([s for s in unique_symbols if s not in errors]),
+                "failed": len(errors),
+                "elapsed_seconds": round((datetime.now() - started).total_seconds(), 2)
+            }
+        }
+    
+    def _normalize_sections(self, sections: Optional[List[str]]) -> List[str]:
+        """Kiểm tra danh sách section (None = tất cả)"""
+        if not sections:
+            return list(DATA_SECTIONS)
+        
+        sections = list(dict.fromkeys(s.strip().lower() for s in sections if s and s.strip()))
+        unknown = [s for s in sections if s not in DATA_SECTIONS]
+        if unknown:
+            raise ValueError(f"Section không hỗ trợ: {', '.join(unknown)} (hỗ trợ: {', '.join(DATA_SECTIONS)})")
+        return sections
+    
+    def _collect_sections(self, symbol: str, sections: List[str], start: str, end: str) -> Dict[str, Any]:
+        """Lấy các section của một mã (overview + historical dùng chung một lần đọc giá)"""
+        result: Dict[str, Any] = {}
+        
+        if 'overview' in sections or 'historical' in sections:
+            today = datetime.now()
+            overview_start = (today - timedelta(days=OVERVIEW_DAYS)).strftime("%Y-%m-%d")
+            fetch_start = start if 'historical' in sections else overview_start
+            fetch_end = end if 'historical' in sections else today.strftime("%Y-%m-%d")
+            if 'overview' in sections:
+                fetch_start = min(fetch_start, overview_start)
+                fetch_end = max(fetch_end, today.strftime("%Y-%m-%d"))
+            
+            try:
+                from data_store import get_price_history
+                
+                prices = get_price_history(symbol, start_date=fetch_start, end_date=fetch_end)
+                dates = pd.to_datetime(prices['time'])
+                
+                if 'overview' in sections:
+                    result['overview'] = self._build_overview(
+                        symbol, prices[dates >= overview_start].reset_index(drop=True))
+                if 'historical' in sections:
+                    result['historical_data'] = self._build_historical(
+                        symbol, prices[(dates >= start) & (dates <= end)].reset_index(drop=True), start, end)
+            except (Exception, SystemExit) as e:
+                # SystemExit: vnstock rate limit
+                logger.error(f"Lỗi khi lấy dữ liệu giá cho {symbol}: {str(e)}")
+                for section in ('overview', 'historical'):
+                    if section in sections:
+                        result[DATA_SECTIONS[section]] = {"error": str(e) or type(e).__name__, "symbol": symbol}
+        
+        if 'financial' in sections:
+            result['financial_data'] = self.get_financial_data(symbol)
+        
+        if 'market' in sections:
+            result['market_data'] = self.get_market_data(symbol)
+        
+        return result
+    
     def _check_data_completeness(self, data: Dict[str, Any]) -> Dict[str, bool]:
-        """Kiểm tra tính đầy đủ của dữ liệu"""
+        """Kiểm tra tính đầy đủ của dữ liệu (chỉ các section đã yêu cầu)"""
+        checks = {
+            "has_overview": lambda: "error" not in data["overview"],
+            "has_historical_data": lambda: len(data["historical_data"].get("daily_data", [])) > 0,
+            "has_financial_data": lambda: "error" not in data["financial_data"],
+            "has_market_data": lambda: "error" not in data["market_data"]
+        }
         completeness = {
-            "has_overview": "error" not in data.get("overview", {}),
-            "has_historical_data": len(data.get("historical_data", {}).get("daily_data", [])) > 0,
-            "has_financial_data": "error" not in data.get("financial_data", {}),
-            "has_market_data": "error" not in data.get("market_data", {})
+            name: check() for name, check in checks.items()
+            if name.replace("has_", "") in data
         }
         completeness["overall_complete"] = all(completeness.values())
         return completeness